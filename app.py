@@ -1,14 +1,25 @@
 import streamlit as st
 import os
-from dotenv import load_dotenv
-from services.email_processor import EmailProcessor
-from services.prompt_manager import PromptManager
-from services.draft_manager import DraftManager
-from services.llm_service import LLMService
-from utils.helpers import format_timestamp
+import json
+from datetime import datetime
+from services.metrics import metrics
+from services.worker import JOB_TYPES, Worker
+from utils.helpers import format_timestamp, load_env
+from models.analysis import CATEGORIES
+
+# Inbox sort options: (SORT_KEYS field, descending); without a field search results
+# are ranked by relevance and everything else is in inbox order
+SORT_OPTIONS = {
+    "Default": (None, False),
+    "Newest first": ("date", True),
+    "Oldest first": ("date", False),
+    "Sender": ("sender", False),
+    "Subject": ("subject", False),
+}
+PAGE_SIZES = [25, 50, 100]
 
 # Load environment variables
-load_dotenv()
+load_env()
 
 # Page Config
 st.set_page_config(
@@ -17,29 +28,107 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize Services
-def get_services():
-    return {
-        "email_processor": EmailProcessor(),
-        "prompt_manager": PromptManager(),
-        "draft_manager": DraftManager(),
-        "llm_service": LLMService()
-    }
+@st.cache_resource
+def start_metrics_exporters():
+    metrics.start_exporters_from_env()
+
+start_metrics_exporters()
+
+# Each service is created on first use, once per process; every session and rerun shares it.
+# Modules are imported here too, so a page never pays for services it does not show.
+@st.cache_resource
+def get_service(name):
+    if name == "llm_service":
+        from services.llm_service import LLMService
+        return LLMService()
+    if name == "prompt_manager":
+        from services.prompt_manager import PromptManager
+        return PromptManager()
+    if name == "draft_manager":
+        from services.draft_manager import DraftManager
+        return DraftManager()
+    if name == "email_processor":
+        from services.email_processor import EmailProcessor
+        return EmailProcessor(llm_service=get_service("llm_service"), prompt_manager=get_service("prompt_manager"))
+    if name == "context_retriever":
+        from services.context_retriever import ContextRetriever
+        return ContextRetriever(get_service("email_processor"))
+    if name == "job_queue":
+        from services.job_queue import JobQueue
+        job_queue = JobQueue()
+        # Run queued jobs inside the server process unless a separate `python worker.py` does it
+        if os.getenv("JOB_WORKER", "embedded").lower() == "embedded":
+            Worker(job_queue, get_service("email_processor"), get_service("draft_manager")).start()
+        return job_queue
+    raise KeyError(name)
+
+class Services:
+    """
+    Services by name for the current script run. A page only creates the services
+    it uses, and each is refreshed once per run to pick up changes made by other
+    sessions or processes (a cheap mtime/version check).
+    """
+
+    def __init__(self):
+        self._refreshed = set()
 
-services = get_services()
+    def __getitem__(self, name):
+        service = get_service(name)
+        if name not in self._refreshed:
+            self._refreshed.add(name)
+            if hasattr(service, "refresh"):
+                service.refresh()
+        return service
+
+services = Services()
 
 # Sidebar Navigation
 st.sidebar.title("📧 Email Agent")
 page = st.sidebar.radio(
     "Navigate",
-    ["Inbox", "Prompt Brain", "Email Agent", "Drafts"]
+    ["Inbox", "Prompt Brain", "Email Agent", "Drafts", "Diagnostics"]
 )
 
 # API Key Check
-if not os.getenv("GEMINI_API_KEY"):
+if os.getenv("LLM_BACKEND", "gemini").lower() == "gemini" and not os.getenv("GEMINI_API_KEY"):
     st.error("⚠️ GEMINI_API_KEY not found in environment variables. Please configure it in .env file.")
     st.stop()
 
+@st.fragment(run_every=2)
+def render_jobs():
+    """Poll active background jobs; rerun the page when one makes progress so new results show up."""
+    jobs = services["job_queue"].list_jobs(limit=5, active_only=True)
+    seen = st.session_state.setdefault("job_progress", {})
+    changed = False
+    for job in jobs:
+        label = JOB_TYPES.get(job.type, job.type)
+        if job.status == "queued":
+            st.caption(f"⏳ {label}: queued")
+        elif job.progress_total:
+            st.progress(job.progress_done / job.progress_total,
+                        text=f"{label}: {job.progress_done}/{job.progress_total}")
+        else:
+            st.caption(f"⚙️ {label}: starting...")
+        if seen.get(job.id) != job.progress_done:
+            changed = changed or job.id in seen
+            seen[job.id] = job.progress_done
+
+    # A job we were watching has finished
+    for job_id in [j for j in seen if j not in {job.id for job in jobs}]:
+        del seen[job_id]
+        job = services["job_queue"].get(job_id)
+        if job and job.status == "failed":
+            st.session_state["job_notice"] = ("error", f"{JOB_TYPES.get(job.type, job.type)} failed: {job.error}")
+        elif job and job.result and job.result.get("remaining"):
+            st.session_state["job_notice"] = ("warning", f"Processed {job.result['processed']} emails; "
+                                              f"{job.result['remaining']} failed and stay queued. Try again later.")
+        elif job and job.result:
+            st.session_state["job_notice"] = ("success", f"{JOB_TYPES.get(job.type, job.type)}: done")
+        changed = True
+
+    if changed:
+        st.rerun()
+
 def render_inbox():
     st.title("📥 Inbox")
     
@@ -48,56 +137,156 @@ def render_inbox():
         st.write("Manage and process your emails.")
     with col2:
         if st.button("⚡ Process Inbox", type="primary"):
-            with st.spinner("Processing emails..."):
-                count = services["email_processor"].process_inbox()
-                st.success(f"Processed {count} emails!")
-                st.rerun()
+            # Runs in the background worker; progress is polled below
+            services["job_queue"].enqueue("process_inbox")
+
+    if "job_notice" in st.session_state:
+        kind, message = st.session_state.pop("job_notice")
+        getattr(st, kind)(message)
+    render_jobs()
 
     # Filter
-    filter_category = st.selectbox(
-        "Filter by Category",
-        ["All", "Important", "To-Do", "Newsletter", "Spam", "Project", "Personal", "Uncategorized"]
+    c1, c2, c3 = st.columns([2, 2, 1])
+    with c1:
+        filter_category = st.selectbox(
+            "Filter by Category",
+            ["All"] + CATEGORIES + ["Uncategorized"]
+        )
+    with c2:
+        sort = st.selectbox("Sort", list(SORT_OPTIONS))
+    with c3:
+        page_size = st.selectbox("Per page", PAGE_SIZES)
+
+    search_query = st.text_input(
+        "Search",
+        placeholder='e.g. report from:boss@company.com category:to-do "project kickoff"'
     )
 
-    emails = services["email_processor"].emails
-    
-    # Apply Filter
-    if filter_category != "All":
-        if filter_category == "Uncategorized":
-            emails = [e for e in emails if not e.category]
-        else:
-            emails = [e for e in emails if e.category == filter_category]
+    # Filtering, sorting and paging happen in the email processor; only this page's headers are read
+    filters = {}
+    if filter_category == "Uncategorized":
+        filters["category"] = None
+    elif filter_category != "All":
+        filters["category"] = filter_category
+    view = (filter_category, sort, page_size, search_query)
+    if st.session_state.get("inbox_view") != view:
+        st.session_state["inbox_view"] = view
+        st.session_state["inbox_page"] = 1
+    sort_field, descending = SORT_OPTIONS[sort]
+    offset = (st.session_state["inbox_page"] - 1) * page_size
+    headers, total = services["email_processor"].page_headers(
+        query=search_query or None, sort=sort_field, descending=descending,
+        offset=offset, limit=page_size, **filters
+    )
+    if total and offset >= total:
+        st.session_state["inbox_page"] = 1
+        st.rerun()
 
-    # Display Emails
-    for email in emails:
-        with st.expander(f"{'🔴 ' if not email.processed else ''}{email.sender} - {email.subject}"):
-            c1, c2 = st.columns([3, 1])
-            with c1:
-                st.markdown(f"**Date:** {format_timestamp(email.timestamp)}")
-                st.markdown(f"**Category:** {email.category or 'Uncategorized'}")
-                st.markdown("---")
-                st.write(email.body)
-                
-                if email.action_items:
-                    st.markdown("### 📋 Action Items")
-                    for item in email.action_items:
-                        st.info(f"**Task:** {item.get('task')}\n\n**Deadline:** {item.get('deadline') or 'None'}")
-            
-            with c2:
-                if st.button("Summarize", key=f"sum_{email.id}"):
-                    prompt = services["prompt_manager"].get_prompt("summarization")
-                    if prompt:
-                        with st.spinner("Summarizing..."):
-                            summary = services["llm_service"].generate_response(
-                                prompt.template, 
-                                f"Email Body:\n{email.body}"
-                            )
-                            st.write(summary)
-                
-                if st.button("Draft Reply", key=f"reply_{email.id}"):
-                    # Set session state to navigate to drafts or open modal
-                    st.session_state['reply_email'] = email
-                    st.toast("Go to 'Drafts' or 'Email Agent' to finalize.")
+    # Display Emails; an email's body is read only while its expander is open
+    for header in headers:
+        label = f"{'🔴 ' if not header.processed else ''}{header.sender} - {header.subject}"
+        expander = st.expander(label, key=f"email_{header.id}", on_change="rerun")
+        if expander.open:
+            with expander:
+                render_email(header.id, header.version)
+
+    render_pager(total, page_size)
+
+def render_pager(total, page_size):
+    """Previous/next controls for the inbox list."""
+    pages = max(1, -(-total // page_size))
+    current = st.session_state["inbox_page"]
+    c1, c2, c3 = st.columns([1, 3, 1])
+    with c1:
+        if st.button("← Previous", disabled=current <= 1):
+            st.session_state["inbox_page"] = current - 1
+            st.rerun()
+    with c2:
+        first = (current - 1) * page_size + 1 if total else 0
+        st.caption(f"Page {current} of {pages} · emails {first}–{min(current * page_size, total)} of {total}")
+    with c3:
+        if st.button("Next →", disabled=current >= pages):
+            st.session_state["inbox_page"] = current + 1
+            st.rerun()
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def email_view(email_id, version):
+    """
+    What the Inbox shows for one email, cached per email version so reopening an
+    unchanged email does not read its body or recompute anything.
+    """
+    email = services["email_processor"].get_email(email_id)
+    if email is None:
+        return None
+    compaction = services["email_processor"].compaction(email)
+    return {
+        "date": format_timestamp(email.timestamp),
+        "category": email.category or "Uncategorized",
+        "summary": email.summary,
+        "body": email.body,
+        "action_items": email.action_items or [],
+        "compaction": (compaction.tokens, compaction.raw_tokens),
+    }
+
+@st.fragment
+def render_email(email_id, version):
+    """One opened email; its buttons rerun only this fragment."""
+    view = email_view(email_id, version)
+    if view is None:
+        return
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        st.markdown(f"**Date:** {view['date']}")
+        st.markdown(f"**Category:** {view['category']}")
+        if view["summary"]:
+            st.markdown(f"**Summary:** {view['summary']}")
+        st.markdown("---")
+        st.write(view["body"])
+        tokens, raw_tokens = view["compaction"]
+        if tokens < raw_tokens:
+            st.caption(f"Sent to the LLM as ~{tokens} of {raw_tokens} tokens "
+                       f"({1 - tokens / raw_tokens:.0%} saved by compaction)")
+
+        if view["action_items"]:
+            st.markdown("### 📋 Action Items")
+            for item in view["action_items"]:
+                st.info(f"**Task:** {item.get('task')}\n\n**Deadline:** {item.get('deadline') or 'None'}")
+        live = st.empty()
+
+    with c2:
+        header = services["email_processor"].get_header(email_id)
+        stale = services["email_processor"].stale_fields(header) if header else set()
+        if st.button("Analyze", key=f"analyze_{email_id}", disabled=not stale - {"summary"}):
+            # Show the category and action items as the reply streams in
+            for partial in services["email_processor"].process_email_stream(email_id):
+                if not isinstance(partial, dict):
+                    continue
+                with live.container():
+                    if isinstance(partial.get("category"), str):
+                        st.markdown(f"**Category:** {partial['category']}")
+                    for item in partial.get("tasks") or []:
+                        if isinstance(item, dict) and item.get("task"):
+                            st.info(f"**Task:** {item['task']}\n\n**Deadline:** {item.get('deadline') or 'None'}")
+            st.rerun()
+
+        summary_fresh = header and view["summary"] and "summary" not in stale
+        if st.button("Summarize", key=f"sum_{email_id}", disabled=bool(summary_fresh)):
+            prompt = services["prompt_manager"].get_prompt("summarization")
+            email = services["email_processor"].get_email(email_id)
+            if prompt and email:
+                summary = st.write_stream(services["llm_service"].generate_response_stream(
+                    prompt.template,
+                    f"Email Body:\n{services['email_processor'].prompt_body(email, 'summarization')}",
+                    prompt_key="summarization"
+                ))
+                if summary and not summary.startswith("Error"):
+                    services["email_processor"].record_summary(email, summary)
+                    st.rerun()
+
+        if st.button("Draft Reply", key=f"reply_{email_id}"):
+            # Set session state to navigate to drafts or open modal
+            st.session_state['reply_email'] = services["email_processor"].get_email(email_id)
+            st.toast("Go to 'Drafts' or 'Email Agent' to finalize.")
 
 
 def render_prompt_brain():
@@ -115,6 +304,12 @@ def render_prompt_brain():
     for i, (key, prompt) in enumerate(prompts.items()):
         with tabs[i]:
             st.markdown(f"**Description:** {prompt.description}")
+            caption = f"Version: {prompt.version}"
+            if prompt.output_fields:
+                caption += f" · Fills: {', '.join(prompt.output_fields)}"
+            if prompt.body_tokens:
+                caption += f" · Email body budget: {prompt.body_tokens} tokens"
+            st.caption(caption)
             new_template = st.text_area(
                 "Template",
                 value=prompt.template,
@@ -126,6 +321,15 @@ def render_prompt_brain():
                 services["prompt_manager"].update_prompt(key, new_template)
                 st.success("Prompt updated successfully!")
 
+    # Outputs produced by an older prompt version (or from an edited email body)
+    stale = services["email_processor"].get_stale_emails()
+    if stale:
+        st.markdown("---")
+        st.warning(f"{len(stale)} processed emails have outputs from an older prompt version.")
+        if st.button("🔁 Reprocess Stale Outputs"):
+            services["job_queue"].enqueue("reprocess")
+            st.success("Reprocessing queued. Progress is shown on the Inbox page.")
+
 def render_email_agent():
     st.title("🤖 Email Agent")
     st.write("Chat with your inbox.")
@@ -145,19 +349,9 @@ def render_email_agent():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                # Build context from inbox
-                emails = services["email_processor"].emails
-                
-                # Create a summary of the inbox for context
-                inbox_summary = "Here is the current inbox:\n\n"
-                for email in emails:
-                    inbox_summary += f"- From: {email.sender}\n"
-                    inbox_summary += f"  Subject: {email.subject}\n"
-                    inbox_summary += f"  Category: {email.category or 'Uncategorized'}\n"
-                    if email.action_items:
-                        inbox_summary += f"  Action Items: {len(email.action_items)} tasks\n"
-                    inbox_summary += f"  Preview: {email.body[:100]}...\n\n"
+            with st.spinner("Searching inbox..."):
+                # Retrieve the relevant slice of the inbox within the token budget
+                inbox_summary = services["context_retriever"].build_context(prompt)
                 
                 # Construct the prompt
                 system_prompt = f"""You are a helpful email assistant. Answer the user's question based on their inbox.
@@ -167,10 +361,10 @@ def render_email_agent():
 User Question: {prompt}
 
 Provide a helpful, concise answer based on the inbox data above."""
-                
-                response = services["llm_service"].generate_response(system_prompt)
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+
+            # Render the answer as it streams in
+            response = st.write_stream(services["llm_service"].generate_response_stream(system_prompt, prompt_key="chat"))
+            st.session_state.messages.append({"role": "assistant", "content": response})
 
 def render_drafts():
     st.title("📝 Drafts")
@@ -190,26 +384,25 @@ def render_drafts():
             if st.button("Generate Draft", type="primary"):
                 prompt = services["prompt_manager"].get_prompt("auto_reply")
                 if prompt:
-                    with st.spinner("Generating..."):
-                        # Construct context
-                        context_vars = {
-                            "user_instructions": f"{instructions}. Tone: {tone}",
-                            "sender": email.sender,
-                            "subject": email.subject,
-                            "body": email.body
-                        }
-                        filled_template = prompt.template.format(**context_vars)
-                        
-                        draft_body = services["llm_service"].generate_response(filled_template)
-                        
-                        services["draft_manager"].create_draft(
-                            subject=f"Re: {email.subject}",
-                            body=draft_body,
-                            email_id=email.id
-                        )
-                        del st.session_state['reply_email']
-                        st.success("✅ Draft created!")
-                        st.rerun()
+                    # Construct context
+                    context_vars = {
+                        "user_instructions": f"{instructions}. Tone: {tone}",
+                        "sender": email.sender,
+                        "subject": email.subject,
+                        "body": services["email_processor"].prompt_body(email, "auto_reply")
+                    }
+                    filled_template = prompt.template.format(**context_vars)
+                    
+                    draft_body = st.write_stream(services["llm_service"].generate_response_stream(filled_template, prompt_key="auto_reply"))
+                    
+                    services["draft_manager"].create_draft(
+                        subject=f"Re: {email.subject}",
+                        body=draft_body,
+                        email_id=email.id
+                    )
+                    del st.session_state['reply_email']
+                    st.success("✅ Draft created!")
+                    st.rerun()
         else:
             st.write("Select an email from the Inbox and click 'Draft Reply', or create a new draft below:")
             
@@ -219,19 +412,39 @@ def render_drafts():
             
             if st.button("Generate New Draft", type="primary"):
                 if new_subject and new_instructions:
-                    with st.spinner("Generating..."):
-                        prompt_text = f"Write a professional email with the following subject and content:\n\nSubject: {new_subject}\n\nContent: {new_instructions}\n\nWrite only the email body, no subject line."
-                        draft_body = services["llm_service"].generate_response(prompt_text)
-                        
-                        services["draft_manager"].create_draft(
-                            subject=new_subject,
-                            body=draft_body
-                        )
-                        st.success("✅ Draft created!")
-                        st.rerun()
+                    prompt_text = f"Write a professional email with the following subject and content:\n\nSubject: {new_subject}\n\nContent: {new_instructions}\n\nWrite only the email body, no subject line."
+                    draft_body = st.write_stream(services["llm_service"].generate_response_stream(prompt_text, prompt_key="compose"))
+                    
+                    services["draft_manager"].create_draft(
+                        subject=new_subject,
+                        body=draft_body
+                    )
+                    st.success("✅ Draft created!")
+                    st.rerun()
                 else:
                     st.warning("Please fill in both subject and instructions.")
 
+    # Section 2: Draft replies for whole categories in the background
+    with st.expander("📨 Bulk Reply"):
+        categories = [c for c in services["email_processor"].count_by_category() if c]
+        selected = st.multiselect("Draft replies for", sorted(categories),
+                                  default=[c for c in ("To-Do", "Important") if c in categories])
+        col1, col2 = st.columns(2)
+        with col1:
+            bulk_instructions = st.text_area("Instructions for replies", "Polite and professional.",
+                                             key="bulk_instructions")
+        with col2:
+            bulk_tone = st.selectbox("Tone", ["Professional", "Casual", "Urgent"], key="bulk_tone")
+        st.caption("Emails that already have a draft are skipped.")
+        if st.button("Draft Replies", disabled=not selected):
+            services["job_queue"].enqueue("draft_replies", {
+                "categories": selected, "instructions": bulk_instructions, "tone": bulk_tone
+            })
+    if "job_notice" in st.session_state:
+        kind, message = st.session_state.pop("job_notice")
+        getattr(st, kind)(message)
+    render_jobs()
+
     st.markdown("---")
     st.markdown("### 📋 Saved Drafts")
     
@@ -259,6 +472,152 @@ def render_drafts():
                     services["draft_manager"].delete_draft(draft.id)
                     st.rerun()
 
+def render_diagnostics():
+    st.title("🩺 Diagnostics")
+    st.write("Latency, token usage and storage I/O recorded since the app started.")
+
+    snapshot = metrics.snapshot()
+    counters = snapshot["counters"]
+
+    def fmt_ms(seconds):
+        return round(seconds * 1000, 1) if seconds is not None else None
+
+    st.markdown("### 🤖 LLM Calls")
+    requests_by_key = {}
+    for c in counters:
+        if c["name"] == "llm_requests_total":
+            row = requests_by_key.setdefault(c["labels"].get("prompt_key"), {"hits": 0, "calls": 0, "errors": 0})
+            row["calls"] += c["value"]
+            if c["labels"].get("cache") == "hit":
+                row["hits"] += c["value"]
+            if c["labels"].get("status") == "error":
+                row["errors"] += c["value"]
+    tokens = {}
+    for c in counters:
+        if c["name"] in ("llm_prompt_tokens_total", "llm_response_tokens_total"):
+            tokens.setdefault(c["labels"].get("prompt_key"), {})[c["name"]] = c["value"]
+        elif c["name"] == "llm_body_tokens_total":
+            tokens.setdefault(c["labels"].get("prompt_key"), {})[f"body_{c['labels'].get('stage')}"] = c["value"]
+        elif c["name"] == "llm_json_repairs_total":
+            tokens.setdefault(c["labels"].get("prompt_key"), {})[f"repair_{c['labels'].get('outcome')}"] = c["value"]
+    latency = {h["labels"].get("prompt_key"): h for h in snapshot["histograms"] if h["name"] == "llm_request_seconds"}
+
+    llm_rows = []
+    for key, row in sorted(requests_by_key.items()):
+        hist = latency.get(key, {})
+        llm_rows.append({
+            "prompt": key,
+            "calls": row["calls"],
+            "cache hits": row["hits"],
+            "errors": row["errors"],
+            "p50 ms": fmt_ms(hist.get("p50")),
+            "p95 ms": fmt_ms(hist.get("p95")),
+            "p99 ms": fmt_ms(hist.get("p99")),
+            "prompt tokens": tokens.get(key, {}).get("llm_prompt_tokens_total", 0),
+            "response tokens": tokens.get(key, {}).get("llm_response_tokens_total", 0),
+            "body tokens saved": tokens.get(key, {}).get("body_raw", 0) - tokens.get(key, {}).get("body_sent", 0),
+            "JSON repaired": tokens.get(key, {}).get("repair_fixed", 0),
+            "JSON unusable": tokens.get(key, {}).get("repair_failed", 0),
+        })
+    if llm_rows:
+        st.dataframe(llm_rows)
+    else:
+        st.info("No LLM calls recorded yet.")
+
+    cache_stats = services["llm_service"].cache.stats() if services["llm_service"].cache else None
+    if cache_stats:
+        st.caption(f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                   f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['memory_entries']} entries in memory")
+    controller = services["llm_service"].controller.stats()
+    st.caption(f"Call controller: circuit {controller['state']}, concurrency limit {controller['limit']}, "
+               f"{controller['in_flight']} in flight, {controller['trips']} breaker trips")
+
+    classifier = services["email_processor"].classifier
+    if classifier:
+        st.markdown("### ⚡ Local Classifier")
+        stats = classifier.stats()
+
+        def agreement(rate, compared):
+            return f"{rate:.0%} of {compared}" if rate is not None else "n/a"
+
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("LLM calls skipped", stats["skipped"], f"{stats['skip_rate']:.0%} of decisions", delta_color="off")
+        c2.metric("Sent to LLM", stats["deferred"] + stats["audited"])
+        c3.metric("Agreement (confident)", agreement(stats["confident_agreement"], stats["confident_compared"]))
+        c4.metric("Agreement (unsure)", agreement(stats["unsure_agreement"], stats["unsure_compared"]))
+        st.caption(f"Trained on {stats['trained']} LLM-categorized emails. {stats['accepted']} confident labels "
+                   f"were used; those outside newsletters and spam still had their action items extracted. "
+                   f"Confident predictions are audited against the LLM {classifier.audit_rate:.0%} of the time.")
+
+    email_processor = services["email_processor"]
+    if email_processor.use_grouping:
+        st.markdown("### 🧵 Threads & Duplicates")
+        headers = [h for h in email_processor.headers if h.thread_id]
+        propagated = {c["labels"].get("kind"): c["value"] for c in counters
+                      if c["name"] == "email_group_propagations_total"}
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Replies in threads", sum(1 for h in headers if h.thread_id != h.id))
+        c2.metric("Near-duplicates", sum(1 for h in headers if h.cluster_id != h.id))
+        c3.metric("Copied from duplicates", propagated.get("duplicate", 0))
+        c4.metric("Taken from threads", propagated.get("thread", 0))
+        st.caption("Near-duplicates reuse their cluster representative's results; thread replies reuse the "
+                   "thread's category and only their new lines are sent to the LLM.")
+
+    st.markdown("### 💾 Storage I/O")
+    io_bytes = {}
+    for c in counters:
+        if c["name"] == "storage_bytes_total":
+            io_bytes[(c["labels"].get("operation"), c["labels"].get("collection"))] = c["value"]
+    io_rows = []
+    for h in snapshot["histograms"]:
+        if h["name"] != "storage_seconds":
+            continue
+        op, collection = h["labels"].get("operation"), h["labels"].get("collection")
+        io_rows.append({
+            "collection": collection,
+            "operation": op,
+            "count": h["count"],
+            "total ms": fmt_ms(h["sum"]),
+            "p50 ms": fmt_ms(h["p50"]),
+            "p99 ms": fmt_ms(h["p99"]),
+            "bytes": io_bytes.get((op, collection), 0),
+        })
+    if io_rows:
+        st.dataframe(sorted(io_rows, key=lambda r: (r["collection"], r["operation"])))
+    else:
+        st.info("No storage operations recorded yet.")
+
+    st.markdown("### 🐢 Slowest Recent Operations")
+    slowest = sorted(snapshot["events"], key=lambda e: e.get("latency") or 0, reverse=True)[:20]
+    if slowest:
+        st.dataframe([{k: v for k, v in e.items() if k != "time"} for e in slowest])
+
+    st.markdown("### 👷 Background Jobs")
+    jobs = services["job_queue"].list_jobs(limit=20)
+    if jobs:
+        st.dataframe([{
+            "job": JOB_TYPES.get(job.type, job.type),
+            "status": job.status,
+            "progress": f"{job.progress_done}/{job.progress_total}" if job.progress_total else "",
+            "attempts": job.attempts,
+            "queued": datetime.fromtimestamp(job.created_at).strftime("%Y-%m-%d %H:%M:%S"),
+            "took s": round(job.finished_at - job.started_at, 1) if job.finished_at and job.started_at else None,
+            "result": json.dumps(job.result) if job.result else job.error
+        } for job in jobs])
+    if st.button("🔎 Rebuild Search Index"):
+        services["job_queue"].enqueue("reindex")
+        st.rerun()
+
+    c1, c2, c3 = st.columns(3)
+    with c1:
+        st.download_button("⬇️ Prometheus", metrics.to_prometheus(), file_name="metrics.prom")
+    with c2:
+        st.download_button("⬇️ JSON", json.dumps(snapshot, indent=2, default=str), file_name="metrics.json")
+    with c3:
+        if st.button("Reset metrics"):
+            metrics.reset()
+            st.rerun()
+
 # Routing
 if page == "Inbox":
     render_inbox()
@@ -268,3 +627,5 @@ elif page == "Email Agent":
     render_email_agent()
 elif page == "Drafts":
     render_drafts()
+elif page == "Diagnostics":
+    render_diagnostics()
@@ -0,0 +1,89 @@
+"""
+Import-time profile of the entry points, plus Streamlit rerun overhead per page.
+
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --modules services.llm_service --top 20 --reruns
+
+Each module is imported in a fresh interpreter under `python -X importtime`,
+so the numbers are cold-start costs. The slowest imports are listed by their
+cumulative time (the module plus everything it imported first).
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+DEFAULT_MODULES = ["services.llm_service", "services.email_processor", "services.draft_manager", "worker", "app"]
+PAGES = ["Inbox", "Prompt Brain", "Email Agent", "Drafts", "Diagnostics"]
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def profile_import(module):
+    """Import `module` in a fresh interpreter; returns (wall seconds, [(self us, cumulative us, depth, name)])."""
+    env = {**os.environ, "LLM_BACKEND": os.getenv("LLM_BACKEND", "mock")}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            rows.append((int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    return elapsed, rows
+
+def _print_profile(module, elapsed, rows, top):
+    own = next((row for row in rows if row[3] == module), None)
+    total = own[1] / 1000 if own else sum(row[0] for row in rows) / 1000
+    print(f"\n{module}: {total:.1f} ms importing, {elapsed * 1000:.0f} ms interpreter wall time, {len(rows)} modules")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for self_us, cumulative_us, depth, name in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+
+def profile_reruns(runs):
+    """Time full script runs of app.py for each page; the first run also creates that page's services."""
+    os.environ.setdefault("LLM_BACKEND", "mock")
+    os.environ.setdefault("JOB_WORKER", "external")
+    from streamlit.testing.v1 import AppTest
+
+    print(f"\n{'page':>14} {'first ms':>9} {'rerun ms':>9}")
+    for page in PAGES:
+        app = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        app.run()
+        started = time.perf_counter()
+        app.sidebar.radio[0].set_value(page).run()
+        first = time.perf_counter() - started
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            app.run()
+            timings.append(time.perf_counter() - started)
+        if app.exception:
+            print(f"{page:>14} error: {app.exception[0].message}")
+            continue
+        print(f"{page:>14} {first * 1000:>9.0f} {sorted(timings)[len(timings) // 2] * 1000:>9.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile import time of the entry points and Streamlit reruns.")
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports listed per module")
+    parser.add_argument("--reruns", action="store_true", help="Also time app.py reruns on every page")
+    parser.add_argument("--runs", type=int, default=5, help="Timed reruns per page")
+    args = parser.parse_args()
+
+    for module in args.modules:
+        elapsed, rows = profile_import(module)
+        _print_profile(module, elapsed, rows, args.top)
+    if args.reruns:
+        profile_reruns(args.runs)
+
+if __name__ == "__main__":
+    main()
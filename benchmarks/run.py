@@ -0,0 +1,192 @@
+"""
+Throughput and latency benchmarks on synthetic inboxes, using the offline mock LLM.
+
+    python -m benchmarks.run --sizes 1000 10000 100000 --backend json sqlite
+
+Each (size, backend) pair runs in its own process so peak RSS is per run.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+def _bytes_written():
+    """Bytes written by this process so far (Linux), or None if unavailable."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+class _Phase:
+    """Times a phase and records bytes written during it."""
+
+    def __init__(self, results, name, items):
+        self.results = results
+        self.name = name
+        self.items = items
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.written = _bytes_written()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        written = _bytes_written()
+        self.results[self.name] = {
+            "seconds": round(elapsed, 4),
+            "items_per_sec": round(self.items / elapsed, 1) if elapsed else None,
+            "bytes_written": written - self.written if written is not None and self.written is not None else None,
+        }
+
+def run_benchmark(size, backend, process_limit, search_queries, mock_latency, workers):
+    """Run every phase for one inbox size and storage backend; returns a result dict."""
+    os.environ["STORAGE_BACKEND"] = backend
+    os.environ["LLM_CACHE"] = "false"
+    os.environ["LLM_BACKEND"] = "mock"
+
+    from benchmarks.synthetic import generate_emails, generate_queries
+    from services.email_processor import EmailProcessor
+    from services.llm_backends import MockBackend
+    from services.llm_service import LLMService
+    from services.prompt_manager import PromptManager
+
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        inbox_file = os.path.join(workdir, "inbox.json")
+        os.environ["STORAGE_DB"] = os.path.join(workdir, "app.db")
+        with open(inbox_file, "w") as f:
+            json.dump(list(generate_emails(size)), f)
+
+        results = {"size": size, "backend": backend}
+        llm_service = LLMService(backend=MockBackend(latency=mock_latency, jitter=mock_latency / 2))
+        prompt_manager = PromptManager()
+        index_file = os.path.join(workdir, "search_index.json")
+        snapshot_file = os.path.join(workdir, "email_snapshot.bin")
+
+        # Cold load: repository read and snapshot build (and JSON->SQLite migration)
+        with _Phase(results, "load_cold", size):
+            ep = EmailProcessor(inbox_file, index_file=index_file, llm_service=llm_service, prompt_manager=prompt_manager,
+                                snapshot_file=snapshot_file)
+
+        # Warm load: memory-mapped snapshot and, for SQLite, an already-migrated database
+        with _Phase(results, "load_warm", size):
+            ep = EmailProcessor(inbox_file, index_file=index_file, llm_service=llm_service, prompt_manager=prompt_manager,
+                                snapshot_file=snapshot_file)
+
+        queries = generate_queries(search_queries)
+        latencies = []
+        with _Phase(results, "search", len(queries)):
+            for query in queries:
+                start = time.perf_counter()
+                ep.search_emails(query, limit=20)
+                latencies.append(time.perf_counter() - start)
+        results["search"]["p50_ms"] = round(_percentile(latencies, 50) * 1000, 3)
+        results["search"]["p99_ms"] = round(_percentile(latencies, 99) * 1000, 3)
+
+        with _Phase(results, "save_all", size):
+            ep.save_emails()
+
+        # Processing: time each unit of work (one email or one batch) as seen by its emails
+        to_process = ep.get_unprocessed_emails()[:process_limit]
+        email_latencies = []
+        analyze_group = ep._analyze_group
+
+        def timed_analyze_group(group, needs, deltas):
+            start = time.perf_counter()
+            result = analyze_group(group, needs, deltas)
+            email_latencies.extend([time.perf_counter() - start] * len(group))
+            return result
+
+        ep._analyze_group = timed_analyze_group
+        calls_before = llm_service.backend.calls
+        with _Phase(results, "process", len(to_process)):
+            processed = ep.process_emails(to_process, max_workers=workers)
+        results["process"]["emails"] = processed
+        results["process"]["llm_calls"] = llm_service.backend.calls - calls_before
+        results["process"]["p50_ms"] = round(_percentile(email_latencies, 50) * 1000, 1)
+        results["process"]["p99_ms"] = round(_percentile(email_latencies, 99) * 1000, 1)
+
+        results["peak_rss_mb"] = round(_peak_rss_mb(), 1)
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _worker(queue, *args):
+    try:
+        queue.put(run_benchmark(*args))
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+def _print_table(results):
+    header = f"{'size':>8} {'backend':>7} {'phase':>10} {'seconds':>9} {'items/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'written':>12}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        if "error" in result:
+            print(f"error: {result['error']}")
+            continue
+        for phase in ("load_cold", "load_warm", "search", "save_all", "process"):
+            data = result[phase]
+            written = data["bytes_written"]
+            print(f"{result['size']:>8} {result['backend']:>7} {phase:>10} {data['seconds']:>9} "
+                  f"{data['items_per_sec'] or '-':>10} {data.get('p50_ms', '-'):>8} {data.get('p99_ms', '-'):>8} "
+                  f"{written if written is not None else '-':>12}")
+        print(f"{result['size']:>8} {result['backend']:>7} {'peak RSS':>10} {result['peak_rss_mb']} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark load, save, search and processing on synthetic inboxes.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backend", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    parser.add_argument("--process-limit", type=int, default=2000, help="Emails processed per run")
+    parser.add_argument("--queries", type=int, default=200, help="Search queries per run")
+    parser.add_argument("--mock-latency", type=float, default=0.05, help="Mock LLM latency in seconds")
+    parser.add_argument("--workers", type=int, default=8, help="Processing concurrency")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in args.sizes:
+        for backend in args.backend:
+            queue = context.Queue()
+            process = context.Process(
+                target=_worker,
+                args=(queue, size, backend, args.process_limit, args.queries, args.mock_latency, args.workers)
+            )
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            print(f"finished size={size} backend={backend}", file=sys.stderr)
+
+    _print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
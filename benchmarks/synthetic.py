@@ -0,0 +1,62 @@
+import random
+from datetime import datetime, timedelta
+
+SENDERS = [
+    "boss@company.com", "colleague@company.com", "project_manager@company.com", "hr@company.com",
+    "client@bigcorp.com", "newsletter@techweekly.com", "spam@offers.com", "noreply@service.com",
+    "friend@gmail.com", "mom@family.com", "security@company.com", "marketing@company.com",
+]
+SUBJECTS = [
+    "Urgent: {topic} due {day}", "Meeting request: {topic}", "Weekly digest: {topic}",
+    "You won a {prize}!", "Re: {topic}", "Update on {topic}", "Lunch {day}?", "Reminder: {topic}",
+]
+TOPICS = ["Q4 report", "project kickoff", "budget review", "UI mocks", "security training",
+          "team offsite", "client proposal", "release plan", "hiring update", "logo assets"]
+DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "tomorrow", "next week"]
+PRIZES = ["cruise", "gift card", "new phone", "vacation"]
+SENTENCES = [
+    "Please review the attached {topic} before {day}.",
+    "Can you send me an update on the {topic} by {day}?",
+    "We should schedule a call about the {topic}.",
+    "Thanks for the quick turnaround on the {topic}.",
+    "Click here to claim your free {prize} today!",
+    "This week in tech: new releases, market updates and more.",
+    "Let me know if {day} works for you.",
+    "No action needed if you wish to continue.",
+]
+
+def generate_emails(count, seed=42, body_sentences=(1, 12)):
+    """Yield `count` synthetic email records in the mock inbox format."""
+    rng = random.Random(seed)
+    start = datetime(2023, 1, 1, 8, 0)
+    for i in range(count):
+        words = {"topic": rng.choice(TOPICS), "day": rng.choice(DAYS), "prize": rng.choice(PRIZES)}
+        sender = rng.choice(SENDERS)
+        sentences = [rng.choice(SENTENCES).format(**words) for _ in range(rng.randint(*body_sentences))]
+        yield {
+            "id": f"s{i:07d}",
+            "sender": sender,
+            "subject": rng.choice(SUBJECTS).format(**words),
+            "body": "Hi,\n\n" + " ".join(sentences) + f"\n\nThanks,\n{sender.split('@')[0].title()}",
+            "timestamp": (start + timedelta(minutes=7 * i)).isoformat(),
+            "category": None,
+            "action_items": None,
+            "processed": False,
+        }
+
+def generate_queries(count, seed=7):
+    """Return a mix of free-text, phrase and field-scoped search queries."""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        topic = rng.choice(TOPICS)
+        kind = rng.randint(0, 3)
+        if kind == 0:
+            queries.append(topic.split()[0])
+        elif kind == 1:
+            queries.append(f'"{topic}"')
+        elif kind == 2:
+            queries.append(f"from:{rng.choice(SENDERS)} {topic.split()[-1]}")
+        else:
+            queries.append(f"{topic} {rng.choice(DAYS)}")
+    return queries
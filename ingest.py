@@ -0,0 +1,35 @@
+import argparse
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from services.email_processor import EmailProcessor
+from services.storage import JSONRepository
+from utils.helpers import load_env
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream emails from an mbox file, Maildir or JSONL file into the inbox.")
+    parser.add_argument("source", help="Path to an mbox file, a Maildir directory or a .jsonl file")
+    parser.add_argument("--format", choices=["mbox", "maildir", "jsonl"], help="Override format detection")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Emails committed per write")
+    parser.add_argument("--process", action="store_true", help="Categorize and extract action items while ingesting")
+    args = parser.parse_args()
+    load_env()
+
+    ep = EmailProcessor()
+    if isinstance(ep.repository, JSONRepository):
+        print("Note: the JSON backend keeps the whole inbox in memory and rewrites it on every chunk; "
+              "set STORAGE_BACKEND=sqlite for large mailboxes.")
+    count = ep.ingest(
+        args.source,
+        fmt=args.format,
+        chunk_size=args.chunk_size,
+        process=args.process,
+        progress_callback=lambda n: print(f"Ingested {n} emails...")
+    )
+    print(f"✅ Ingested {count} new emails.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from functools import lru_cache
+from typing import Annotated, Any, Dict, List, Literal, Optional, Tuple, Type
+from pydantic import BaseModel, BeforeValidator, ValidationError, create_model
+
+CATEGORIES = ["Important", "To-Do", "Newsletter", "Spam", "Project", "Personal"]
+
+# Output fields a prompt can declare, mapped to the Email attribute they fill
+ANALYSIS_FIELDS = {
+    "category": "category",
+    "tasks": "action_items",
+}
+
+FIELD_SCHEMAS = {
+    "category": {"type": "string", "enum": CATEGORIES},
+    "tasks": {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "task": {"type": "string"},
+                "deadline": {"type": "string", "nullable": True},
+            },
+            "required": ["task"],
+        },
+    },
+}
+
+class Task(BaseModel):
+    task: str
+    deadline: Optional[str] = None
+
+# Python types of the output fields, for validating responses into pydantic models
+FIELD_TYPES = {
+    "category": Annotated[Literal[tuple(CATEGORIES)], BeforeValidator(lambda v: v.strip() if isinstance(v, str) else v)],
+    "tasks": List[Task],
+}
+
+def build_response_schema(fields: List[str]) -> Dict[str, Any]:
+    """Build the JSON schema for a response that fills the given output fields."""
+    known = [f for f in fields if f in FIELD_SCHEMAS]
+    return {
+        "type": "object",
+        "properties": {f: FIELD_SCHEMAS[f] for f in known},
+        "required": known,
+    }
+
+@lru_cache(maxsize=None)
+def _response_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    return create_model("AnalysisResponse", **{f: (FIELD_TYPES[f], ...) for f in fields})
+
+def build_response_model(fields: List[str]) -> Type[BaseModel]:
+    """The pydantic model a response filling the given output fields is validated into."""
+    return _response_model(tuple(f for f in fields if f in FIELD_TYPES))
+
+def validate_analysis(data: Any, fields: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Validate a structured response against the declared output fields.
+    Returns the values keyed by Email attribute, or None if any field is invalid.
+    """
+    try:
+        response = build_response_model(fields).model_validate(data)
+    except ValidationError:
+        return None
+    return {ANALYSIS_FIELDS[f]: v for f, v in response.model_dump().items() if f in ANALYSIS_FIELDS}
@@ -1,6 +1,8 @@
+import json
 from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 from datetime import datetime
+from utils.helpers import content_hash
 
 class Email(BaseModel):
     id: str
@@ -11,6 +13,64 @@ class Email(BaseModel):
     category: Optional[str] = None
     action_items: Optional[List[Dict[str, Any]]] = None
     processed: bool = False
+    message_id: Optional[str] = None
+    in_reply_to: Optional[str] = None
+    # Set at ingestion: the thread, the near-duplicate cluster (its representative's id)
+    # and the body SimHash as 16 hex digits (None if the body is too short to compare)
+    thread_id: Optional[str] = None
+    cluster_id: Optional[str] = None
+    simhash: Optional[str] = None
+    summary: Optional[str] = None
+    # Derived field -> {"prompt", "version", "body_hash"} it was produced from
+    provenance: Dict[str, Dict[str, str]] = {}
+
+    @property
+    def body_hash(self) -> str:
+        return content_hash(self.body)
 
     def to_dict(self):
         return self.model_dump()
+
+class EmailHeader:
+    """
+    Compact, slotted view of an email for list views, filtering and staleness
+    checks. Holds everything except the body, action items and summary, which
+    stay in storage until the full Email is requested.
+    """
+
+    __slots__ = ("id", "sender", "subject", "timestamp", "category", "processed", "message_id",
+                 "provenance", "thread_id", "cluster_id", "simhash", "body_hash")
+    # Stored fields read from each record; body_hash is derived from the body
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, id: str, sender: str, subject: str, timestamp: str, category: Optional[str] = None,
+                 processed: bool = False, message_id: Optional[str] = None,
+                 provenance: Optional[Dict[str, Dict[str, str]]] = None, thread_id: Optional[str] = None,
+                 cluster_id: Optional[str] = None, simhash: Optional[str] = None, body_hash: Optional[str] = None):
+        self.id = id
+        self.sender = sender
+        self.subject = subject
+        self.timestamp = timestamp
+        self.category = category
+        self.processed = bool(processed)
+        self.message_id = message_id
+        self.provenance = provenance or {}
+        self.thread_id = thread_id
+        self.cluster_id = cluster_id
+        self.simhash = simhash
+        self.body_hash = body_hash
+
+    @classmethod
+    def from_email(cls, email: Email) -> "EmailHeader":
+        return cls(email.id, email.sender, email.subject, email.timestamp, email.category, email.processed,
+                   email.message_id, email.provenance, email.thread_id, email.cluster_id, email.simhash,
+                   email.body_hash)
+
+    @property
+    def version(self) -> str:
+        """Changes whenever the body or a derived field changes; used as a cache key for rendered views."""
+        return content_hash(json.dumps([self.body_hash, self.category, self.processed, self.provenance],
+                                       sort_keys=True))
+
+    def __repr__(self):
+        return f"EmailHeader(id={self.id!r}, sender={self.sender!r}, subject={self.subject!r})"
@@ -0,0 +1,26 @@
+from pydantic import BaseModel
+from typing import Optional, Dict, Any
+
+class Job(BaseModel):
+    id: str
+    type: str
+    params: Dict[str, Any] = {}
+    status: str = "queued"  # queued, running, done, failed or cancelled
+    progress_done: int = 0
+    progress_total: int = 0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    worker: Optional[str] = None
+    # Unix timestamps
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    heartbeat_at: Optional[float] = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def to_dict(self):
+        return self.model_dump()
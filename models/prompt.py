@@ -1,9 +1,33 @@
 from pydantic import BaseModel
+from typing import Any, Dict, List, Optional, Type
+from models.analysis import build_response_model, build_response_schema
+from utils.helpers import content_hash
 
 class Prompt(BaseModel):
     name: str
     description: str
     template: str
+    output_fields: List[str] = []
+    # Token budget for the email body sent with this prompt; None uses the compactor default
+    body_tokens: Optional[int] = None
+
+    @property
+    def version(self) -> str:
+        """Content hash of everything that affects the prompt's output."""
+        key = self.template + "\0" + ",".join(self.output_fields)
+        if self.body_tokens:
+            key += f"\0{self.body_tokens}"
+        return content_hash(key)
+
+    @property
+    def response_schema(self) -> Optional[Dict[str, Any]]:
+        """JSON schema the model's reply is constrained to, for prompts that declare output fields."""
+        return build_response_schema(self.output_fields) if self.output_fields else None
+
+    @property
+    def response_model(self) -> Optional[Type[BaseModel]]:
+        """Pydantic model the reply is validated into, for prompts that declare output fields."""
+        return build_response_model(self.output_fields) if self.output_fields else None
 
     def to_dict(self):
         return self.model_dump()
@@ -0,0 +1,31 @@
+import argparse
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from services.email_processor import EmailProcessor
+from utils.helpers import load_env
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-run only the email outputs whose prompt version or email body changed since they were produced."
+    )
+    parser.add_argument("--dry-run", action="store_true", help="List the stale outputs without calling the LLM")
+    args = parser.parse_args()
+    load_env()
+
+    ep = EmailProcessor()
+    stale = ep.get_stale_emails()
+    if args.dry_run:
+        for email in stale:
+            print(f"{email.id}  {email.subject[:50]:<50}  {', '.join(sorted(ep.stale_fields(email)))}")
+        print(f"{len(stale)} emails have stale outputs.")
+        return
+
+    count = ep.reprocess_stale(progress_callback=lambda done, total: print(f"Reprocessed {done}/{total} emails..."))
+    print(f"✅ Reprocessed {count} of {len(stale)} stale emails.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from services.metrics import metrics
+from utils.helpers import content_hash, estimate_tokens, html_to_text
+
+HTML_RE = re.compile(r"<(?:html|body|div|p|br|table|td|span|font)\b[^>]*>", re.IGNORECASE)
+QUOTE_RE = re.compile(r"^\s*>")
+# Lines that start the quoted history of a reply; everything from there on is dropped.
+# An "On ... wrote:" attribution must end its line and be followed by ">"-quoted lines
+REPLY_HEADER_RE = re.compile(
+    r"^(?:On\b.{0,200}(?:\n.{0,100})?\bwrote:[ \t]*\n(?:[ \t]*\n)?[ \t]*>"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|_{10,}"
+    r"|From:\s.+\n(?:.+\n){0,3}?(?:Sent|Date):\s)",
+    re.IGNORECASE | re.MULTILINE
+)
+# A forwarded message is content to act on, so reply headers after this marker are kept
+FORWARD_RE = re.compile(r"^(?:-{2,}\s*Forwarded message\s*-{2,}|Begin forwarded message:)",
+                        re.IGNORECASE | re.MULTILINE)
+SIGNATURE_RE = re.compile(r"^(?:-- ?|Sent from my \w+.*|Get Outlook for \w+.*)$", re.IGNORECASE | re.MULTILINE)
+SIGN_OFF_RE = re.compile(
+    r"^(?:best(?: regards| wishes)?|kind regards|warm regards|regards|many thanks|thanks(?: again)?|"
+    r"thank you|cheers|sincerely|all the best)[,.!]?\s*$",
+    re.IGNORECASE
+)
+DISCLAIMER_RE = re.compile(
+    r"this (?:e-?mail|message|communication)(?: and any attachments)? (?:is|are|may (?:be|contain)) "
+    r"(?:confidential|privileged|intended)"
+    r"|intended (?:solely |only )?for the (?:use of the )?(?:addressee|recipient|individual|named)"
+    r"|if you (?:have )?received this (?:e-?mail|message|communication) (?:in error|by mistake)"
+    r"|(?:click here )?to unsubscribe|unsubscribe from (?:this|these|our)"
+    r"|you are receiving this (?:e-?mail|message|newsletter|because)",
+    re.IGNORECASE
+)
+
+Compaction = namedtuple("Compaction", "text raw_tokens tokens")
+
+class BodyCompactor:
+    """
+    Shrinks email bodies before they are sent to the LLM: HTML becomes text, and
+    quoted reply history, signatures and legal or unsubscribe footers are dropped.
+    Results are cached by body hash and shared by every prompt; each prompt then
+    truncates the compacted text to its own token budget.
+    """
+
+    CACHE_SIZE = 1024
+    # Lines after a sign-off that are still treated as a signature block
+    SIGN_OFF_LINES = 4
+    TRUNCATION_MARK = "\n[...]"
+    # Below this share of the non-quoted body kept, compaction is assumed to have cut real content
+    MIN_KEPT = 0.25
+
+    def __init__(self, default_tokens=1500, enabled=True):
+        self.default_tokens = default_tokens
+        self.enabled = enabled
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compact(self, body):
+        """Compact a body (cached by its hash). Returns a Compaction with before/after token estimates."""
+        body = body or ""
+        key = content_hash(body)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+
+        text = self._compact_text(body) if self.enabled else body
+        compaction = Compaction(text, estimate_tokens(body), estimate_tokens(text))
+        with self._lock:
+            self._cache[key] = compaction
+            while len(self._cache) > self.CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return compaction
+
+    def _compact_text(self, body):
+        text = html_to_text(body) if HTML_RE.search(body) else body
+        original = text.strip()
+
+        forward = FORWARD_RE.search(text)
+        match = REPLY_HEADER_RE.search(text, 0, forward.start() if forward else len(text))
+        if match:
+            text = text[:match.start()]
+        lines = [line for line in text.splitlines() if not QUOTE_RE.match(line)]
+
+        text = unquoted = "\n".join(lines)
+        match = SIGNATURE_RE.search(text)
+        if match:
+            text = text[:match.start()]
+        lines = text.rstrip().splitlines()
+        for i in range(max(0, len(lines) - self.SIGN_OFF_LINES - 1), len(lines)):
+            if SIGN_OFF_RE.match(lines[i].strip()):
+                lines = lines[:i]
+                break
+
+        paragraphs = re.split(r"\n\s*\n", "\n".join(lines))
+        text = "\n\n".join(p.strip() for p in paragraphs if p.strip() and not DISCLAIMER_RE.search(p))
+        text = re.sub(r"[ \t]+", " ", text).strip()
+        # A body that was nothing but quotes or footer is sent as it was
+        if not text:
+            return original
+        # Signature, sign-off and footer rules removed most of what the sender wrote: keep it all
+        unquoted = unquoted.strip()
+        if len(text) < len(unquoted) * self.MIN_KEPT:
+            return unquoted
+        return text
+
+    def truncate(self, text, max_tokens):
+        """Cut text to about `max_tokens` tokens at a line or word boundary."""
+        limit = max_tokens * 4
+        if len(text) <= limit:
+            return text
+        cut = text.rfind("\n", 0, limit)
+        if cut < limit // 2:
+            cut = text.rfind(" ", 0, limit)
+        if cut < limit // 2:
+            cut = limit
+        return text[:cut].rstrip() + self.TRUNCATION_MARK
+
+    def for_prompt(self, body, prompt_key=None, max_tokens=None):
+        """The body as sent with a prompt: compacted, then truncated to the prompt's budget."""
+        compaction = self.compact(body)
+        text = self.truncate(compaction.text, max_tokens or self.default_tokens)
+        sent = estimate_tokens(text)
+        prompt_key = prompt_key or "adhoc"
+        metrics.inc("llm_body_tokens_total", compaction.raw_tokens, prompt_key=prompt_key, stage="raw")
+        metrics.inc("llm_body_tokens_total", sent, prompt_key=prompt_key, stage="sent")
+        return text
@@ -0,0 +1,171 @@
+import random
+import threading
+import time
+from services.llm_backends import LLMBackendError, RateLimitError
+from services.metrics import metrics, record_retry
+
+class CircuitOpenError(LLMBackendError):
+    """Raised when a call gives up while the circuit breaker is open."""
+
+class CallController:
+    """
+    Retries and admission control around backend calls, shared by all threads.
+
+    - Transient failures are retried with capped exponential backoff and full
+      jitter, never sooner than the backend's retry-after hint.
+    - Concurrency adapts AIMD-style: the limit grows by 1/limit per success
+      and halves on a rate-limit error.
+    - After `failure_threshold` consecutive failures the circuit opens and
+      every caller waits out `cooldown` seconds; a single probe call then
+      decides whether it closes again.
+    """
+
+    # Several 429s from one burst only halve the limit once
+    DECREASE_INTERVAL = 1.0
+
+    def __init__(self, max_retries=4, base_delay=1.0, max_delay=60.0, max_concurrency=8,
+                 min_concurrency=1, failure_threshold=5, cooldown=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.state = "closed"  # closed, open or half_open
+        self.open_until = 0.0
+        self.consecutive_failures = 0
+        self.trips = 0
+        self._probing = False
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def is_retryable(error):
+        if isinstance(error, LLMBackendError):
+            return error.retryable
+        return isinstance(error, (ConnectionError, TimeoutError))
+
+    def backoff(self, attempt, retry_after=None):
+        """Delay before retry number `attempt` (0-based)."""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        return max(delay, retry_after or 0)
+
+    def _acquire(self):
+        """Wait for a free slot and a closed circuit. Returns True if this call is the half-open probe."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.state == "open":
+                    if now < self.open_until:
+                        self._cond.wait(self.open_until - now)
+                        continue
+                    self.state = "half_open"
+                if self.state == "half_open":
+                    if not self._probing and self.in_flight == 0:
+                        self._probing = True
+                        self.in_flight += 1
+                        return True
+                elif self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return False
+                self._cond.wait(1.0)
+
+    def _release(self, probe, error=None):
+        with self._cond:
+            self.in_flight -= 1
+            if probe:
+                self._probing = False
+            now = time.monotonic()
+            if error is None:
+                self.consecutive_failures = 0
+                if self.state != "closed":
+                    self.state = "closed"
+                    metrics.record_event("circuit", state="closed")
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif self.is_retryable(error):
+                self.consecutive_failures += 1
+                if isinstance(error, RateLimitError) and now - self._last_decrease >= self.DECREASE_INTERVAL:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                if probe or (self.state == "closed" and self.consecutive_failures >= self.failure_threshold):
+                    self._trip(now, getattr(error, "retry_after", None))
+            self._cond.notify_all()
+
+    def _trip(self, now, retry_after=None):
+        cooldown = max(self.cooldown, retry_after or 0)
+        self.state = "open"
+        self.open_until = now + cooldown
+        self.trips += 1
+        metrics.inc("llm_circuit_trips_total")
+        metrics.record_event("circuit", state="open", cooldown=round(cooldown, 2))
+        print(f"LLM circuit breaker open for {cooldown:.1f}s after {self.consecutive_failures} failures")
+
+    def _failed(self, probe, error, attempt, prompt_key):
+        """Record a failed attempt; return the delay before retrying, or raise if giving up."""
+        self._release(probe, error)
+        if not self.is_retryable(error):
+            raise error
+        if attempt >= self.max_retries:
+            if self.state != "closed":
+                raise CircuitOpenError(f"Circuit breaker open after repeated failures: {error}") from error
+            raise error
+        delay = self.backoff(attempt, getattr(error, "retry_after", None))
+        record_retry(prompt_key, error, delay)
+        return delay
+
+    def call(self, fn, prompt_key=None):
+        """Run `fn()` under the controller, retrying transient failures."""
+        attempt = 0
+        while True:
+            probe = self._acquire()
+            try:
+                result = fn()
+            except Exception as e:
+                time.sleep(self._failed(probe, e, attempt, prompt_key))
+                attempt += 1
+                continue
+            self._release(probe)
+            return result
+
+    def stream(self, fn, prompt_key=None):
+        """
+        Iterate `fn()` under the controller. Failures before the first chunk are
+        retried; once output has been yielded a failure is raised to the caller.
+        """
+        attempt = 0
+        while True:
+            probe = self._acquire()
+            try:
+                chunks = iter(fn())
+                first = next(chunks, None)
+            except Exception as e:
+                time.sleep(self._failed(probe, e, attempt, prompt_key))
+                attempt += 1
+                continue
+            break
+
+        error = None
+        try:
+            if first is not None:
+                yield first
+            for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(probe, error)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "state": self.state,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "open_for": max(0.0, self.open_until - time.monotonic()) if self.state == "open" else 0.0
+            }
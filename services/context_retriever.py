@@ -0,0 +1,139 @@
+import heapq
+import os
+import threading
+from collections import OrderedDict
+from utils.helpers import estimate_tokens
+
+class ContextRetriever:
+    """
+    Selects the inbox context sent with an Email Agent question.
+
+    Emails are ranked against the question with the BM25 search index (and,
+    if enabled, local embeddings), and recent or high-priority emails are always
+    included. The pinned blocks are added first, then the ranked ones until the
+    token budget is spent, so a long ranked email cannot crowd them out. Results are
+    cached per inbox version, so repeated turns on an unchanged inbox are free.
+    """
+
+    PRIORITY_CATEGORIES = ("Important", "To-Do")
+
+    def __init__(self, email_processor, token_budget=None, top_k=8, recent_count=3, priority_count=5,
+                 preview_chars=300, use_embeddings=None):
+        self.email_processor = email_processor
+        self.token_budget = token_budget or int(os.getenv("CHAT_CONTEXT_TOKENS", "3000"))
+        self.top_k = top_k
+        self.recent_count = recent_count
+        self.priority_count = priority_count
+        self.preview_chars = preview_chars
+        if use_embeddings is None:
+            use_embeddings = os.getenv("RETRIEVAL_EMBEDDINGS", "false").lower() == "true"
+        self.use_embeddings = use_embeddings
+        self._embedder = None
+        self._embeddings = {}  # email id -> (body fingerprint, vector)
+        self._lock = threading.Lock()
+        self._pinned = (None, [])         # (inbox version, pinned email ids)
+        self._contexts = OrderedDict()    # (inbox version, question) -> context
+        self._max_cached_contexts = 64
+
+    def _pinned_ids(self):
+        """Recent and high-priority email ids, recomputed only when the inbox changes."""
+        ep = self.email_processor
+        version, pinned = self._pinned
+        if version == ep.version:
+            return pinned
+
+        priority = []
+        for category in self.PRIORITY_CATEGORIES:
+            priority.extend(ep.get_emails_by_category(category))
+        priority = heapq.nlargest(self.priority_count, priority, key=lambda e: e.timestamp)
+        recent = heapq.nlargest(self.recent_count, ep.headers, key=lambda e: e.timestamp)
+
+        pinned = list(dict.fromkeys(e.id for e in priority + recent))
+        self._pinned = (ep.version, pinned)
+        return pinned
+
+    def _load_embedder(self):
+        if self._embedder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError:
+                print("Warning: sentence-transformers is not installed; using lexical retrieval only.")
+                self.use_embeddings = False
+                return None
+            self._embedder = SentenceTransformer(os.getenv("RETRIEVAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2"))
+        return self._embedder
+
+    def _embedding_ranking(self, question):
+        """Email ids ranked by cosine similarity to the question, using local embeddings."""
+        embedder = self._load_embedder()
+        if embedder is None:
+            return []
+
+        headers = self.email_processor.headers
+        stale = [h.id for h in headers if self._embeddings.get(h.id, (None,))[0] != (h.subject, h.body_hash)]
+        if stale:
+            emails = self.email_processor.get_emails(stale, cache=False)
+            vectors = embedder.encode([f"{e.subject}\n{e.body}" for e in emails], normalize_embeddings=True)
+            for email, vector in zip(emails, vectors):
+                self._embeddings[email.id] = ((email.subject, email.body_hash), vector)
+
+        query = embedder.encode([question], normalize_embeddings=True)[0]
+        scores = {h.id: float(self._embeddings[h.id][1] @ query) for h in headers if h.id in self._embeddings}
+        return heapq.nlargest(self.top_k, scores, key=scores.get)
+
+    def rank(self, question):
+        """Email ids most relevant to the question, best first."""
+        lexical = self.email_processor.search_index.search(question, limit=self.top_k * 2, match_all=False)
+        if not self.use_embeddings:
+            return lexical[:self.top_k]
+
+        # Reciprocal-rank fusion of the lexical and embedding rankings
+        fused = {}
+        for ranking in (lexical, self._embedding_ranking(question)):
+            for position, email_id in enumerate(ranking):
+                fused[email_id] = fused.get(email_id, 0.0) + 1.0 / (60 + position)
+        return heapq.nlargest(self.top_k, fused, key=fused.get)
+
+    def _format_email(self, email):
+        block = f"- From: {email.sender}\n"
+        block += f"  Date: {email.timestamp}\n"
+        block += f"  Subject: {email.subject}\n"
+        block += f"  Category: {email.category or 'Uncategorized'}\n"
+        if email.action_items:
+            tasks = "; ".join(str(item.get("task")) for item in email.action_items)
+            block += f"  Action Items: {tasks}\n"
+        body = self.email_processor.compaction(email).text
+        preview = body[:self.preview_chars]
+        block += f"  Preview: {preview}{'...' if len(body) > self.preview_chars else ''}\n\n"
+        return block
+
+    def build_context(self, question):
+        """Assemble the inbox context for a question within the token budget."""
+        ep = self.email_processor
+        key = (ep.version, question.strip().lower())
+        with self._lock:
+            if key in self._contexts:
+                self._contexts.move_to_end(key)
+                return self._contexts[key]
+
+            counts = ep.count_by_category()
+            overview = ", ".join(f"{count} {category or 'Uncategorized'}" for category, count in counts.items())
+            context = f"The inbox has {sum(counts.values())} emails ({overview}).\n"
+            context += "Here are recent and high-priority emails, plus the ones most relevant to the question:\n\n"
+
+            used = estimate_tokens(context)
+            for email_id in dict.fromkeys(self._pinned_ids() + self.rank(question)):
+                email = ep.get_email(email_id)
+                if not email:
+                    continue
+                block = self._format_email(email)
+                cost = estimate_tokens(block)
+                if used + cost > self.token_budget:
+                    continue
+                context += block
+                used += cost
+
+            self._contexts[key] = context
+            while len(self._contexts) > self._max_cached_contexts:
+                self._contexts.popitem(last=False)
+            return context
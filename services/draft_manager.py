@@ -1,33 +1,62 @@
-import json
 import os
+import threading
 from models.draft import Draft
+from services.storage import create_repository
 from utils.helpers import generate_id
+from utils.indexes import FieldIndex
 
 class DraftManager:
-    def __init__(self, drafts_file="data/drafts.json"):
+    def __init__(self, drafts_file="data/drafts.json", repository=None):
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.drafts_file = os.path.join(base_dir, drafts_file)
-        self.drafts = self.load_drafts()
+        self.repository = repository or create_repository("drafts", self.drafts_file)
+        self._lock = threading.RLock()
+        self._data_version = None
+        self._drafts = {}
+        self._by_email = FieldIndex(lambda d: d.email_id)
+        self._set_drafts(self.load_drafts())
+
+    @property
+    def drafts(self):
+        """All drafts in creation order."""
+        return list(self._drafts.values())
+
+    def _set_drafts(self, drafts):
+        self._drafts.clear()
+        self._by_email.clear()
+        for draft in drafts:
+            self._index_draft(draft)
+
+    def refresh(self):
+        """Reload drafts if the backing store changed since they were last loaded or saved."""
+        with self._lock:
+            if self.repository.version() == self._data_version:
+                return False
+            self._set_drafts(self.load_drafts())
+            return True
+
+    def _index_draft(self, draft):
+        self._drafts[draft.id] = draft
+        self._by_email.add(draft.id, draft)
 
     def load_drafts(self):
-        """Load drafts from JSON file."""
-        if not os.path.exists(self.drafts_file):
-            return []
-        
+        """Load drafts from the repository."""
         try:
-            with open(self.drafts_file, 'r') as f:
-                data = json.load(f)
-                return [Draft(**d) for d in data]
+            self._data_version = self.repository.version()
+            return [Draft(**d) for d in self.repository.load().values()]
         except Exception as e:
             print(f"Error loading drafts: {e}")
             return []
 
-    def save_drafts(self):
-        """Save drafts to JSON file."""
+    def save_drafts(self, drafts=None):
+        """Save drafts to the repository; only the given drafts are written if provided."""
         try:
-            data = [d.to_dict() for d in self.drafts]
-            with open(self.drafts_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with self._lock:
+                if drafts is None:
+                    self.repository.save_all({d.id: d.to_dict() for d in self._drafts.values()})
+                else:
+                    self.repository.upsert({d.id: d.to_dict() for d in drafts})
+                self._data_version = self.repository.version()
             return True
         except Exception as e:
             print(f"Error saving drafts: {e}")
@@ -42,30 +71,67 @@ class DraftManager:
             body=body,
             metadata=metadata or {}
         )
-        self.drafts.append(draft)
-        self.save_drafts()
+        with self._lock:
+            self._index_draft(draft)
+            self.save_drafts([draft])
         return draft
 
+    def create_drafts(self, drafts):
+        """
+        Create several drafts, given as dicts of create_draft's arguments, with
+        one write. Returns the new drafts.
+        """
+        created = [
+            Draft(
+                id=generate_id(),
+                email_id=d.get("email_id"),
+                subject=d["subject"],
+                body=d["body"],
+                metadata=d.get("metadata") or {}
+            )
+            for d in drafts
+        ]
+        with self._lock:
+            for draft in created:
+                self._index_draft(draft)
+            self.save_drafts(created)
+        return created
+
     def update_draft(self, draft_id, subject, body):
         """Update an existing draft."""
-        for draft in self.drafts:
-            if draft.id == draft_id:
-                draft.subject = subject
-                draft.body = body
-                return self.save_drafts()
-        return False
+        with self._lock:
+            draft = self._drafts.get(draft_id)
+            if not draft:
+                return False
+            draft.subject = subject
+            draft.body = body
+            return self.save_drafts([draft])
 
     def delete_draft(self, draft_id):
         """Delete a draft."""
-        self.drafts = [d for d in self.drafts if d.id != draft_id]
-        return self.save_drafts()
+        try:
+            with self._lock:
+                if self._drafts.pop(draft_id, None) is None:
+                    return False
+                self._by_email.remove(draft_id)
+                self.repository.delete([draft_id])
+                self._data_version = self.repository.version()
+            return True
+        except Exception as e:
+            print(f"Error deleting draft: {e}")
+            return False
 
     def get_draft(self, draft_id):
         """Get a specific draft."""
-        for draft in self.drafts:
-            if draft.id == draft_id:
-                return draft
-        return None
+        return self._drafts.get(draft_id)
+
+    def has_draft(self, email_id):
+        """Whether a draft replying to this email exists."""
+        return self._by_email.count(email_id) > 0
+
+    def get_drafts_for_email(self, email_id):
+        """Get the drafts replying to an email."""
+        return [self._drafts[i] for i in self._by_email.get(email_id)]
 
     def get_all_drafts(self):
         """Get all drafts."""
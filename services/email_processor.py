@@ -1,91 +1,1051 @@
-import json
 import os
-from models.email import Email
+import threading
+from collections import OrderedDict
+from weakref import WeakValueDictionary
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from models.analysis import ANALYSIS_FIELDS, validate_analysis
+from models.email import Email, EmailHeader
+from services.body_compactor import BodyCompactor
+from services.call_controller import CircuitOpenError
+from services.grouping import THREAD_SOURCE, EmailGrouper, normalize_subject
 from services.llm_service import LLMService
 from services.prompt_manager import PromptManager
+from services.ingestion import iter_records
+from services.local_classifier import LOCAL_SOURCE, LocalClassifier
+from services.metrics import metrics
+from services.search_index import SearchIndex
+from services.snapshot import EmailSnapshot, HeaderMap
+from services.storage import create_repository
+from utils.helpers import chunked, content_hash
+from utils.indexes import FieldIndex
+
+# Email attributes filled by the analysis prompts, and every LLM-derived attribute
+ANALYSIS_OUTPUTS = tuple(ANALYSIS_FIELDS.values())
+DERIVED_FIELDS = ANALYSIS_OUTPUTS + ("summary",)
+# Prompts whose category labels the local classifier learns from
+CATEGORY_PROMPTS = ("analysis", "categorization")
+# Dedicated prompt for each analysis output, used when it is the only one needed
+FIELD_PROMPTS = {"category": "categorization", "action_items": "action_extraction"}
+# Prompts that are sent only the new lines of a thread reply
+DELTA_PROMPTS = ("analysis", "categorization", "action_extraction")
+# Inbox sort orders: name -> (header field, function giving the value sorted on)
+SORT_KEYS = {
+    "date": ("timestamp", lambda value: value or ""),
+    "sender": ("sender", lambda value: (value or "").lower()),
+    "subject": ("subject", lambda value: normalize_subject(value)[0]),
+}
+# page_headers category that matches every email
+ANY = "*"
 
 class EmailProcessor:
-    def __init__(self, inbox_file="data/mock_inbox.json"):
+    # Emails at or below this size are eligible for multi-email batch prompts
+    SMALL_EMAIL_TOKENS = 300
+    # Full emails kept in memory; the rest are read from storage on demand
+    EMAIL_CACHE_SIZE = 256
+    # Emails whose bodies are loaded at once while processing
+    PROCESSING_CHUNK = 1000
+    # Earlier thread messages a reply's new lines are compared against
+    THREAD_CONTEXT = 5
+
+    def __init__(self, inbox_file="data/mock_inbox.json", repository=None, index_file="data/search_index.json",
+                 llm_service=None, prompt_manager=None, snapshot_file="data/email_snapshot.bin"):
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.inbox_file = os.path.join(base_dir, inbox_file)
-        self.llm_service = LLMService()
-        self.prompt_manager = PromptManager()
-        self.emails = self.load_emails()
+        self.repository = repository or create_repository("emails", self.inbox_file)
+        self.llm_service = llm_service or LLMService()
+        self.prompt_manager = prompt_manager or PromptManager()
+        self._lock = threading.RLock()
+        self._data_version = None
+        # Bumped on every in-memory change so callers can cache derived views
+        self.version = 0
+        self.use_fused_analysis = os.getenv("FUSED_ANALYSIS", "true").lower() != "false"
+        # Short emails are packed into shared requests up to this many tokens (0 disables)
+        self.batch_token_budget = int(os.getenv("BATCH_TOKEN_BUDGET", str(LLMService.BATCH_TOKEN_BUDGET)))
+        # Local fast path: confident categories skip the LLM (LOCAL_CLASSIFIER=false disables)
+        self.classifier = None
+        if os.getenv("LOCAL_CLASSIFIER", "true").lower() != "false":
+            self.classifier = LocalClassifier(
+                threshold=float(os.getenv("LOCAL_CLASSIFIER_THRESHOLD", "0.95")),
+                min_training=int(os.getenv("LOCAL_CLASSIFIER_MIN_TRAINING", "30")),
+                audit_rate=float(os.getenv("LOCAL_CLASSIFIER_AUDIT_RATE", "0.05"))
+            )
+        self._headers = HeaderMap()
+        # Recently used full emails; everything else stays in storage. Every full email
+        # handed out is also tracked weakly, so there is only ever one object per id
+        self._cache = OrderedDict()
+        self._live = WeakValueDictionary()
+        self._indexes = {
+            "category": FieldIndex(lambda e: e.category),
+            "processed": FieldIndex(lambda e: e.processed),
+            "sender": FieldIndex(lambda e: e.sender.lower()),
+            "message_id": FieldIndex(lambda e: e.message_id),
+            "thread": FieldIndex(lambda e: e.thread_id),
+        }
+        # Bodies are compacted before every LLM call (BODY_COMPACTION=false sends them as stored)
+        self.compactor = BodyCompactor(
+            default_tokens=int(os.getenv("BODY_TOKEN_BUDGET", "1500")),
+            enabled=os.getenv("BODY_COMPACTION", "true").lower() != "false"
+        )
+        # Secondary indexes and classifier training are built on first use
+        self._indexed = False
+        # Threads and near-duplicate clusters are assigned as emails arrive (EMAIL_GROUPING=false disables);
+        # the grouper is rebuilt from the stored assignments on first use
+        self.use_grouping = os.getenv("EMAIL_GROUPING", "true").lower() != "false"
+        self._grouper = None
+        # Memory-mapped copy of the store that headers and bodies are read from (EMAIL_SNAPSHOT=false disables)
+        self.snapshot_file = None
+        if snapshot_file and os.getenv("EMAIL_SNAPSHOT", "true").lower() != "false":
+            self.snapshot_file = os.path.join(base_dir, snapshot_file)
+        # Persisted full-text index, loaded on first use; changes made before then are queued
+        self.index_file = os.path.join(base_dir, index_file)
+        self._search_index = None
+        self._pending_search = {}
+        self._set_headers(self.load_emails())
 
-    def load_emails(self):
-        """Load emails from JSON file."""
-        if not os.path.exists(self.inbox_file):
+    @property
+    def headers(self):
+        """Compact headers of all emails in inbox order; use these for lists and filtering."""
+        return list(self._headers.values())
+
+    @property
+    def emails(self):
+        """All full emails in inbox order. Reads every body from storage; prefer `headers`."""
+        return self.get_emails(list(self._headers))
+
+    def _set_headers(self, headers):
+        """Replace the in-memory headers; indexes are rebuilt on next use."""
+        self.version += 1
+        self._headers = headers
+        self._cache.clear()
+        self._live.clear()
+        for index in self._indexes.values():
+            index.clear()
+        self._indexed = False
+        self._grouper = None
+        self._sort_values = {}
+        # The search index must now match this data version, plus the changes queued from here on
+        self._search_base = self._data_version
+        self._pending_search = {}
+        if self._search_index is not None:
+            self._sync_search_index()
+
+    def _ensure_indexed(self):
+        """Build the secondary indexes and train the local classifier, once per load."""
+        with self._lock:
+            if self._indexed:
+                return
+            for header in self._headers.values():
+                self._add_to_indexes(header)
+            self._indexed = True
+
+    def _index(self, name):
+        self._ensure_indexed()
+        return self._indexes[name]
+
+    def _add_to_indexes(self, header):
+        for index in self._indexes.values():
+            index.add(header.id, header)
+        source = header.provenance.get("category")
+        if self.classifier and source and source.get("prompt") in CATEGORY_PROMPTS:
+            self.classifier.learn(header, header.category)
+
+    @property
+    def grouper(self):
+        """The thread and near-duplicate grouper, seeded with every grouped email on first use."""
+        with self._lock:
+            if self._grouper is None:
+                grouper = EmailGrouper()
+                for header in self._headers.values():
+                    if header.thread_id:
+                        grouper.add(header)
+                self._grouper = grouper
+            return self._grouper
+
+    def _group(self, emails):
+        """Assign a thread and near-duplicate cluster to emails that have none. Returns those changed."""
+        if not self.use_grouping:
             return []
-        
+        grouped = []
+        for email in emails:
+            if email.thread_id is None:
+                compaction = self.compaction(email)
+                self.grouper.assign(email, compaction.text, compaction.tokens)
+                grouped.append(email)
+        return grouped
+
+    def _index_header(self, header):
+        """Add or refresh a header in the id map and, once built, the secondary indexes."""
+        with self._lock:
+            self._headers[header.id] = header
+            self.version += 1
+            if self._indexed:
+                self._add_to_indexes(header)
+            for sort, values in self._sort_values.items():
+                field, key = SORT_KEYS[sort]
+                values[header.id] = key(getattr(header, field))
+
+    def _index_email(self, email):
+        """Refresh a full email's header, cache entry and search index entry after it changed."""
+        self._index_header(EmailHeader.from_email(email))
+        self._remember(email)
+        with self._lock:
+            if self._search_index is None:
+                self._pending_search[email.id] = self._search_fields(email)
+            else:
+                self._search_index.add(email.id, self._search_fields(email))
+
+    @property
+    def search_index(self):
+        """The full-text index, loaded and brought up to date with storage on first use."""
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = SearchIndex(self.index_file)
+                self._search_index.load()
+                self._sync_search_index()
+            return self._search_index
+
+    def _sync_search_index(self):
+        """
+        Bring the search index up to date with storage and save it. Bodies are only
+        read if the index was saved for a different version of the data.
+        """
+        index = self._search_index
+        pending, self._pending_search = self._pending_search, {}
+        current = index.source_version == EmailSnapshot.normalize_version(self._search_base)
+        if current:
+            for key, fields in pending.items():
+                index.add(key, fields)
+        if not current or len(index) != len(self._headers):
+            index.retain(set(self._headers))
+            for key, record in self.repository.load().items():
+                index.add(key, self._search_fields(Email.model_construct(**record)))
+        self._save_search_index()
+
+    def _save_search_index(self):
+        """Save the search index, noting the data version it matches so the next load can trust it."""
+        self.search_index.mark_synced(self._data_version)
+        self.search_index.save()
+
+    @staticmethod
+    def _search_fields(email):
+        """Text indexed for full-text search."""
+        return {
+            "subject": email.subject,
+            "sender": email.sender,
+            "body": email.body,
+            "category": email.category or "",
+            "actions": " ".join(str(item.get("task", "")) for item in email.action_items or []),
+        }
+
+    def _lookup(self, ids):
+        """Resolve ids to headers in inbox order; cost is proportional to len(ids)."""
+        return [self._headers[i] for i in sorted(ids, key=self._headers.position)]
+
+    def refresh(self):
+        """Reload emails if the backing store changed since they were last loaded or saved."""
+        with self._lock:
+            if self.repository.version() == self._data_version:
+                return False
+            self._set_headers(self.load_emails())
+            return True
+
+    def load_emails(self):
+        """
+        Load email headers; bodies stay in storage until requested. With a snapshot,
+        headers are decoded from it on access and the repository is only read to
+        rebuild the snapshot when it is out of date.
+        """
         try:
-            with open(self.inbox_file, 'r') as f:
-                data = json.load(f)
-                return [Email(**e) for e in data]
+            self._data_version = self.repository.version()
+            if self.snapshot_file:
+                snapshot = self._open_snapshot()
+                if snapshot is not None:
+                    return HeaderMap(snapshot)
+            records = self.repository.load_fields(EmailHeader.FIELDS, {"body_hash": ("body", content_hash)})
+            return HeaderMap(headers=[EmailHeader(**values) for values in records.values()])
         except Exception as e:
             print(f"Error loading emails: {e}")
-            return []
+            return HeaderMap()
+
+    def _open_snapshot(self):
+        """Open the snapshot for the current data version, rebuilding it if stale. None on failure."""
+        snapshot = EmailSnapshot(self.snapshot_file)
+        if snapshot.open(self._data_version):
+            return snapshot
+        try:
+            EmailSnapshot.write(self.snapshot_file, self.repository.load().values(), self._data_version)
+        except Exception as e:
+            print(f"Error writing email snapshot: {e}")
+            return None
+        return snapshot if snapshot.open(self._data_version) else None
 
-    def save_emails(self):
-        """Save emails to JSON file."""
+    def save_emails(self, emails=None):
+        """Save emails to the repository; only the given emails are written if provided."""
         try:
-            data = [e.to_dict() for e in self.emails]
-            with open(self.inbox_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with self._lock:
+                if emails is None:
+                    self.repository.save_all({e.id: e.to_dict() for e in self.emails})
+                else:
+                    self.repository.upsert({e.id: e.to_dict() for e in emails})
+                self._data_version = self.repository.version()
             return True
         except Exception as e:
             print(f"Error saving emails: {e}")
             return False
 
+    def add_emails(self, emails):
+        """Add or replace emails, updating indexes and writing them in one transaction."""
+        with self._lock:
+            self._group(emails)
+            for email in emails:
+                self._index_email(email)
+            with self.repository.transaction():
+                return self.save_emails(emails)
+
+    def has_message_id(self, message_id):
+        """Whether an email with this Message-ID is already stored."""
+        return self._index("message_id").count(message_id) > 0
+
+    def ingest(self, source, fmt=None, chunk_size=500, process=False, progress_callback=None):
+        """
+        Stream emails from an mbox file, Maildir or JSONL file into the store.
+
+        Messages are parsed one at a time, deduplicated by Message-ID and id, and
+        committed in chunks of `chunk_size`. With `process=True` each chunk is also
+        analyzed before the next one is read. `progress_callback(ingested)` is called
+        after each chunk. Returns the number of new emails.
+
+        Memory only stays flat with the SQLite backend: the JSON repository keeps
+        every record in memory and rewrites its file on each chunk. The set of
+        Message-IDs used for deduplication grows with the mailbox on both.
+        """
+        seen = set(v for v in self._index("message_id").values() if v)
+        ingested = 0
+        for chunk in chunked(iter_records(source, fmt, seen), chunk_size):
+            emails = []
+            for record in chunk:
+                if record["id"] in self._headers:
+                    continue
+                try:
+                    emails.append(Email(**record))
+                except Exception as e:
+                    print(f"Skipping invalid email {record.get('id')}: {e}")
+            if not emails:
+                continue
+            self.add_emails(emails)
+            ingested += len(emails)
+            if process:
+                self.process_emails(emails)
+            if progress_callback:
+                progress_callback(ingested)
+        self._save_search_index()
+        return ingested
+
+    def _remember(self, email):
+        """Put a full email in the LRU cache."""
+        with self._lock:
+            self._live[email.id] = email
+            self._cache[email.id] = email
+            self._cache.move_to_end(email.id)
+            while len(self._cache) > self.EMAIL_CACHE_SIZE:
+                self._cache.popitem(last=False)
+
+    def get_header(self, email_id):
+        """Get an email's header by ID, or None."""
+        return self._headers.get(email_id)
+
     def get_email(self, email_id):
-        """Get a specific email by ID."""
-        for email in self.emails:
-            if email.id == email_id:
-                return email
+        """Get a full email by ID, reading it from storage if it is not cached."""
+        emails = self.get_emails([email_id])
+        return emails[0] if emails else None
+
+    def get_emails(self, ids, cache=True):
+        """
+        Get full emails by ID, in the given order, with one storage read for those
+        not cached. Records from our own store are trusted and skip validation.
+        With `cache=False` newly read emails are not kept in the LRU cache.
+        """
+        with self._lock:
+            found = {}
+            for email_id in ids:
+                email = self._live.get(email_id)
+                if email is not None:
+                    found[email_id] = email
+                    if email_id in self._cache:
+                        self._cache.move_to_end(email_id)
+            records = {}
+            missing = []
+            for email_id in ids:
+                if email_id in found:
+                    continue
+                row = self._headers.snapshot_row(email_id)
+                if row is not None:
+                    records[email_id] = self._headers.snapshot.record(row)
+                elif email_id in self._headers:
+                    missing.append(email_id)
+            if missing:
+                records.update(self.repository.get(missing))
+            if records:
+                for key, record in records.items():
+                    email = Email.model_construct(**record)
+                    found[key] = email
+                    self._live[key] = email
+                    if cache:
+                        self._remember(email)
+        return [found[i] for i in ids if i in found]
+
+    def get_emails_by_category(self, category):
+        """Get email headers in a category; None selects uncategorized emails."""
+        return self._lookup(self._index("category").get(category))
+
+    def get_emails_by_sender(self, sender):
+        """Get email headers from a sender address (case-insensitive)."""
+        return self._lookup(self._index("sender").get(sender.lower()))
+
+    def get_unprocessed_emails(self):
+        """Get headers of emails that have not been processed yet."""
+        return self._lookup(self._index("processed").get(False))
+
+    def _sort_values_for(self, sort):
+        """
+        Email id -> value sorted on for a SORT_KEYS order. Built on first use from
+        that one field (read straight from the snapshot) and kept current as headers change.
+        """
+        with self._lock:
+            values = self._sort_values.get(sort)
+            if values is None:
+                field, key = SORT_KEYS[sort]
+                values = {email_id: key(value) for email_id, value in self._headers.field_values(field)}
+                self._sort_values[sort] = values
+            return values
+
+    def page_headers(self, category=ANY, query=None, sort=None, descending=False, offset=0, limit=50):
+        """
+        One page of headers for a list view, and how many match in total.
+
+        `category` filters on a category (None selects uncategorized emails),
+        `query` on a full-text search. Results are in inbox order, or by relevance
+        for a search, unless `sort` names a SORT_KEYS field. Only the returned
+        page of headers is decoded.
+        """
+        with self._lock:
+            if query:
+                ids = [key for key in self.search_index.search(query) if key in self._headers]
+                if category != ANY:
+                    in_category = set(self._index("category").get(category))
+                    ids = [key for key in ids if key in in_category]
+            elif category != ANY:
+                ids = sorted(self._index("category").get(category), key=self._headers.position)
+            else:
+                ids = None
+
+            if sort:
+                values = self._sort_values_for(sort)
+                ids = sorted(values if ids is None else ids, key=values.__getitem__, reverse=descending)
+            elif descending and ids is not None and not query:
+                ids.reverse()
+
+            if ids is None:
+                total = len(self._headers)
+                positions = range(offset, min(offset + limit, total))
+                page = [self._headers.key_at(total - 1 - p if descending else p) for p in positions]
+            else:
+                total = len(ids)
+                page = ids[offset:offset + limit]
+            return [self._headers[key] for key in page], total
+
+    def count_by_category(self):
+        """Return the number of emails per category (None for uncategorized)."""
+        index = self._index("category")
+        return {category: index.count(category) for category in index.values()}
+
+    def _analysis_prompt(self):
+        """Return the fused analysis prompt if it is enabled and declares output fields."""
+        prompt = self.prompt_manager.get_prompt("analysis")
+        if self.use_fused_analysis and prompt and prompt.output_fields:
+            return prompt
         return None
 
-    def process_email(self, email_id):
+    def _source(self, email, prompt_key):
+        """Provenance entry for a field produced by `prompt_key` from the email's current body."""
+        prompt = self.prompt_manager.get_prompt(prompt_key)
+        return {
+            "prompt": prompt_key,
+            "version": prompt.version if prompt else None,
+            "body_hash": email.body_hash
+        }
+
+    def stale_fields(self, email):
+        """
+        Return the derived fields of an email or header that need (re)computing: every
+        analysis field of an unprocessed email, plus any field whose recorded prompt
+        version or body hash no longer matches. A summary is only refreshed if the
+        email already has one.
+        """
+        if not email.processed:
+            return set(ANALYSIS_OUTPUTS)
+
+        body_hash = email.body_hash
+        fields = ANALYSIS_OUTPUTS + ("summary",) if "summary" in email.provenance else ANALYSIS_OUTPUTS
+        stale = set()
+        for field in fields:
+            source = email.provenance.get(field)
+            if not source or source.get("body_hash") != body_hash:
+                stale.add(field)
+                continue
+            if source.get("prompt") == THREAD_SOURCE and "from" in source:
+                # A category taken from an earlier message is as fresh as that message's
+                other = self._headers.get(source["from"])
+                if not other or self._category_version(other) != source.get("version"):
+                    stale.add(field)
+                continue
+            if source.get("prompt") in (LOCAL_SOURCE, THREAD_SOURCE):
+                # Local labels and empty thread deltas depend only on the email itself
+                continue
+            prompt = self.prompt_manager.get_prompt(source.get("prompt"))
+            if not prompt or prompt.version != source.get("version"):
+                stale.add(field)
+        return stale
+
+    def _category_version(self, header):
+        """Fingerprint of a header's category and its provenance, or None if the category is stale."""
+        if not header.category or "category" in self.stale_fields(header):
+            return None
+        source = header.provenance.get("category", {})
+        return content_hash("|".join(str(source.get(key)) for key in ("prompt", "version", "body_hash"))
+                            + "|" + header.category)
+
+    def get_stale_emails(self):
+        """Return headers of processed emails with at least one outdated field."""
+        return [header for header in self.headers if header.processed and self.stale_fields(header)]
+
+    def _classify_locally(self, email, fields):
+        """
+        Try the local classifier for the category. Returns (result, remaining fields,
+        prediction): an accepted label fills the category, plus empty action items when
+        the label rules them out (newsletters and spam, see NO_ACTION_CATEGORIES). The prediction is returned when the email
+        still goes to the LLM, so the two can be compared. Action items left after
+        an accepted label are extracted by the action_extraction prompt alone.
+        """
+        result = {"provenance": {}}
+        if not self.classifier or "category" not in fields:
+            return result, fields, None
+        self._ensure_indexed()
+        prediction = self.classifier.decide(email)
+        if not prediction.accepted:
+            return result, fields, prediction
+
+        values = {"category": prediction.category}
+        if prediction.no_actions:
+            values["action_items"] = []
+        source = {"prompt": LOCAL_SOURCE, "version": prediction.source, "body_hash": email.body_hash}
+        for field, value in values.items():
+            if field in fields:
+                result[field] = value
+                result["provenance"][field] = source
+        fields = fields - set(values)
+        if not fields:
+            self.classifier.record_skipped()
+        return result, fields, None
+
+    def _leader(self, header):
+        """The email whose results this one can reuse: its cluster representative, else its thread root."""
+        if header.cluster_id and header.cluster_id != header.id:
+            return header.cluster_id
+        if header.thread_id and header.thread_id != header.id:
+            return header.thread_id
+        return None
+
+    def _propagate(self, email, fields):
+        """
+        Reuse the results of the email's group. Returns (result, remaining fields, delta).
+
+        A near-duplicate copies every requested field its cluster representative
+        has up to date. A thread reply takes the category of the latest earlier
+        message in the thread; only its new lines (those not already in the last
+        THREAD_CONTEXT messages) are then sent to the LLM, and a reply with no new
+        lines gets no action items. `delta` is those new lines, or None when the
+        whole body should be sent.
+        """
+        result = {"provenance": {}}
+        if not self.use_grouping or not email.thread_id:
+            return result, fields, None
+
+        representative = self._headers.get(email.cluster_id) if email.cluster_id != email.id else None
+        if representative and representative.processed:
+            reusable = {f for f in fields - self.stale_fields(representative) if f in representative.provenance}
+            if reusable:
+                source = self.get_email(representative.id)
+                for field in reusable:
+                    result[field] = getattr(source, field)
+                    result["provenance"][field] = {
+                        "from": source.id, **source.provenance.get(field, {}), "body_hash": email.body_hash
+                    }
+                metrics.inc("email_group_propagations_total", kind="duplicate")
+                fields = fields - reusable
+        if not fields or email.thread_id == email.id:
+            return result, fields, None
+
+        position = self._headers.position(email.id)
+        earlier = [header for header in self._lookup(self._index("thread").get(email.thread_id))
+                   if header.id != email.id and self._headers.position(header.id) < position][-self.THREAD_CONTEXT:]
+        if not earlier:
+            return result, fields, None
+        source = {"prompt": THREAD_SOURCE, "version": None, "body_hash": email.body_hash}
+        if "category" in fields:
+            other = next((h for h in reversed(earlier) if h.processed and self._category_version(h)), None)
+            if other:
+                result["category"] = other.category
+                result["provenance"]["category"] = {
+                    **source, "version": self._category_version(other), "from": other.id
+                }
+                metrics.inc("email_group_propagations_total", kind="thread")
+                fields = fields - {"category"}
+
+        seen = set()
+        for other in self.get_emails([h.id for h in earlier], cache=False):
+            seen.update(line.strip() for line in self.compaction(other).text.splitlines())
+        delta = "\n".join(line for line in self.compaction(email).text.splitlines()
+                          if line.strip() and line.strip() not in seen)
+        if not delta and "action_items" in fields:
+            result["action_items"] = []
+            result["provenance"]["action_items"] = source
+            fields = fields - {"action_items"}
+        return result, fields, delta or None
+
+    def _prefill(self, email, fields):
+        """
+        Settle what can be settled without the LLM: first from the email's thread or
+        cluster, then with the local classifier. Returns (result, remaining fields,
+        prediction, delta); `delta` is passed on to analyze_email.
+        """
+        grouped, fields, delta = self._propagate(email, fields)
+        local, fields, prediction = self._classify_locally(email, fields)
+        return self._combine(grouped, local, None), fields, prediction, delta
+
+    def _combine(self, local, result, prediction):
+        """Merge a local partial result with the LLM's, recording agreement if both categorized."""
+        if prediction and "category" in result:
+            self.classifier.record_outcome(prediction, result["category"])
+        return {**local, **result, "provenance": {**local["provenance"], **result.get("provenance", {})}}
+
+    def analyze_email(self, email, fields=None, delta=None):
+        """
+        Run the LLM prompts for an email and return the derived fields without mutating it.
+        `fields` limits the work to those Email attributes (all analysis fields by default).
+        `delta`, if given, replaces the body for the analysis prompts (see _propagate).
+        Each produced field also gets a "provenance" entry.
+        Backend errors that outlast the LLM service's retries are raised.
+        """
+        fields = set(fields or ANALYSIS_OUTPUTS)
+        result = {"provenance": {}}
+
+        # 1. Fused analysis: one schema-constrained call filling every declared field
+        analysis_prompt = self._analysis_prompt()
+        if self._wants_fused(analysis_prompt, fields):
+            prompt_fields = analysis_prompt.output_fields
+            context = analysis_prompt.template.replace("{email_body}", self.prompt_body(email, "analysis", delta))
+            response = self.llm_service.generate_json(
+                context,
+                response_schema=analysis_prompt.response_schema,
+                response_model=analysis_prompt.response_model,
+                prompt_key="analysis",
+                raise_on_error=True
+            )
+            fused = validate_analysis(response, prompt_fields)
+            if fused is not None:
+                self._merge(email, result, fused, "analysis", fields)
+
+        result = self._complete_analysis(email, result, fields, delta)
+        if "summary" in fields:
+            summary = self.summarize_email(email)
+            if summary is not None:
+                self._merge(email, result, {"summary": summary}, "summarization", fields)
+        return result
+
+    def _wants_fused(self, analysis_prompt, fields):
+        """
+        Whether the fused prompt is worth a call for `fields`: it must fill one of them,
+        and a single field with a dedicated prompt is left to that prompt.
+        """
+        if not analysis_prompt:
+            return False
+        wanted = fields & {ANALYSIS_FIELDS.get(f) for f in analysis_prompt.output_fields}
+        if len(wanted) == 1 and self.prompt_manager.get_prompt(FIELD_PROMPTS.get(next(iter(wanted)))):
+            return False
+        return bool(wanted)
+
+    def _merge(self, email, result, values, prompt_key, fields):
+        """Copy the requested `values` into `result`, recording which prompt produced them."""
+        source = self._source(email, prompt_key)
+        for field, value in values.items():
+            if field in fields:
+                result[field] = value
+                result["provenance"][field] = source
+
+    def analyze_batch(self, emails, deltas=None):
+        """
+        Analyze several emails with one batched fused call. `deltas` maps email ids
+        to the body to send instead (see _propagate).
+        Returns a dict mapping email id to the derived fields.
+        """
+        deltas = deltas or {}
+        analysis_prompt = self._analysis_prompt()
+        if not analysis_prompt or len(emails) < 2:
+            return {email.id: self.analyze_email(email, delta=deltas.get(email.id)) for email in emails}
+
+        prompt_fields = analysis_prompt.output_fields
+        responses = self.llm_service.generate_json_batch(
+            analysis_prompt.template.replace("{email_body}", "").strip(),
+            [(email.id, self.prompt_body(email, "analysis", deltas.get(email.id))) for email in emails],
+            response_schema=analysis_prompt.response_schema,
+            response_model=analysis_prompt.response_model,
+            token_budget=self.batch_token_budget or None,
+            prompt_key="analysis",
+            raise_on_error=True
+        )
+
+        results = {}
+        fields = set(ANALYSIS_OUTPUTS)
+        for email in emails:
+            result = {"provenance": {}}
+            fused = validate_analysis(responses.get(email.id), prompt_fields)
+            if fused:
+                self._merge(email, result, fused, "analysis", fields)
+            results[email.id] = self._complete_analysis(email, result, fields, deltas.get(email.id))
+        return results
+
+    def _complete_analysis(self, email, result, fields, delta=None):
+        """Fall back to dedicated prompts for any requested field the fused call did not fill."""
+        if 'category' in fields and 'category' not in result:
+            cat_prompt = self.prompt_manager.get_prompt("categorization")
+            if cat_prompt:
+                category = self.llm_service.generate_response(
+                    cat_prompt.template, 
+                    f"Email Body:\n{self.prompt_body(email, 'categorization', delta)}",
+                    prompt_key="categorization",
+                    raise_on_error=True
+                )
+                self._merge(email, result, {'category': category.strip()}, "categorization", fields)
+
+        if 'action_items' in fields and 'action_items' not in result:
+            action_prompt = self.prompt_manager.get_prompt("action_extraction")
+            if action_prompt:
+                context = action_prompt.template.replace("{email_body}", self.prompt_body(email, "action_extraction", delta))
+                extracted = self.llm_service.generate_json(
+                    context,
+                    response_schema=action_prompt.response_schema,
+                    response_model=action_prompt.response_model,
+                    prompt_key="action_extraction",
+                    raise_on_error=True
+                )
+                values = validate_analysis(extracted, action_prompt.output_fields or ["tasks"])
+                if values and 'action_items' in values:
+                    self._merge(email, result, {'action_items': values['action_items']}, "action_extraction", fields)
+
+        return result
+
+    def prompt_body(self, email, prompt_key, delta=None):
+        """
+        The email body as sent with a prompt: compacted and cut to the prompt's token
+        budget. For DELTA_PROMPTS a thread reply's `delta` is sent instead of the body.
+        """
+        prompt = self.prompt_manager.get_prompt(prompt_key)
+        body = delta if delta and prompt_key in DELTA_PROMPTS else email.body
+        return self.compactor.for_prompt(body, prompt_key, prompt.body_tokens if prompt else None)
+
+    def compaction(self, email):
+        """The compacted body of an email with its token estimate before and after compaction."""
+        return self.compactor.compact(email.body)
+
+    def summarize_email(self, email):
+        """Summarize an email with the summarization prompt; raises if the LLM call fails."""
+        prompt = self.prompt_manager.get_prompt("summarization")
+        if not prompt:
+            return None
+        return self.llm_service.generate_response(
+            prompt.template,
+            f"Email Body:\n{self.prompt_body(email, 'summarization')}",
+            prompt_key="summarization",
+            raise_on_error=True
+        )
+
+    def record_summary(self, email, summary):
+        """Store a summary produced elsewhere (e.g. streamed in the UI) with its provenance."""
+        self.apply_analysis(email, {
+            "summary": summary,
+            "provenance": {"summary": self._source(email, "summarization")}
+        })
+        self.save_emails([email])
+
+    def _plan_work(self, emails, needs):
+        """
+        Group emails into units of work: short emails needing a full analysis are
+        packed into batched requests, everything else is analyzed on its own.
+        """
+        analysis_prompt = self._analysis_prompt()
+        if not analysis_prompt or self.batch_token_budget <= 0:
+            return [[email] for email in emails]
+
+        small = []
+        groups = []
+        for email in emails:
+            if needs[email.id] == set(ANALYSIS_OUTPUTS) and self.compaction(email).tokens <= self.SMALL_EMAIL_TOKENS:
+                small.append(email)
+            else:
+                groups.append([email])
+
+        by_id = {email.id: email for email in small}
+        items = [(email.id, self.compaction(email).text) for email in small]
+        # Count the same instructions analyze_batch sends against the budget
+        instructions = analysis_prompt.template.replace("{email_body}", "").strip()
+        for batch in self.llm_service.plan_batches(instructions, items, token_budget=self.batch_token_budget):
+            groups.append([by_id[item_id] for item_id, _ in batch])
+        return groups
+
+    @staticmethod
+    def _has_outputs(result):
+        return bool(result) and any(field in result for field in DERIVED_FIELDS)
+
+    def _analyze_group(self, group, needs, deltas):
+        if len(group) > 1:
+            return self.analyze_batch(group, deltas)
+        return {email.id: self.analyze_email(email, needs[email.id], deltas.get(email.id)) for email in group}
+
+    def apply_analysis(self, email, result):
+        """Store the fields returned by analyze_email on the email."""
+        with self._lock:
+            for field in DERIVED_FIELDS:
+                if field in result:
+                    setattr(email, field, result[field])
+            email.provenance = {**email.provenance, **result.get("provenance", {})}
+            # A summary alone does not make an email processed; that needs the analysis outputs
+            if any(field in result for field in ANALYSIS_OUTPUTS):
+                email.processed = True
+            self._index_email(email)
+
+    def process_email(self, email_id, save=True):
         """Process a single email: Categorize and Extract Action Items."""
+        if email_id in self._headers:
+            self._ensure_grouped([email_id])
         email = self.get_email(email_id)
         if not email:
             return False
 
-        # 1. Categorize
-        cat_prompt = self.prompt_manager.get_prompt("categorization")
-        if cat_prompt:
-            category = self.llm_service.generate_response(
-                cat_prompt.template, 
-                f"Email Body:\n{email.body}"
-            )
-            email.category = category.strip()
-
-        # 2. Extract Action Items
-        action_prompt = self.prompt_manager.get_prompt("action_extraction")
-        if action_prompt:
-            context = action_prompt.template.replace("{email_body}", email.body)
-            result = self.llm_service.generate_json(context)
-            if result and 'tasks' in result:
-                email.action_items = result['tasks']
-
-        email.processed = True
-        self.save_emails()
+        local, fields, prediction, delta = self._prefill(email, set(ANALYSIS_OUTPUTS))
+        try:
+            result = self.analyze_email(email, fields, delta) if fields else {}
+        except Exception as e:
+            print(f"Error processing email {email_id}: {e}")
+            return False
+        result = self._combine(local, result, prediction)
+        if not self._has_outputs(result):
+            return False
+        self.apply_analysis(email, result)
+        if save:
+            self.save_emails([email])
         return True
 
-    def process_inbox(self):
-        """Process all unprocessed emails."""
+    def process_email_stream(self, email_id):
+        """
+        Process a single email like process_email, streaming the fused analysis reply:
+        yields its partial value (prompt output fields, e.g. {"category": ..., "tasks": [...]})
+        as it arrives. The result is applied and saved when the stream ends.
+        """
+        if email_id in self._headers:
+            self._ensure_grouped([email_id])
+        email = self.get_email(email_id)
+        if not email:
+            return
+
+        local, fields, prediction, delta = self._prefill(email, set(ANALYSIS_OUTPUTS))
+        result = {"provenance": {}}
+        analysis_prompt = self._analysis_prompt()
+        if self._wants_fused(analysis_prompt, fields):
+            response = {}
+            for response in self.llm_service.generate_json_stream(
+                analysis_prompt.template.replace("{email_body}", self.prompt_body(email, "analysis", delta)),
+                response_schema=analysis_prompt.response_schema,
+                response_model=analysis_prompt.response_model,
+                prompt_key="analysis"
+            ):
+                yield response
+            fused = validate_analysis(response, analysis_prompt.output_fields)
+            if fused is not None:
+                self._merge(email, result, fused, "analysis", fields)
+        try:
+            result = self._complete_analysis(email, result, fields, delta)
+        except Exception as e:
+            print(f"Error processing email {email_id}: {e}")
+            return
+        result = self._combine(local, result, prediction)
+        if self._has_outputs(result):
+            self.apply_analysis(email, result)
+            self.save_emails([email])
+
+    def process_inbox(self, max_workers=None, batch_size=None, progress_callback=None):
+        """Process all unprocessed emails. See process_emails for the options."""
+        return self.process_emails(self.get_unprocessed_emails(), max_workers, batch_size, progress_callback)
+
+    def reprocess_stale(self, max_workers=None, batch_size=None, progress_callback=None):
+        """Re-run only the outputs whose prompt or email body changed since they were produced."""
+        return self.process_emails(self.get_stale_emails(), max_workers, batch_size, progress_callback)
+
+    def process_emails(self, emails, max_workers=None, batch_size=None, progress_callback=None):
+        """
+        Compute the stale fields (see stale_fields) of the given emails or headers.
+
+        Bodies are loaded PROCESSING_CHUNK emails at a time. Emails whose cluster
+        representative or thread root is also being processed wait for it, then
+        reuse its results (see _propagate). Categories the local classifier is
+        confident about are filled without the LLM; newsletters and spam skip it
+        entirely. Short emails are packed into batched requests. LLM
+        calls run on a thread pool of `max_workers` threads (rate limited by the
+        shared LLMService), while results are applied and saved on the calling
+        thread every `batch_size` emails. `progress_callback(done, total)` is
+        called after each email.
+
+        Emails whose analysis fails stay unprocessed so a later run retries
+        them. If the LLM circuit breaker gives up, the remaining work is
+        cancelled rather than spent against an unavailable backend.
+        Returns the number of emails processed.
+        """
+        max_workers = max_workers or int(os.getenv("PROCESSING_CONCURRENCY", "4"))
+        batch_size = batch_size or int(os.getenv("PROCESSING_BATCH_SIZE", "25"))
+        needs = {}
+        for email in emails:
+            fields = self.stale_fields(email)
+            if fields:
+                needs[email.id] = fields
+        total = len(needs)
+        if not total:
+            return 0
+        self._ensure_grouped(list(needs))
+        # Emails that can reuse another pending email's results go in a second pass
+        dependents = [key for key in needs if self._leader(self._headers[key]) in needs]
+        independent = [key for key in needs if key not in set(dependents)]
+
         count = 0
-        for email in self.emails:
-            if not email.processed:
-                self.process_email(email.id)
-                count += 1
+        uncommitted = []
+        local = {}
+        predictions = {}
+        deltas = {}
+
+        def commit():
+            with self.repository.transaction():
+                self.save_emails(uncommitted)
+            uncommitted.clear()
+
+        def record(email, result):
+            nonlocal count
+            self.apply_analysis(email, result)
+            count += 1
+            uncommitted.append(email)
+            if len(uncommitted) >= batch_size:
+                commit()
+            if progress_callback:
+                progress_callback(count, total)
+
+        def record_group(group, results):
+            for email in group:
+                if email.id in results:
+                    result = self._combine(local[email.id], results[email.id], predictions[email.id])
+                    if self._has_outputs(result):
+                        record(email, result)
+
+        def failed(group, error):
+            print(f"Error processing emails {[email.id for email in group]}: {error}")
+            return isinstance(error, CircuitOpenError)
+
+        def run(groups):
+            """Analyze and record the groups; returns False once the circuit breaker gives up."""
+            if executor is None:
+                for group in groups:
+                    try:
+                        results = self._analyze_group(group, needs, deltas)
+                    except Exception as e:
+                        if failed(group, e):
+                            return False
+                        continue
+                    record_group(group, results)
+                return True
+
+            keep_going = True
+            futures = {executor.submit(self._analyze_group, group, needs, deltas): group for group in groups}
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                group = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    if failed(group, e):
+                        keep_going = False
+                        for pending_future in futures:
+                            pending_future.cancel()
+                    continue
+                record_group(group, results)
+            return keep_going
+
+        def process_chunk(chunk_ids):
+            chunk = self.get_emails(chunk_ids, cache=False)
+
+            # Group results and the local fast path first; only what they cannot settle goes to the LLM
+            local.clear()
+            predictions.clear()
+            deltas.clear()
+            for email in chunk:
+                prefilled = self._prefill(email, needs[email.id])
+                local[email.id], needs[email.id], predictions[email.id], deltas[email.id] = prefilled
+            record_group([email for email in chunk if not needs[email.id]], local)
+            return run(self._plan_work([email for email in chunk if needs[email.id]], needs))
+
+        executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        try:
+            for ids in (independent, dependents):
+                if uncommitted:
+                    commit()
+                if not all(process_chunk(chunk_ids) for chunk_ids in chunked(ids, self.PROCESSING_CHUNK)):
+                    break
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if count < total:
+            print(f"{total - count} emails could not be processed and remain queued")
+
+        if uncommitted:
+            commit()
+        self._save_search_index()
         return count
 
-    def search_emails(self, query):
-        """Simple search implementation."""
-        query = query.lower()
-        results = []
-        for email in self.emails:
-            if (query in email.subject.lower() or 
-                query in email.sender.lower() or 
-                query in email.body.lower()):
-                results.append(email)
-        return results
+    def _ensure_grouped(self, ids):
+        """Group emails stored before grouping was enabled, in inbox order, so their results can be shared."""
+        if not self.use_grouping:
+            return
+        ungrouped = [key for key in ids if self._headers[key].thread_id is None]
+        for chunk_ids in chunked(sorted(ungrouped, key=self._headers.position), self.PROCESSING_CHUNK):
+            emails = self._group(self.get_emails(chunk_ids, cache=False))
+            for email in emails:
+                self._index_header(EmailHeader.from_email(email))
+            with self.repository.transaction():
+                self.save_emails(emails)
+
+    def reindex(self, progress_callback=None):
+        """Rebuild the full-text search index from scratch and save it. Returns the number of emails indexed."""
+        records = self.repository.load()
+        self.search_index.clear()
+        for i, (key, record) in enumerate(records.items(), 1):
+            self.search_index.add(key, self._search_fields(Email.model_construct(**record)))
+            if progress_callback and (i % 500 == 0 or i == len(records)):
+                progress_callback(i, len(records))
+        self._save_search_index()
+        return len(records)
+
+    def search_emails(self, query, limit=None):
+        """
+        Full-text search ranked by BM25, returning headers. Supports "quoted phrases" and field scopes
+        (from:, subject:, body:, category:, action:).
+        """
+        results = self.search_index.search(query, limit)
+        return [self._headers[i] for i in results if i in self._headers]
@@ -0,0 +1,133 @@
+import hashlib
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from email.utils import parseaddr
+from services.search_index import tokenize
+
+REPLY_PREFIX_RE = re.compile(r"^\s*(?:(?:re|fwd?|aw|sv|wg|antw)\s*(?:\[\d+\])?\s*:\s*)+", re.IGNORECASE)
+MESSAGE_ID_RE = re.compile(r"<[^>]+>")
+
+# Provenance "prompt" recorded for fields settled from the thread without an LLM call
+THREAD_SOURCE = "thread"
+
+def normalize_subject(subject):
+    """Return (subject without Re:/Fwd: prefixes, lowercased and collapsed; whether it had a prefix)."""
+    subject = subject or ""
+    match = REPLY_PREFIX_RE.match(subject)
+    base = subject[match.end():] if match else subject
+    return " ".join(base.lower().split()), bool(match)
+
+def parse_message_ids(value):
+    """Message-IDs listed in an In-Reply-To or References header."""
+    return MESSAGE_ID_RE.findall(value or "")
+
+def parse_timestamp(value):
+    """Timezone-aware datetime for an ISO timestamp (naive ones are taken as UTC), or None."""
+    try:
+        parsed = datetime.fromisoformat(value or "")
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def simhash(text, bits=64):
+    """SimHash of the word bigrams of `text`; near-identical texts differ in only a few bits."""
+    tokens = tokenize(text)
+    features = Counter(zip(tokens, tokens[1:])) if len(tokens) > 1 else Counter(tokens)
+    weights = [0] * bits
+    for feature, count in features.items():
+        digest = hashlib.blake2b(repr(feature).encode("utf-8"), digest_size=bits // 8).digest()
+        value = int.from_bytes(digest, "big")
+        for bit in range(bits):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit in range(bits) if weights[bit] > 0)
+
+class EmailGrouper:
+    """
+    Assigns emails to threads and near-duplicate clusters as they are ingested.
+
+    Threads follow In-Reply-To headers. A message with a Re:/Fwd: prefix and no
+    known In-Reply-To falls back to the thread with the same normalized subject,
+    but only if its sender already wrote in that thread within `subject_window`;
+    otherwise any "Re: Update" would join the first "Update" in the mailbox.
+    Near-duplicates are emails from the
+    same sender whose compacted bodies have SimHashes at most `max_distance`
+    bits apart; the first email of a cluster is its representative. Candidate
+    lookup splits the hash into `max_distance + 1` bands, so any pair within
+    the distance shares at least one band exactly.
+    """
+
+    def __init__(self, max_distance=3, min_tokens=20, subject_window=timedelta(days=30)):
+        self.max_distance = max_distance
+        self.min_tokens = min_tokens
+        self.subject_window = subject_window
+        self.bands = max_distance + 1
+        self._band_bits = 64 // self.bands
+        self._lock = threading.Lock()
+        self._threads_by_message = {}  # message id -> thread id
+        self._threads_by_subject = {}  # normalized subject -> thread id
+        self._participants = {}        # thread id -> {sender: latest message time}
+        self._buckets = {}             # (sender, band, value) -> [(simhash, cluster id)]
+
+    def _band_keys(self, sender, value):
+        mask = (1 << self._band_bits) - 1
+        return [(sender, band, value >> (band * self._band_bits) & mask) for band in range(self.bands)]
+
+    def add(self, email):
+        """Register an already grouped email or header so later emails can join its thread or cluster."""
+        with self._lock:
+            self._register(email, int(email.simhash, 16) if email.simhash else None)
+
+    def _register(self, email, value):
+        if email.message_id:
+            self._threads_by_message.setdefault(email.message_id, email.thread_id)
+        base, _ = normalize_subject(email.subject)
+        if base:
+            self._threads_by_subject.setdefault(base, email.thread_id)
+        sender = parseaddr(email.sender)[1].lower()
+        sent = parse_timestamp(email.timestamp)
+        participants = self._participants.setdefault(email.thread_id, {})
+        if sent and (sender not in participants or participants[sender] < sent):
+            participants[sender] = sent
+        if value is not None:
+            for key in self._band_keys(sender, value):
+                self._buckets.setdefault(key, []).append((value, email.cluster_id))
+
+    def _subject_thread(self, base, sender, sent):
+        """The thread titled `base` if `sender` wrote in it within `subject_window` of `sent`."""
+        thread_id = self._threads_by_subject.get(base)
+        last = self._participants.get(thread_id, {}).get(sender)
+        if not last or not sent or abs(sent - last) > self.subject_window:
+            return None
+        return thread_id
+
+    def assign(self, email, text, tokens):
+        """
+        Set thread_id, cluster_id and simhash on a new email. `text` is its compacted
+        body and `tokens` that body's token estimate; very short bodies are never
+        clustered, since a "Thanks!" says nothing about the next "Thanks!".
+        """
+        base, is_reply = normalize_subject(email.subject)
+        sender = parseaddr(email.sender)[1].lower()
+        value = simhash(text) if tokens >= self.min_tokens else None
+        with self._lock:
+            thread_id = None
+            for message_id in parse_message_ids(email.in_reply_to):
+                thread_id = self._threads_by_message.get(message_id)
+                if thread_id:
+                    break
+            if not thread_id and is_reply and base:
+                thread_id = self._subject_thread(base, sender, parse_timestamp(email.timestamp))
+            email.thread_id = thread_id or email.id
+
+            email.cluster_id = email.id
+            if value is not None:
+                for key in self._band_keys(sender, value):
+                    match = next((cluster for other, cluster in self._buckets.get(key, ())
+                                  if bin(other ^ value).count("1") <= self.max_distance), None)
+                    if match:
+                        email.cluster_id = match
+                        break
+            email.simhash = f"{value:016x}" if value is not None else None
+            self._register(email, value)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from email import policy
+from email.parser import BytesHeaderParser, BytesParser
+from email.utils import parsedate_to_datetime
+from utils.helpers import html_to_text
+
+_header_parser = BytesHeaderParser(policy=policy.default)
+_message_parser = BytesParser(policy=policy.default)
+
+def detect_format(path):
+    """Guess the mailbox format of a path: 'maildir', 'jsonl' or 'mbox'."""
+    if os.path.isdir(path):
+        return "maildir"
+    if path.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "mbox"
+
+def iter_jsonl(path):
+    """Yield one record per line of a newline-delimited JSON file."""
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Skipping malformed JSONL line {line_no}: {e}")
+
+def iter_mbox_messages(path):
+    """Yield the raw bytes of each message in an mbox file, one message in memory at a time."""
+    lines = []
+    previous_blank = True
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.startswith(b"From ") and previous_blank:
+                if lines:
+                    yield b"".join(lines)
+                lines = []
+            else:
+                if line.startswith(b">From "):
+                    line = line[1:]
+                lines.append(line)
+            previous_blank = not line.strip()
+    if lines:
+        yield b"".join(lines)
+
+def iter_maildir_messages(path):
+    """Yield the raw bytes of each message in a Maildir (cur/ and new/)."""
+    for sub in ("cur", "new"):
+        folder = os.path.join(path, sub)
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.startswith("."):
+                    with open(entry.path, 'rb') as f:
+                        yield f.read()
+
+def _stable_id(message_id, raw):
+    source = message_id.encode("utf-8") if message_id else raw
+    return "m" + hashlib.sha1(source).hexdigest()[:16]
+
+def _extract_body(message):
+    """Plain-text body of a parsed MIME message, converting HTML if that is all there is."""
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    try:
+        content = part.get_content()
+    except Exception:
+        payload = part.get_payload(decode=True) or b""
+        content = payload.decode("utf-8", errors="replace")
+    if part.get_content_type() == "text/html":
+        return html_to_text(content)
+    return content
+
+def parse_message(raw, seen_message_ids=None):
+    """
+    Turn raw RFC 822 bytes into an email record. Only the headers are parsed
+    until the Message-ID has been checked, so duplicates never pay for MIME decoding.
+    Returns None for duplicates.
+    """
+    headers = _header_parser.parsebytes(raw)
+    message_id = (headers.get("Message-ID") or "").strip() or None
+    if message_id and seen_message_ids is not None:
+        if message_id in seen_message_ids:
+            return None
+        seen_message_ids.add(message_id)
+
+    timestamp = headers.get("Date")
+    try:
+        timestamp = parsedate_to_datetime(timestamp).isoformat() if timestamp else ""
+    except (TypeError, ValueError):
+        timestamp = str(timestamp)
+
+    # In-Reply-To names the parent; References lists the thread, parent last
+    in_reply_to = " ".join(str(headers.get(name) or "") for name in ("In-Reply-To", "References")).strip() or None
+
+    message = _message_parser.parsebytes(raw)
+    return {
+        "id": _stable_id(message_id, raw),
+        "message_id": message_id,
+        "in_reply_to": in_reply_to,
+        "sender": str(headers.get("From") or ""),
+        "subject": str(headers.get("Subject") or ""),
+        "body": _extract_body(message),
+        "timestamp": timestamp,
+    }
+
+def _normalize_record(record, seen_message_ids):
+    """Fill in ids for a JSONL record and apply Message-ID deduplication."""
+    message_id = record.get("message_id")
+    if message_id and seen_message_ids is not None:
+        if message_id in seen_message_ids:
+            return None
+        seen_message_ids.add(message_id)
+    if not record.get("id"):
+        raw = json.dumps(record, sort_keys=True).encode("utf-8")
+        record = dict(record, id=_stable_id(message_id, raw))
+    return record
+
+def iter_records(path, fmt=None, seen_message_ids=None):
+    """
+    Stream email records from an mbox file, Maildir or JSONL file.
+    `seen_message_ids` is updated in place and used to skip duplicates.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt == "jsonl":
+        for record in iter_jsonl(path):
+            record = _normalize_record(record, seen_message_ids)
+            if record:
+                yield record
+        return
+
+    if fmt == "maildir":
+        messages = iter_maildir_messages(path)
+    elif fmt == "mbox":
+        messages = iter_mbox_messages(path)
+    else:
+        raise ValueError(f"Unknown mailbox format: {fmt}")
+
+    for raw in messages:
+        try:
+            record = parse_message(raw, seen_message_ids)
+        except Exception as e:
+            print(f"Skipping unparsable message: {e}")
+            continue
+        if record:
+            yield record
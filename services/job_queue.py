@@ -0,0 +1,165 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from models.job import Job
+from utils.helpers import generate_id
+
+class JobQueue:
+    """
+    Durable job queue in a SQLite table (WAL mode), shared by the app and any
+    number of worker processes.
+
+    Workers claim the oldest queued job atomically and send heartbeats while it
+    runs. A running job whose heartbeat is older than `stale_after` seconds
+    (its worker died or the app restarted) is handed out again, so work resumes
+    after a restart.
+    """
+
+    COLUMNS = ("id", "type", "params", "status", "progress_done", "progress_total", "result", "error",
+               "attempts", "worker", "created_at", "started_at", "finished_at", "heartbeat_at")
+
+    def __init__(self, db_path=None, stale_after=None, max_attempts=3):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.db_path = os.path.join(base_dir, db_path or os.getenv("JOB_DB", "data/jobs.db"))
+        self.stale_after = stale_after or float(os.getenv("JOB_STALE_SECONDS", "60"))
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, type TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL, "
+            "progress_done INTEGER DEFAULT 0, progress_total INTEGER DEFAULT 0, result TEXT, error TEXT, "
+            "attempts INTEGER DEFAULT 0, worker TEXT, created_at REAL NOT NULL, started_at REAL, "
+            "finished_at REAL, heartbeat_at REAL)"
+        )
+        self._connect().execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _job(self, row):
+        data = dict(zip(self.COLUMNS, row))
+        data["params"] = json.loads(data["params"])
+        data["result"] = json.loads(data["result"]) if data["result"] else None
+        return Job(**data)
+
+    def _select(self, where="", args=(), suffix=""):
+        sql = f"SELECT {', '.join(self.COLUMNS)} FROM jobs {where} {suffix}"
+        return [self._job(row) for row in self._connect().execute(sql, args)]
+
+    def enqueue(self, job_type, params=None, dedupe=True):
+        """
+        Queue a job and return it. With `dedupe`, an already queued or running
+        job of the same type and params is returned instead of adding another.
+        """
+        params = params or {}
+        encoded = json.dumps(params, sort_keys=True)
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if dedupe:
+                existing = self._select(
+                    "WHERE type = ? AND params = ? AND status IN ('queued', 'running')", (job_type, encoded)
+                )
+                if existing:
+                    conn.execute("COMMIT")
+                    return existing[0]
+            job = Job(id=generate_id(), type=job_type, params=params, created_at=time.time())
+            conn.execute(
+                "INSERT INTO jobs (id, type, params, status, created_at) VALUES (?, ?, ?, 'queued', ?)",
+                (job.id, job_type, encoded, job.created_at)
+            )
+            conn.execute("COMMIT")
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker_id):
+        """
+        Mark the next runnable job as running for `worker_id` and return it, or None.
+        Stale running jobs are requeued first, or failed once they used up `max_attempts`.
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Worker stopped responding', finished_at = ? "
+                "WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (now, now - self.stale_after, self.max_attempts)
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (now - self.stale_after,)
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started_at = COALESCE(started_at, ?), heartbeat_at = ? WHERE id = ?",
+                (worker_id, now, now, row[0])
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(row[0])
+
+    def heartbeat(self, job_id):
+        self._connect().execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def update_progress(self, job_id, done, total):
+        self._connect().execute(
+            "UPDATE jobs SET progress_done = ?, progress_total = ?, heartbeat_at = ? WHERE id = ?",
+            (done, total, time.time(), job_id)
+        )
+
+    def complete(self, job_id, result=None):
+        self._finish(job_id, "done", result=result)
+
+    def fail(self, job_id, error):
+        self._finish(job_id, "failed", error=str(error))
+
+    def cancel(self, job_id):
+        """Cancel a job that has not started yet. Returns False if it is already running or finished."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id)
+        )
+        return cursor.rowcount > 0
+
+    def _finish(self, job_id, status, result=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, heartbeat_at = NULL WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+        )
+
+    def get(self, job_id):
+        jobs = self._select("WHERE id = ?", (job_id,))
+        return jobs[0] if jobs else None
+
+    def list_jobs(self, limit=20, active_only=False):
+        """Most recent jobs first."""
+        where = "WHERE status IN ('queued', 'running')" if active_only else ""
+        return self._select(where, suffix=f"ORDER BY created_at DESC LIMIT {int(limit)}")
+
+    def purge(self, older_than=7 * 24 * 3600):
+        """Delete finished jobs older than `older_than` seconds."""
+        cursor = self._connect().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?",
+            (time.time() - older_than,)
+        )
+        return cursor.rowcount
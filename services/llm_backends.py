@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from models.analysis import CATEGORIES
+
+class LLMBackendError(Exception):
+    """Raised by a backend when a request fails. `retryable` marks transient failures."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class RateLimitError(LLMBackendError):
+    """Raised when the backend rejects a request for exceeding its quota."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# HTTP statuses worth retrying besides 429
+TRANSIENT_STATUSES = (408, 500, 502, 503, 504)
+RETRY_AFTER_RE = re.compile(r"retry(?: in|_delay\s*\{\s*seconds:)\s*([\d.]+)", re.IGNORECASE)
+
+def _translate_error(error):
+    """Map a google-api-core error to LLMBackendError/RateLimitError, or return it unchanged."""
+    status = getattr(error, "code", None)
+    if not isinstance(status, int):
+        return error
+    match = RETRY_AFTER_RE.search(str(error))
+    if status == 429:
+        return RateLimitError(str(error), retry_after=float(match.group(1)) if match else None)
+    return LLMBackendError(str(error), retryable=status in TRANSIENT_STATUSES)
+
+class GeminiBackend:
+    """
+    Google Gemini through the google-generativeai client. The SDK takes about a
+    second to import, so it is imported and configured on the first request.
+    """
+
+    def __init__(self, api_key, model_name="gemini-2.5-flash"):
+        self.model_name = model_name
+        self.api_key = api_key
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.model_name)
+        return self._model
+
+    def _kwargs(self, generation_config):
+        return {"generation_config": generation_config} if generation_config else {}
+
+    def generate(self, prompt, generation_config=None):
+        """Return the full response text for a prompt."""
+        try:
+            return self.model.generate_content(prompt, **self._kwargs(generation_config)).text
+        except Exception as e:
+            translated = _translate_error(e)
+            if translated is e:
+                raise
+            raise translated from e
+
+    def stream(self, prompt, generation_config=None):
+        """Yield response text chunks as they arrive."""
+        try:
+            for chunk in self.model.generate_content(prompt, stream=True, **self._kwargs(generation_config)):
+                if chunk.text:
+                    yield chunk.text
+        except Exception as e:
+            translated = _translate_error(e)
+            if translated is e:
+                raise
+            raise translated from e
+
+class MockBackend:
+    """
+    Deterministic offline stand-in for the LLM, for benchmarks and development.
+
+    Replies are derived from a hash of the prompt, so the same prompt always gets
+    the same answer. Schema-constrained requests get JSON matching the schema,
+    including batched requests keyed by '=== Item <id> ===' headers. Latency,
+    error rate, a rate of malformed JSON replies and a requests-per-minute
+    quota are configurable.
+    """
+
+    ITEM_RE = re.compile(r"^=== Item (.+?) ===$", re.MULTILINE)
+    WORDS = ("review", "report", "meeting", "deadline", "project", "update", "schedule",
+             "budget", "follow", "send", "confirm", "draft", "plan", "team", "client")
+
+    def __init__(self, latency=0.0, latency_per_token=0.0, jitter=0.0, error_rate=0.0,
+                 requests_per_minute=None, malformed_rate=0.0, seed=0):
+        self.model_name = "mock"
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.malformed_rate = malformed_rate
+        self._rng = random.Random(seed)
+        self._seed = seed
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self.calls = 0
+
+    def _prompt_rng(self, prompt):
+        digest = hashlib.sha256(f"{self._seed}:{prompt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    def _admit(self):
+        """Apply the simulated quota and error rate."""
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            if self.requests_per_minute:
+                while self._requests and now - self._requests[0] >= 60:
+                    self._requests.popleft()
+                if len(self._requests) >= self.requests_per_minute:
+                    retry_after = 60 - (now - self._requests[0])
+                    raise RateLimitError("429 Resource has been exhausted (mock quota)", retry_after=retry_after)
+                self._requests.append(now)
+            fail = self.error_rate and self._rng.random() < self.error_rate
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if fail:
+            raise LLMBackendError("503 Service unavailable (mock transient error)")
+        return delay
+
+    def _sentence(self, rng, words):
+        return " ".join(rng.choice(self.WORDS) for _ in range(words)).capitalize() + "."
+
+    def _from_schema(self, schema, rng, prompt):
+        kind = (schema.get("type") or "string").lower()
+        if "enum" in schema:
+            return rng.choice(schema["enum"])
+        if kind == "object":
+            properties = schema.get("properties", {})
+            if "results" in properties and "id" in properties["results"].get("items", {}).get("properties", {}):
+                item_schema = properties["results"]["items"]
+                results = []
+                for item_id in self.ITEM_RE.findall(prompt):
+                    if item_id == "<id>":
+                        continue
+                    entry = self._from_schema(item_schema, self._prompt_rng(prompt + item_id), prompt)
+                    entry["id"] = item_id
+                    results.append(entry)
+                return {"results": results}
+            return {name: self._from_schema(sub, rng, prompt) for name, sub in properties.items()}
+        if kind == "array":
+            return [self._from_schema(schema.get("items", {}), rng, prompt) for _ in range(rng.randint(0, 2))]
+        if kind in ("integer", "number"):
+            return rng.randint(0, 100)
+        if kind == "boolean":
+            return rng.random() < 0.5
+        if schema.get("nullable") and rng.random() < 0.5:
+            return None
+        return self._sentence(rng, rng.randint(2, 6))
+
+    def _malformed(self, text):
+        """Sometimes break a JSON reply the way real models do: wrapped in prose and cut short."""
+        with self._lock:
+            malformed = self.malformed_rate and self._rng.random() < self.malformed_rate
+        return f"Here is the JSON you asked for:\n{text[:-1]}" if malformed else text
+
+    def _reply(self, prompt, generation_config):
+        rng = self._prompt_rng(prompt)
+        schema = (generation_config or {}).get("response_schema")
+        if schema:
+            return self._malformed(json.dumps(self._from_schema(schema, rng, prompt)))
+        if "JSON" in prompt:
+            tasks = [{"task": self._sentence(rng, 4), "deadline": None} for _ in range(rng.randint(0, 2))]
+            return self._malformed(json.dumps({"tasks": tasks}))
+        if "category" in prompt.lower() and "ONLY the category" in prompt:
+            return rng.choice(CATEGORIES)
+        return " ".join(self._sentence(rng, rng.randint(5, 12)) for _ in range(rng.randint(1, 4)))
+
+    def generate(self, prompt, generation_config=None):
+        """Return a deterministic reply after the configured latency."""
+        delay = self._admit()
+        text = self._reply(prompt, generation_config)
+        time.sleep(delay + self.latency_per_token * (len(text) // 4))
+        return text
+
+    def stream(self, prompt, generation_config=None):
+        """Yield a deterministic reply in small chunks, spreading the latency across them."""
+        delay = self._admit()
+        text = self._reply(prompt, generation_config)
+        time.sleep(delay)
+        for i in range(0, len(text), 16):
+            chunk = text[i:i + 16]
+            time.sleep(self.latency_per_token * (len(chunk) // 4))
+            yield chunk
+
+def create_backend(name=None):
+    """
+    Build the backend selected by LLM_BACKEND ("gemini" or "mock").
+    Returns None when Gemini is selected but no API key is configured.
+    """
+    name = (name or os.getenv("LLM_BACKEND", "gemini")).lower()
+    if name == "mock":
+        rpm = int(os.getenv("MOCK_LLM_RPM", "0"))
+        return MockBackend(
+            latency=float(os.getenv("MOCK_LLM_LATENCY", "0.2")),
+            jitter=float(os.getenv("MOCK_LLM_JITTER", "0.1")),
+            error_rate=float(os.getenv("MOCK_LLM_ERROR_RATE", "0")),
+            requests_per_minute=rpm or None,
+            malformed_rate=float(os.getenv("MOCK_LLM_MALFORMED_RATE", "0"))
+        )
+    if name != "gemini":
+        raise ValueError(f"Unknown LLM backend: {name}")
+
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        # For development/testing without key, we might want to warn or handle gracefully
+        print("Warning: GEMINI_API_KEY not found in environment variables.")
+        return None
+    return GeminiBackend(api_key)
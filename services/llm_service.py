@@ -1,52 +1,427 @@
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import copy
 import json
-from utils.helpers import extract_json_from_text
-
-# Load environment variables
-load_dotenv()
+import time
+from services.call_controller import CallController
+from services.llm_backends import create_backend
+from services.llm_cache import LLMCache
+from services.metrics import metrics, record_llm_call
+from services.rate_limiter import RateLimiter
+from utils.helpers import estimate_tokens, load_env, parse_json_response
+from utils.json_stream import IncrementalJSONParser
 
 class LLMService:
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            # For development/testing without key, we might want to warn or handle gracefully
-            print("Warning: GEMINI_API_KEY not found in environment variables.")
-            self.model = None
-        else:
-            genai.configure(api_key=api_key)
-            self.model = genai.GenerativeModel('gemini-2.5-flash')
-
-    def generate_response(self, prompt_text, context=""):
+    # Defaults for packing several small inputs into one request
+    BATCH_TOKEN_BUDGET = 4000
+    BATCH_MAX_ITEMS = 20
+    BATCH_INSTRUCTIONS = (
+        "You will receive {count} separate items, each introduced by a line '=== Item <id> ==='. "
+        "Apply the task below to every item independently. Respond with a JSON object "
+        "{{\"results\": [...]}} holding one entry per item, each with an \"id\" field copied "
+        "from its header plus the requested fields."
+    )
+    # Sent once after a reply that is not valid JSON or does not match the response model
+    REPAIR_INSTRUCTIONS = (
+        "Your previous reply could not be used: {error}\n\nPrevious reply:\n{reply}\n\n"
+        "Reply again with only the corrected JSON."
+    )
+    REPAIR_REPLY_CHARS = 2000
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, cache=None, backend=None,
+                 controller=None):
+        load_env()
+        # The backend does the actual generation: Gemini by default, or the offline mock
+        self.backend = backend or create_backend()
+        self.model_name = self.backend.model_name if self.backend else None
+
+        # Shared across threads so concurrent processing stays within quota
+        self.rate_limiter = RateLimiter(
+            requests_per_minute=requests_per_minute or int(os.getenv("GEMINI_RPM", "0")),
+            tokens_per_minute=tokens_per_minute or int(os.getenv("GEMINI_TPM", "0"))
+        )
+
+        # Retries, adaptive concurrency and the circuit breaker, also shared across threads
+        self.controller = controller or CallController(
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+            base_delay=float(os.getenv("LLM_BACKOFF_BASE", "1.0")),
+            max_delay=float(os.getenv("LLM_BACKOFF_MAX", "60")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+            failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", "5")),
+            cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+        )
+
+        if cache is None and os.getenv("LLM_CACHE", "true").lower() != "false":
+            cache = LLMCache(ttl_seconds=int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))))
+        self.cache = cache
+
+    def _cache_key(self, full_prompt, generation_config=None, use_cache=True):
+        """Cache key for a request, or None when caching is disabled or bypassed."""
+        if not use_cache or not self.cache:
+            return None
+        return self.cache.make_key(self.model_name, full_prompt, generation_config)
+
+    def _generate(self, full_prompt, generation_config=None, stream=False, prompt_key=None):
+        """
+        Send a prompt to the backend once the rate limiter allows it, retrying
+        transient failures through the call controller.
+        Returns the response text, or an iterator of text chunks if `stream` is set.
+        """
+        def attempt():
+            self.rate_limiter.acquire(estimate_tokens(full_prompt))
+            if stream:
+                return self.backend.stream(full_prompt, generation_config)
+            return self.backend.generate(full_prompt, generation_config)
+
+        if stream:
+            return self.controller.stream(attempt, prompt_key)
+        return self.controller.call(attempt, prompt_key)
+
+    def _record(self, prompt_key, started, full_prompt, response_text, cache_status, error=None, streamed=False):
+        """Report one call to the metrics registry."""
+        record_llm_call(
+            prompt_key,
+            time.perf_counter() - started,
+            estimate_tokens(full_prompt),
+            estimate_tokens(response_text) if isinstance(response_text, str) else 0,
+            cache_status,
+            error=error,
+            streamed=streamed
+        )
+
+    def _cache_status(self, key):
+        return "miss" if key else "bypass"
+
+    @staticmethod
+    def _json_config(response_schema):
+        if not response_schema:
+            return None
+        return {
+            "response_mime_type": "application/json",
+            "response_schema": response_schema
+        }
+
+    @staticmethod
+    def _parse_json(text, response_model=None):
+        """
+        Parse a JSON reply, validated into `response_model` if given. Returns a dict;
+        raises ValueError (JSONDecodeError or pydantic's ValidationError) if it is unusable.
+        """
+        data = parse_json_response(text)
+        if response_model is not None:
+            return response_model.model_validate(data).model_dump()
+        return data
+
+    @staticmethod
+    def _describe_error(error):
+        """A short description of why a reply was rejected, for the repair prompt."""
+        if hasattr(error, "errors"):
+            return "; ".join(f"{'.'.join(str(part) for part in e['loc']) or 'reply'}: {e['msg']}"
+                             for e in error.errors()[:5])
+        if isinstance(error, json.JSONDecodeError):
+            return f"invalid JSON ({error.msg} at position {error.pos})"
+        return str(error)
+
+    def _repair(self, full_prompt, generation_config, reply, error, response_model=None, prompt_key=None):
+        """
+        Ask once for a corrected reply after an unusable one, quoting the problem.
+        Returns (text, result); raises ValueError if the new reply is unusable too,
+        or the backend's error if the request fails.
+        """
+        metrics.inc("llm_malformed_json_total", prompt_key=prompt_key or "adhoc")
+        started = time.perf_counter()
+        repair_prompt = f"{full_prompt}\n\n" + self.REPAIR_INSTRUCTIONS.format(
+            error=self._describe_error(error), reply=(reply or "")[:self.REPAIR_REPLY_CHARS]
+        )
+        text = None
+        try:
+            text = self._generate(repair_prompt, generation_config, prompt_key=prompt_key)
+            result = self._parse_json(text, response_model)
+        except Exception as e:
+            self._record(prompt_key, started, repair_prompt, text, "bypass", error=e)
+            metrics.inc("llm_json_repairs_total", prompt_key=prompt_key or "adhoc", outcome="failed")
+            raise
+        self._record(prompt_key, started, repair_prompt, text, "bypass")
+        metrics.inc("llm_json_repairs_total", prompt_key=prompt_key or "adhoc", outcome="fixed")
+        return text, result
+
+    def generate_response(self, prompt_text, context="", use_cache=True, prompt_key=None, raise_on_error=False):
         """
         Generate a response from the LLM.
+        Identical requests are served from the cache unless `use_cache` is False.
+        `prompt_key` labels the call in metrics. If the call still fails after
+        retries, an error message is returned, or the error raised with `raise_on_error`.
         """
-        if not self.model:
+        if not self.backend:
             return "Error: LLM not configured. Please check your API key."
 
+        started = time.perf_counter()
+        full_prompt = f"{prompt_text}\n\n{context}"
+        key = self._cache_key(full_prompt, use_cache=use_cache)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(prompt_key, started, full_prompt, cached, "hit")
+                return cached
+
         try:
-            full_prompt = f"{prompt_text}\n\n{context}"
-            response = self.model.generate_content(full_prompt)
-            return response.text
+            text = self._generate(full_prompt, prompt_key=prompt_key)
         except Exception as e:
+            self._record(prompt_key, started, full_prompt, None, self._cache_status(key), error=e)
+            if raise_on_error:
+                raise
             return f"Error generating response: {str(e)}"
 
-    def generate_json(self, prompt_text, context=""):
+        self._record(prompt_key, started, full_prompt, text, self._cache_status(key))
+        if key:
+            self.cache.set(key, text)
+        return text
+
+    def generate_response_stream(self, prompt_text, context="", use_cache=True, prompt_key=None):
+        """
+        Generate a response from the LLM, yielding text chunks as they arrive.
+        A cached response is yielded as a single chunk; the full text is cached once complete.
+        """
+        if not self.backend:
+            yield "Error: LLM not configured. Please check your API key."
+            return
+
+        started = time.perf_counter()
+        full_prompt = f"{prompt_text}\n\n{context}"
+        key = self._cache_key(full_prompt, use_cache=use_cache)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(prompt_key, started, full_prompt, cached, "hit", streamed=True)
+                yield cached
+                return
+
+        parts = []
+        try:
+            for text in self._generate(full_prompt, stream=True, prompt_key=prompt_key):
+                if not parts:
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - started,
+                                    prompt_key=prompt_key or "adhoc")
+                parts.append(text)
+                yield text
+        except Exception as e:
+            self._record(prompt_key, started, full_prompt, "".join(parts), self._cache_status(key),
+                         error=e, streamed=True)
+            yield f"Error generating response: {str(e)}"
+            return
+
+        text = "".join(parts)
+        self._record(prompt_key, started, full_prompt, text, self._cache_status(key), streamed=True)
+        if key:
+            self.cache.set(key, text)
+
+    def generate_json(self, prompt_text, context="", response_schema=None, response_model=None, use_cache=True,
+                      prompt_key=None, raise_on_error=False):
         """
         Generate a JSON response from the LLM.
+        If `response_schema` is given, the model is constrained to JSON matching it
+        (native structured output). With `response_model`, a pydantic model, the
+        reply is validated into it and returned as a dict. A reply that does not
+        parse or validate gets one repair request quoting the problem.
+        Only valid results are cached. Returns {} on failure; with `raise_on_error`,
+        backend errors that outlast the retries are raised instead.
         """
-        if not self.model:
+        if not self.backend:
             return {}
 
+        started = time.perf_counter()
+        generation_config = self._json_config(response_schema)
+        full_prompt = f"{prompt_text}\n\n{context}\n\nIMPORTANT: Respond with valid JSON only."
+        key = self._cache_key(full_prompt, generation_config, use_cache)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(prompt_key, started, full_prompt, json.dumps(cached), "hit")
+                # Callers may mutate the result, so never hand out the cached object
+                return copy.deepcopy(cached)
+
+        text = None
         try:
-            full_prompt = f"{prompt_text}\n\n{context}\n\nIMPORTANT: Respond with valid JSON only."
-            response = self.model.generate_content(full_prompt)
-            json_str = extract_json_from_text(response.text)
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            print(f"Failed to decode JSON from LLM response: {response.text}")
+            text = self._generate(full_prompt, generation_config, prompt_key=prompt_key)
+        except Exception as e:
+            self._record(prompt_key, started, full_prompt, text, self._cache_status(key), error=e)
+            if raise_on_error:
+                raise
+            print(f"Error generating JSON: {str(e)}")
+            return {}
+        self._record(prompt_key, started, full_prompt, text, self._cache_status(key))
+
+        try:
+            try:
+                result = self._parse_json(text, response_model)
+            except ValueError as e:
+                text, result = self._repair(full_prompt, generation_config, text, e, response_model, prompt_key)
+        except ValueError:
+            print(f"Failed to get valid JSON from LLM response: {(text or '')[:200]}")
             return {}
         except Exception as e:
+            if raise_on_error:
+                raise
             print(f"Error generating JSON: {str(e)}")
             return {}
+
+        if key and result:
+            self.cache.set(key, copy.deepcopy(result))
+        return result
+
+    def generate_json_stream(self, prompt_text, context="", response_schema=None, response_model=None,
+                             use_cache=True, prompt_key=None):
+        """
+        Generate a JSON response, yielding progressively more complete partial
+        objects as the reply streams in. The last value yielded is the final result,
+        validated and repaired like generate_json's. Partial values are the stream
+        parser's own object, updated in place by later chunks; copy one to keep it.
+        """
+        if not self.backend:
+            yield {}
+            return
+
+        started = time.perf_counter()
+        generation_config = self._json_config(response_schema)
+        full_prompt = f"{prompt_text}\n\n{context}\n\nIMPORTANT: Respond with valid JSON only."
+        key = self._cache_key(full_prompt, generation_config, use_cache)
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                self._record(prompt_key, started, full_prompt, json.dumps(cached), "hit", streamed=True)
+                yield copy.deepcopy(cached)
+                return
+
+        parser = IncrementalJSONParser()
+        first = True
+        try:
+            for text in self._generate(full_prompt, generation_config, stream=True, prompt_key=prompt_key):
+                if first:
+                    first = False
+                    metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - started,
+                                    prompt_key=prompt_key or "adhoc")
+                partial = parser.feed(text)
+                if partial is not None and parser.changed:
+                    yield partial
+        except Exception as e:
+            self._record(prompt_key, started, full_prompt, parser.buffer, self._cache_status(key),
+                         error=e, streamed=True)
+            print(f"Error generating JSON: {str(e)}")
+            yield {}
+            return
+
+        text = parser.buffer
+        self._record(prompt_key, started, full_prompt, text, self._cache_status(key), streamed=True)
+        try:
+            try:
+                result = self._parse_json(text, response_model)
+            except ValueError as e:
+                _, result = self._repair(full_prompt, generation_config, text, e, response_model, prompt_key)
+        except Exception as e:
+            print(f"Failed to get valid JSON from LLM response: {text[:200]} ({e})")
+            yield {}
+            return
+
+        if key and result:
+            self.cache.set(key, copy.deepcopy(result))
+        yield result
+
+    def plan_batches(self, prompt_text, items, token_budget=None, max_items=None):
+        """
+        Split (item_id, text) pairs into groups whose packed prompt fits `token_budget`.
+        """
+        token_budget = token_budget or self.BATCH_TOKEN_BUDGET
+        max_items = max_items or self.BATCH_MAX_ITEMS
+        overhead = estimate_tokens(prompt_text) + estimate_tokens(self.BATCH_INSTRUCTIONS)
+
+        batches = []
+        current = []
+        used = overhead
+        for item_id, text in items:
+            cost = estimate_tokens(text) + estimate_tokens(str(item_id)) + 8
+            if current and (used + cost > token_budget or len(current) >= max_items):
+                batches.append(current)
+                current = []
+                used = overhead
+            current.append((item_id, text))
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def generate_json_batch(self, prompt_text, items, response_schema=None, response_model=None, validate=None,
+                            token_budget=None, max_items=None, use_cache=True, prompt_key=None,
+                            raise_on_error=False):
+        """
+        Run one JSON prompt over many (item_id, text) pairs, packing several items into
+        each request. Returns a dict mapping item_id to its parsed result.
+
+        Each item's entry is validated into `response_model` on its own. Items missing
+        from a batched reply, invalid, or rejected by `validate`, are retried
+        individually with generate_json. `raise_on_error` is passed on to it.
+        """
+        results = {}
+        if not items:
+            return results
+
+        batch_schema = None
+        if response_schema:
+            item_schema = dict(response_schema)
+            item_schema["properties"] = {"id": {"type": "string"}, **response_schema.get("properties", {})}
+            item_schema["required"] = ["id"] + list(response_schema.get("required", []))
+            batch_schema = {
+                "type": "object",
+                "properties": {"results": {"type": "array", "items": item_schema}},
+                "required": ["results"]
+            }
+
+        for batch in self.plan_batches(prompt_text, items, token_budget, max_items):
+            if len(batch) > 1:
+                results.update(self._run_batch(prompt_text, batch, batch_schema, response_model, use_cache,
+                                               prompt_key, raise_on_error))
+
+            # Retry anything the batch did not answer properly, one item at a time
+            for item_id, text in batch:
+                result = results.get(item_id)
+                if result is None or (validate and not validate(result)):
+                    if len(batch) > 1:
+                        metrics.inc("llm_batch_item_retries_total", prompt_key=prompt_key or "adhoc")
+                    results[item_id] = self.generate_json(
+                        prompt_text, text, response_schema=response_schema, response_model=response_model,
+                        use_cache=use_cache, prompt_key=prompt_key, raise_on_error=raise_on_error
+                    )
+        return results
+
+    def _run_batch(self, prompt_text, batch, batch_schema, response_model=None, use_cache=True, prompt_key=None,
+                   raise_on_error=False):
+        """Send one packed batch and demultiplex the reply by item id."""
+        blocks = [f"=== Item {item_id} ===\n{text}" for item_id, text in batch]
+        instructions = self.BATCH_INSTRUCTIONS.format(count=len(batch))
+        response = self.generate_json(
+            f"{instructions}\n\n{prompt_text}",
+            "\n\n".join(blocks),
+            response_schema=batch_schema,
+            use_cache=use_cache,
+            prompt_key=f"{prompt_key or 'adhoc'}_batch",
+            raise_on_error=raise_on_error
+        )
+
+        entries = response.get("results") if isinstance(response, dict) else None
+        if not isinstance(entries, list):
+            return {}
+
+        wanted = {str(item_id): item_id for item_id, _ in batch}
+        results = {}
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            item_id = wanted.get(str(entry.get("id")))
+            if item_id is None or item_id in results:
+                continue
+            result = {k: v for k, v in entry.items() if k != "id"}
+            if response_model is not None:
+                try:
+                    result = response_model.model_validate(result).model_dump()
+                except ValueError:
+                    continue
+            results[item_id] = result
+        return results
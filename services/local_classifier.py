@@ -0,0 +1,188 @@
+import math
+import random
+import re
+import threading
+from collections import Counter, namedtuple
+from email.utils import parseaddr
+from models.analysis import CATEGORIES
+from services.metrics import metrics
+from services.search_index import tokenize
+
+# (field, pattern, category, confidence, no_actions); the sender field is the bare lowercase
+# address and patterns match case-insensitively. A rule below the classifier's threshold is never
+# acted on. Rules with no_actions=False only settle the category: automated senders (GitHub, Jira)
+# and mail with an unsubscribe link can still ask for something, so their action items are extracted.
+RULES = [
+    ("sender", r"^(newsletter|news|digest|weekly)@", "Newsletter", 0.99, True),
+    ("sender", r"^(spam|promo|promotions|deals|offers)@", "Spam", 0.99, True),
+    ("sender", r"@(offers|deals|promo|promotions|prizes)\.", "Spam", 0.99, True),
+    ("sender", r"^(no-?reply|do-?not-?reply|notifications?|alerts?|mailer-daemon)@", "Newsletter", 0.97, False),
+    ("body", r"\bunsubscribe\b", "Newsletter", 0.97, False),
+]
+
+# Categories whose emails rarely carry action items: a confident label skips the LLM entirely,
+# unless it came from a rule with no_actions=False
+NO_ACTION_CATEGORIES = {"Newsletter", "Spam"}
+
+# Provenance "prompt" recorded for fields filled by the local classifier
+LOCAL_SOURCE = "local"
+
+Prediction = namedtuple("Prediction", "category confidence source accepted audited no_actions")
+
+class LocalClassifier:
+    """
+    Categorizes emails without the LLM: sender/body rules first, then a
+    multinomial naive Bayes model trained on the categories the LLM assigned.
+    The model only looks at header fields, so it can be trained from email
+    headers without loading bodies.
+
+    decide() accepts a prediction when its confidence reaches `threshold`.
+    A random `audit_rate` share of confident predictions is still sent to the
+    LLM so that agreement on accepted labels can be measured.
+    """
+
+    # Sender features count as this many tokens
+    SENDER_WEIGHT = 3
+    # Naive Bayes posteriors are overconfident on long texts; the log-likelihood is
+    # rescaled as if every email carried this many tokens of evidence
+    EVIDENCE_TOKENS = 20
+
+    def __init__(self, threshold=0.95, min_training=30, audit_rate=0.05, rules=None, seed=None):
+        self.threshold = threshold
+        self.min_training = min_training
+        self.audit_rate = audit_rate
+        self.rules = [(field, re.compile(pattern, re.IGNORECASE), category, confidence, no_actions)
+                      for field, pattern, category, confidence, no_actions in (rules or RULES)]
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._labels = {}             # email id -> category it was learned with
+        self._doc_counts = Counter()  # category -> training emails
+        self._term_counts = {}        # category -> term -> count
+        self._term_totals = Counter() # category -> summed term count
+        self._vocab = Counter()       # term -> count over all categories
+        self.counts = Counter()
+
+    @staticmethod
+    def _address(sender):
+        return (parseaddr(sender or "")[1] or sender or "").lower()
+
+    def features(self, email):
+        """Term counts for an email or header: weighted sender address and domain, and subject terms."""
+        address = self._address(email.sender)
+        tokens = [f"from:{address}", f"domain:{address.rpartition('@')[2]}"] * self.SENDER_WEIGHT
+        tokens += [f"subject:{term}" for term in tokenize(email.subject)]
+        return Counter(tokens)
+
+    @property
+    def trained(self):
+        return len(self._labels)
+
+    def learn(self, email, category):
+        """Train on a category the LLM assigned. Re-learning an email replaces its old label."""
+        if category not in CATEGORIES:
+            return
+        with self._lock:
+            previous = self._labels.get(email.id)
+            if previous == category:
+                return
+            features = self.features(email)
+            if previous:
+                self._update(features, previous, -1)
+            self._update(features, category, 1)
+            self._labels[email.id] = category
+
+    def _update(self, features, category, sign):
+        self._doc_counts[category] += sign
+        counts = self._term_counts.setdefault(category, Counter())
+        for term, n in features.items():
+            counts[term] += sign * n
+            self._vocab[term] += sign * n
+            if counts[term] <= 0:
+                del counts[term]
+            if self._vocab[term] <= 0:
+                del self._vocab[term]
+        self._term_totals[category] += sign * sum(features.values())
+
+    def predict(self, email):
+        """
+        Return (category, confidence, source, no_actions); source is "rule", "model" or
+        "untrained", and no_actions says whether the label means the email has no action items.
+        """
+        address = self._address(email.sender)
+        for field, pattern, category, confidence, no_actions in self.rules:
+            value = address if field == "sender" else getattr(email, field, None) or ""
+            if pattern.search(value):
+                return category, confidence, "rule", no_actions and category in NO_ACTION_CATEGORIES
+
+        with self._lock:
+            classes = [c for c in CATEGORIES if self._doc_counts[c] > 0]
+            if self.trained < self.min_training or len(classes) < 2:
+                return None, 0.0, "untrained", False
+
+            features = {t: n for t, n in self.features(email).items() if t in self._vocab}
+            evidence = sum(features.values())
+            scale = self.EVIDENCE_TOKENS / evidence if evidence > self.EVIDENCE_TOKENS else 1.0
+            vocab_size = len(self._vocab) + 1
+            scores = {}
+            for category in classes:
+                counts = self._term_counts[category]
+                denominator = self._term_totals[category] + vocab_size
+                likelihood = sum(n * math.log((counts.get(t, 0) + 1) / denominator) for t, n in features.items())
+                scores[category] = math.log(self._doc_counts[category] / self.trained) + scale * likelihood
+
+        best = max(scores, key=scores.get)
+        confidence = 1 / sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, confidence, "model", best in NO_ACTION_CATEGORIES
+
+    def decide(self, email):
+        """Predict a category and decide whether to use it instead of asking the LLM."""
+        category, confidence, source, no_actions = self.predict(email)
+        confident = category is not None and confidence >= self.threshold
+        audited = confident and self._rng.random() < self.audit_rate
+        accepted = confident and not audited
+        outcome = "accepted" if accepted else "audited" if audited else "deferred"
+        with self._lock:
+            self.counts[outcome] += 1
+        metrics.inc("local_classifier_decisions_total", outcome=outcome, source=source)
+        return Prediction(category, confidence, source, accepted, audited, no_actions)
+
+    def record_skipped(self):
+        """Count an accepted prediction that settled the email with no LLM call at all."""
+        with self._lock:
+            self.counts["skipped"] += 1
+        metrics.inc("local_classifier_llm_skipped_total")
+
+    def record_outcome(self, prediction, llm_category):
+        """Compare a prediction that was sent to the LLM with the category the LLM returned."""
+        if prediction.category is None or llm_category not in CATEGORIES:
+            return
+        confident = "confident" if prediction.confidence >= self.threshold else "unsure"
+        agree = prediction.category == llm_category
+        with self._lock:
+            self.counts[f"{confident}_compared"] += 1
+            self.counts[f"{confident}_agreed"] += agree
+        metrics.inc("local_classifier_agreement_total", confidence=confident, agree=str(agree).lower())
+
+    def stats(self):
+        """Decision counts, training size and agreement with the LLM."""
+        with self._lock:
+            counts = dict(self.counts)
+            trained = self.trained
+        decided = sum(counts.get(k, 0) for k in ("accepted", "audited", "deferred"))
+
+        def rate(prefix):
+            compared = counts.get(f"{prefix}_compared", 0)
+            return counts.get(f"{prefix}_agreed", 0) / compared if compared else None
+
+        return {
+            "trained": trained,
+            "accepted": counts.get("accepted", 0),
+            "audited": counts.get("audited", 0),
+            "deferred": counts.get("deferred", 0),
+            "skipped": counts.get("skipped", 0),
+            "skip_rate": counts.get("skipped", 0) / decided if decided else 0.0,
+            "confident_agreement": rate("confident"),
+            "confident_compared": counts.get("confident_compared", 0),
+            "unsure_agreement": rate("unsure"),
+            "unsure_compared": counts.get("unsure_compared", 0),
+        }
@@ -0,0 +1,227 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+class MetricsRegistry:
+    """
+    Thread-safe counters and latency histograms for LLM calls and storage I/O,
+    exportable as Prometheus text or JSON.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    MAX_SAMPLES = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> {"count", "sum", "buckets", "samples"}
+        self.events = deque(maxlen=200)
+        self._exporters_started = False
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+    def inc(self, name, value=1, **labels):
+        """Add `value` to a counter."""
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Record one observation (in seconds) in a histogram."""
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = {"count": 0, "sum": 0.0, "buckets": [0] * len(self.BUCKETS),
+                        "samples": deque(maxlen=self.MAX_SAMPLES)}
+                self._histograms[key] = hist
+            hist["count"] += 1
+            hist["sum"] += value
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["samples"].append(value)
+
+    def record_event(self, kind, **fields):
+        """Keep a bounded log of recent calls for the diagnostics page."""
+        fields["kind"] = kind
+        fields["time"] = time.time()
+        with self._lock:
+            self.events.append(fields)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.events.clear()
+
+    @staticmethod
+    def _quantile(samples, q):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * (len(ordered) - 1) + 0.5))]
+
+    def snapshot(self):
+        """Return every metric as plain data, with p50/p95/p99 over recent samples."""
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in self._counters.items()]
+            histograms = []
+            for (name, labels), hist in self._histograms.items():
+                samples = list(hist["samples"])
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": hist["count"],
+                    "sum": hist["sum"],
+                    "p50": self._quantile(samples, 0.50),
+                    "p95": self._quantile(samples, 0.95),
+                    "p99": self._quantile(samples, 0.99),
+                })
+            events = list(self.events)
+        return {"counters": counters, "histograms": histograms, "events": events}
+
+    @staticmethod
+    def _format_labels(labels, extra=None):
+        items = list(labels) + list(extra or [])
+        if not items:
+            return ""
+        escaped = []
+        for k, v in items:
+            value = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{k}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def to_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            seen = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} counter")
+                    seen.add(name)
+                lines.append(f"{name}{self._format_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self._histograms.items(), key=lambda kv: kv[0]):
+                if name not in seen:
+                    lines.append(f"# TYPE {name} histogram")
+                    seen.add(name)
+                for bound, count in zip(self.BUCKETS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{self._format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_files(self, directory):
+        """Write metrics.prom and metrics.json into a directory."""
+        os.makedirs(directory, exist_ok=True)
+        for name, content in (("metrics.prom", self.to_prometheus()),
+                              ("metrics.json", json.dumps(self.snapshot(), indent=2, default=str))):
+            path = os.path.join(directory, name)
+            with open(f"{path}.tmp", "w") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+    def start_exporters(self, export_dir=None, port=None, interval=15, host="127.0.0.1"):
+        """
+        Start background exporters once per process: periodic file export to
+        `export_dir` and/or an HTTP server on `host`:`port` serving /metrics and
+        /metrics.json. The server only listens locally unless `host` says otherwise,
+        since the metrics include error messages.
+        """
+        with self._lock:
+            if self._exporters_started:
+                return
+            self._exporters_started = True
+
+        if export_dir:
+            def export_loop():
+                while True:
+                    try:
+                        self.write_files(export_dir)
+                    except Exception as e:
+                        print(f"Error exporting metrics: {e}")
+                    time.sleep(interval)
+            threading.Thread(target=export_loop, name="metrics-export", daemon=True).start()
+
+        if port:
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            registry = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path == "/metrics":
+                        body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4"
+                    elif self.path == "/metrics.json":
+                        body, content_type = json.dumps(registry.snapshot(), default=str), "application/json"
+                    else:
+                        self.send_error(404)
+                        return
+                    data = body.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", content_type)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, *args):
+                    pass
+
+            try:
+                server = ThreadingHTTPServer((host, int(port)), Handler)
+            except OSError as e:
+                print(f"Error starting metrics server on port {port}: {e}")
+                return
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+
+    def start_exporters_from_env(self):
+        """Start exporters configured by METRICS_EXPORT_DIR, METRICS_PORT and METRICS_HOST."""
+        self.start_exporters(
+            export_dir=os.getenv("METRICS_EXPORT_DIR"),
+            port=os.getenv("METRICS_PORT"),
+            interval=int(os.getenv("METRICS_EXPORT_INTERVAL", "15")),
+            host=os.getenv("METRICS_HOST", "127.0.0.1")
+        )
+
+# Process-wide registry shared by every service
+metrics = MetricsRegistry()
+
+def record_llm_call(prompt_key, latency, prompt_tokens, response_tokens, cache, error=None, streamed=False):
+    """Record one LLM request: latency, token counts, cache status and errors."""
+    prompt_key = prompt_key or "adhoc"
+    status = "error" if error else "ok"
+    metrics.inc("llm_requests_total", prompt_key=prompt_key, cache=cache, status=status)
+    if cache != "hit":
+        metrics.observe("llm_request_seconds", latency, prompt_key=prompt_key)
+    metrics.inc("llm_prompt_tokens_total", prompt_tokens, prompt_key=prompt_key)
+    metrics.inc("llm_response_tokens_total", response_tokens, prompt_key=prompt_key)
+    metrics.record_event(
+        "llm", prompt_key=prompt_key, latency=round(latency, 4), prompt_tokens=prompt_tokens,
+        response_tokens=response_tokens, cache=cache, streamed=streamed,
+        error=str(error) if error else None
+    )
+
+def record_retry(prompt_key, error, delay):
+    """Record one retried LLM attempt and the backoff before the next one."""
+    prompt_key = prompt_key or "adhoc"
+    metrics.inc("llm_retries_total", prompt_key=prompt_key)
+    metrics.observe("llm_backoff_seconds", delay, prompt_key=prompt_key)
+    metrics.record_event("retry", prompt_key=prompt_key, delay=round(delay, 4), error=str(error))
+
+def record_io(operation, collection, duration, nbytes=None, error=None):
+    """Record one storage load/save: duration, bytes and errors."""
+    status = "error" if error else "ok"
+    metrics.inc("storage_operations_total", operation=operation, collection=collection, status=status)
+    metrics.observe("storage_seconds", duration, operation=operation, collection=collection)
+    if nbytes:
+        metrics.inc("storage_bytes_total", nbytes, operation=operation, collection=collection)
+    metrics.record_event(
+        "io", operation=operation, collection=collection, latency=round(duration, 4),
+        bytes=nbytes, error=str(error) if error else None
+    )
@@ -1,36 +1,47 @@
-import json
 import os
+import threading
 from models.prompt import Prompt
+from services.storage import create_repository
 
 class PromptManager:
-    def __init__(self, prompts_file="data/prompts.json"):
+    def __init__(self, prompts_file="data/prompts.json", repository=None):
         # Use path relative to this file's directory
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.prompts_file = os.path.join(base_dir, prompts_file)
+        self.repository = repository or create_repository("prompts", self.prompts_file)
+        self._lock = threading.RLock()
+        self._data_version = None
         self.prompts = self.load_prompts()
 
+    def refresh(self):
+        """Reload prompts if the backing store changed since they were last loaded or saved."""
+        with self._lock:
+            if self.repository.version() == self._data_version:
+                return False
+            self.prompts = self.load_prompts()
+            return True
+
     def load_prompts(self):
-        """Load prompts from JSON file."""
-        if not os.path.exists(self.prompts_file):
-            return {}
-        
+        """Load prompts from the repository."""
         try:
-            with open(self.prompts_file, 'r') as f:
-                data = json.load(f)
-                prompts = {}
-                for key, value in data.items():
-                    prompts[key] = Prompt(**value)
-                return prompts
+            self._data_version = self.repository.version()
+            prompts = {}
+            for key, value in self.repository.load().items():
+                prompts[key] = Prompt(**value)
+            return prompts
         except Exception as e:
             print(f"Error loading prompts: {e}")
             return {}
 
-    def save_prompts(self):
-        """Save prompts to JSON file."""
+    def save_prompts(self, keys=None):
+        """Save prompts to the repository; only the given keys are written if provided."""
         try:
-            data = {k: v.to_dict() for k, v in self.prompts.items()}
-            with open(self.prompts_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with self._lock:
+                if keys is None:
+                    self.repository.save_all({k: v.to_dict() for k, v in self.prompts.items()})
+                else:
+                    self.repository.upsert({k: self.prompts[k].to_dict() for k in keys})
+                self._data_version = self.repository.version()
             return True
         except Exception as e:
             print(f"Error saving prompts: {e}")
@@ -42,9 +53,10 @@ class PromptManager:
 
     def update_prompt(self, key, template):
         """Update a prompt template."""
-        if key in self.prompts:
-            self.prompts[key].template = template
-            return self.save_prompts()
+        with self._lock:
+            if key in self.prompts:
+                self.prompts[key].template = template
+                return self.save_prompts([key])
         return False
 
     def get_all_prompts(self):
@@ -0,0 +1,55 @@
+import threading
+import time
+from collections import deque
+
+class RateLimiter:
+    """Thread-safe sliding-window limiter for requests and tokens per minute."""
+
+    WINDOW_SECONDS = 60.0
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute or None
+        self.tokens_per_minute = tokens_per_minute or None
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.requests_per_minute or self.tokens_per_minute)
+
+    def _prune(self, now):
+        while self._events and now - self._events[0][0] >= self.WINDOW_SECONDS:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _wait_time(self, tokens, now):
+        """Seconds until a request of `tokens` fits, or 0 if it fits now."""
+        if not self._events:
+            return 0
+        if self.requests_per_minute and len(self._events) >= self.requests_per_minute:
+            return self._events[0][0] + self.WINDOW_SECONDS - now
+        if self.tokens_per_minute and self._tokens_in_window + tokens > self.tokens_per_minute:
+            # Wait for enough old requests to leave the window
+            freed = 0
+            for timestamp, event_tokens in self._events:
+                freed += event_tokens
+                if self._tokens_in_window - freed + tokens <= self.tokens_per_minute:
+                    return timestamp + self.WINDOW_SECONDS - now
+            return self._events[-1][0] + self.WINDOW_SECONDS - now
+        return 0
+
+    def acquire(self, tokens=0):
+        """Block until a request carrying `tokens` input tokens fits the budget."""
+        if not self.enabled:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._prune(now)
+                wait = self._wait_time(tokens, now)
+                if wait <= 0:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+            time.sleep(min(max(wait, 0.01), 1.0))
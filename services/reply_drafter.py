@@ -0,0 +1,105 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from services.call_controller import CircuitOpenError
+from utils.helpers import chunked
+
+# Categories drafted by default: the ones that usually need an answer
+REPLY_CATEGORIES = ("To-Do", "Important")
+
+class ReplyDrafter:
+    """
+    Drafts replies for many emails at once with the "auto_reply" prompt.
+
+    LLM calls run concurrently (rate limited by the shared LLMService), and the
+    drafts are written with one batched DraftManager write per `batch_size`
+    replies. Emails that already have a draft are skipped, so an interrupted
+    run picks up where it stopped.
+    """
+
+    def __init__(self, email_processor, draft_manager, llm_service=None, prompt_manager=None):
+        self.email_processor = email_processor
+        self.draft_manager = draft_manager
+        self.llm_service = llm_service or email_processor.llm_service
+        self.prompt_manager = prompt_manager or email_processor.prompt_manager
+
+    def pending(self, categories=REPLY_CATEGORIES):
+        """Headers of emails in `categories` without a draft reply, category by category."""
+        self.draft_manager.refresh()
+        return [header for category in dict.fromkeys(categories)
+                for header in self.email_processor.get_emails_by_category(category)
+                if not self.draft_manager.has_draft(header.id)]
+
+    def draft_reply(self, email, instructions="Polite and professional.", tone="Professional"):
+        """Generate the body of a reply to one email; raises if the LLM call fails."""
+        prompt = self.prompt_manager.get_prompt("auto_reply")
+        filled_template = prompt.template.format(
+            user_instructions=f"{instructions}. Tone: {tone}",
+            sender=email.sender,
+            subject=email.subject,
+            body=self.email_processor.prompt_body(email, "auto_reply")
+        )
+        return self.llm_service.generate_response(filled_template, prompt_key="auto_reply", raise_on_error=True)
+
+    def draft_replies(self, categories=REPLY_CATEGORIES, instructions="Polite and professional.",
+                      tone="Professional", max_workers=None, batch_size=None, progress_callback=None):
+        """
+        Draft a reply for every email in `categories` that has none yet.
+        `progress_callback(done, total)` is called after each email. Returns
+        (drafted, failed); failed emails have no draft and are retried next run.
+        """
+        prompt = self.prompt_manager.get_prompt("auto_reply")
+        if not prompt:
+            print("Missing auto_reply prompt")
+            return 0, 0
+        max_workers = max_workers or int(os.getenv("PROCESSING_CONCURRENCY", "4"))
+        batch_size = batch_size or int(os.getenv("PROCESSING_BATCH_SIZE", "25"))
+        headers = self.pending(categories)
+        total = len(headers)
+        metadata = {"prompt": "auto_reply", "version": prompt.version}
+
+        done = 0
+        drafted = 0
+        uncommitted = []
+
+        def commit():
+            nonlocal drafted
+            self.draft_manager.create_drafts(uncommitted)
+            drafted += len(uncommitted)
+            uncommitted.clear()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk_ids in chunked([h.id for h in headers], self.email_processor.PROCESSING_CHUNK):
+                futures = {
+                    executor.submit(self.draft_reply, email, instructions, tone): email
+                    for email in self.email_processor.get_emails(chunk_ids, cache=False)
+                }
+                stopped = False
+                for future in as_completed(futures):
+                    email = futures[future]
+                    done += 1
+                    if future.cancelled():
+                        continue
+                    try:
+                        uncommitted.append({
+                            "subject": f"Re: {email.subject}",
+                            "body": future.result(),
+                            "email_id": email.id,
+                            "metadata": metadata
+                        })
+                    except Exception as e:
+                        print(f"Error drafting reply to {email.id}: {e}")
+                        if isinstance(e, CircuitOpenError) and not stopped:
+                            # The backend is unavailable; leave the rest for the next run
+                            stopped = True
+                            for pending_future in futures:
+                                pending_future.cancel()
+                    if len(uncommitted) >= batch_size:
+                        commit()
+                    if progress_callback:
+                        progress_callback(done, total)
+                if stopped:
+                    break
+
+        if uncommitted:
+            commit()
+        return drafted, total - drafted
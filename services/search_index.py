@@ -0,0 +1,267 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from services.metrics import record_io
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+QUERY_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+
+# Query prefixes accepted for field-scoped search
+FIELD_ALIASES = {
+    "from": "sender",
+    "sender": "sender",
+    "subject": "subject",
+    "body": "body",
+    "category": "category",
+    "action": "actions",
+    "actions": "actions",
+}
+
+def tokenize(text):
+    """Lowercase text and split it into alphanumeric tokens."""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+class SearchIndex:
+    """
+    Positional inverted index with BM25 ranking over several weighted fields.
+
+    Documents are added with a dict of field -> text. Queries support free terms,
+    "quoted phrases" and field scopes such as from:alice or category:to-do. Every
+    clause must match; matches are ranked by the summed per-field BM25 score.
+    """
+
+    FIELD_WEIGHTS = {"subject": 2.0, "sender": 1.5, "category": 1.0, "actions": 1.0, "body": 1.0}
+    K1 = 1.2
+    B = 0.75
+    FORMAT_VERSION = 1
+
+    def __init__(self, index_file=None):
+        self.index_file = index_file
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self.postings = {field: {} for field in self.FIELD_WEIGHTS}  # field -> term -> {doc_id: [positions]}
+        self.lengths = {field: {} for field in self.FIELD_WEIGHTS}   # field -> doc_id -> token count
+        self.totals = {field: 0 for field in self.FIELD_WEIGHTS}     # field -> summed token count
+        self.doc_terms = {}                                           # doc_id -> field -> distinct terms
+        self.fingerprints = {}                                        # doc_id -> content hash
+        self.source_version = None                                    # data version the index reflects
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+    @staticmethod
+    def fingerprint(fields):
+        payload = json.dumps(fields, sort_keys=True)
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def add(self, doc_id, fields):
+        """Index or re-index a document. Unchanged documents are skipped."""
+        fingerprint = self.fingerprint(fields)
+        with self._lock:
+            if self.fingerprints.get(doc_id) == fingerprint:
+                return False
+            self._remove(doc_id)
+            terms = {}
+            for field in self.FIELD_WEIGHTS:
+                tokens = tokenize(fields.get(field))
+                self.lengths[field][doc_id] = len(tokens)
+                self.totals[field] += len(tokens)
+                postings = self.postings[field]
+                for position, term in enumerate(tokens):
+                    postings.setdefault(term, {}).setdefault(doc_id, []).append(position)
+                terms[field] = list(dict.fromkeys(tokens))
+            self.doc_terms[doc_id] = terms
+            self.fingerprints[doc_id] = fingerprint
+            self.dirty = True
+            return True
+
+    def remove(self, doc_id):
+        """Remove a document from the index."""
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        if doc_id not in self.fingerprints:
+            return
+        terms = self.doc_terms.pop(doc_id, {})
+        for field in self.FIELD_WEIGHTS:
+            self.totals[field] -= self.lengths[field].pop(doc_id, 0)
+            postings = self.postings[field]
+            for term in terms.get(field, ()):
+                docs = postings.get(term)
+                if docs is None:
+                    continue
+                docs.pop(doc_id, None)
+                if not docs:
+                    del postings[term]
+        del self.fingerprints[doc_id]
+        self.dirty = True
+
+    def mark_synced(self, source_version):
+        """Record the version of the source data this index now reflects; saved with the index."""
+        source_version = json.loads(json.dumps(source_version))
+        with self._lock:
+            if self.source_version != source_version:
+                self.source_version = source_version
+                self.dirty = True
+
+    def clear(self):
+        """Drop every document; the next save() writes an empty index."""
+        with self._lock:
+            self._reset()
+            self.dirty = True
+
+    def retain(self, doc_ids):
+        """Drop every indexed document whose id is not in `doc_ids`."""
+        with self._lock:
+            for doc_id in [d for d in self.fingerprints if d not in doc_ids]:
+                self._remove(doc_id)
+
+    def _parse(self, query):
+        """Split a query into (field or None, terms, is_phrase) clauses."""
+        clauses = []
+        for prefix, quoted, word in QUERY_RE.findall(query):
+            field = FIELD_ALIASES.get(prefix.lower()) if prefix else None
+            text = quoted if quoted else word
+            if prefix and not field:
+                # Unknown prefix such as "re:" is part of the search text
+                text = f"{prefix} {text}"
+            terms = tokenize(text)
+            if terms:
+                clauses.append((field, terms, bool(quoted) or len(terms) > 1))
+        return clauses
+
+    def _term_scores(self, field, term, doc_ids=None):
+        """BM25 contribution of one term in one field, as doc_id -> score."""
+        docs = self.postings[field].get(term)
+        if not docs:
+            return {}
+        n = len(self.fingerprints)
+        idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+        avg = self.totals[field] / n if n else 0
+        weight = self.FIELD_WEIGHTS[field]
+        lengths = self.lengths[field]
+        scores = {}
+        for doc_id in (doc_ids if doc_ids is not None else docs):
+            positions = docs.get(doc_id)
+            if not positions:
+                continue
+            tf = len(positions)
+            norm = 1 - self.B + self.B * (lengths[doc_id] / avg if avg else 0)
+            scores[doc_id] = weight * idf * tf * (self.K1 + 1) / (tf + self.K1 * norm)
+        return scores
+
+    def _phrase_docs(self, field, terms):
+        """Documents where `terms` appear consecutively in `field`."""
+        postings = [self.postings[field].get(term) for term in terms]
+        if not all(postings):
+            return set()
+        candidates = set.intersection(*(set(p) for p in postings))
+        matches = set()
+        for doc_id in candidates:
+            starts = set(postings[0][doc_id])
+            for offset, term_postings in enumerate(postings[1:], start=1):
+                starts &= {p - offset for p in term_postings[doc_id]}
+                if not starts:
+                    break
+            if starts:
+                matches.add(doc_id)
+        return matches
+
+    def _clause_scores(self, field, terms, is_phrase):
+        scores = {}
+        for f in ([field] if field else self.FIELD_WEIGHTS):
+            doc_ids = self._phrase_docs(f, terms) if is_phrase else None
+            if doc_ids is not None and not doc_ids:
+                continue
+            for term in terms:
+                for doc_id, score in self._term_scores(f, term, doc_ids).items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + score
+        return scores
+
+    def search(self, query, limit=None, match_all=True):
+        """
+        Return doc ids matching the query, best first. With `match_all` every clause
+        must match; otherwise any matching clause is enough (ranked retrieval).
+        """
+        clauses = self._parse(query)
+        if not clauses:
+            return []
+
+        with self._lock:
+            totals = None
+            for field, terms, is_phrase in clauses:
+                scores = self._clause_scores(field, terms, is_phrase)
+                if totals is None:
+                    totals = scores
+                elif match_all:
+                    totals = {d: s + scores[d] for d, s in totals.items() if d in scores}
+                else:
+                    for doc_id, score in scores.items():
+                        totals[doc_id] = totals.get(doc_id, 0.0) + score
+                if match_all and not totals:
+                    return []
+
+        ranked = sorted(totals, key=lambda d: totals[d], reverse=True)
+        return ranked[:limit] if limit else ranked
+
+    def save(self):
+        """Persist the index to `index_file` if it changed since the last save."""
+        if not self.index_file or not self.dirty:
+            return False
+        with self._lock:
+            data = {
+                "version": self.FORMAT_VERSION,
+                "postings": self.postings,
+                "lengths": self.lengths,
+                "doc_terms": self.doc_terms,
+                "fingerprints": self.fingerprints,
+                "source_version": self.source_version,
+            }
+            started = time.perf_counter()
+            try:
+                tmp_path = f"{self.index_file}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(tmp_path, self.index_file)
+                self.dirty = False
+                record_io("save", "search_index", time.perf_counter() - started, os.path.getsize(self.index_file))
+                return True
+            except Exception as e:
+                record_io("save", "search_index", time.perf_counter() - started, error=e)
+                print(f"Error saving search index: {e}")
+                return False
+
+    def load(self):
+        """Load a persisted index; returns False if it is missing or incompatible."""
+        if not self.index_file or not os.path.exists(self.index_file):
+            return False
+        started = time.perf_counter()
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+            record_io("load", "search_index", time.perf_counter() - started, os.path.getsize(self.index_file))
+            if data.get("version") != self.FORMAT_VERSION or set(data["postings"]) != set(self.FIELD_WEIGHTS):
+                return False
+            with self._lock:
+                self.postings = data["postings"]
+                self.lengths = data["lengths"]
+                self.doc_terms = data["doc_terms"]
+                self.fingerprints = data["fingerprints"]
+                self.source_version = data.get("source_version")
+                self.totals = {f: sum(self.lengths[f].values()) for f in self.FIELD_WEIGHTS}
+                self.dirty = False
+            return True
+        except Exception as e:
+            print(f"Error loading search index: {e}")
+            self._reset()
+            return False
@@ -0,0 +1,286 @@
+import json
+import mmap
+import os
+import struct
+import time
+from models.email import EmailHeader
+from services.metrics import record_io
+from utils.helpers import content_hash
+
+class EmailSnapshot:
+    """
+    Read-only columnar copy of the email collection, memory-mapped on open.
+
+    The file holds one section per column: an offset table plus a blob of
+    UTF-8 values for string columns, a byte array for flags, and the row
+    numbers sorted by id for lookups. Opening it costs the same for any
+    mailbox size; values are decoded only when a header or record is read.
+    A snapshot is tagged with the repository version it was built from and
+    is rebuilt from the repository once that no longer matches.
+    """
+
+    MAGIC = b"EMSNAP\x00\x01"
+    FORMAT_VERSION = 2
+    STRING_COLUMNS = ("id", "sender", "subject", "timestamp", "category", "message_id", "thread_id", "cluster_id",
+                      "simhash", "provenance", "body_hash", "body", "extra")
+    NULLABLE = ("category", "message_id", "thread_id", "cluster_id", "simhash")
+    # Record fields kept in their own columns; everything else goes to "extra" as JSON
+    STORED_FIELDS = ("id", "sender", "subject", "timestamp", "category", "message_id", "thread_id", "cluster_id",
+                     "simhash", "provenance", "processed", "body")
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.source_version = None
+        self._map = None
+        self._columns = {}
+
+    @staticmethod
+    def normalize_version(version):
+        """Repository versions as they compare after a JSON round trip (tuples become lists)."""
+        return json.loads(json.dumps(version))
+
+    @classmethod
+    def write(cls, path, records, source_version):
+        """Build a snapshot of `records` (an iterable of email dicts) at `path`. Returns the row count."""
+        started = time.perf_counter()
+        columns = {name: [] for name in cls.STRING_COLUMNS}
+        flags = {name: bytearray() for name in ("processed",) + cls.NULLABLE}
+        for record in records:
+            for name in ("id", "sender", "subject", "timestamp", "body"):
+                columns[name].append(record.get(name) or "")
+            for name in cls.NULLABLE:
+                value = record.get(name)
+                flags[name].append(value is None)
+                columns[name].append(value or "")
+            flags["processed"].append(bool(record.get("processed")))
+            columns["provenance"].append(json.dumps(record.get("provenance") or {}))
+            columns["body_hash"].append(content_hash(record.get("body")))
+            columns["extra"].append(json.dumps({k: v for k, v in record.items() if k not in cls.STORED_FIELDS}))
+        count = len(columns["id"])
+
+        sections = []
+        for name, values in columns.items():
+            blobs = [value.encode("utf-8") for value in values]
+            offsets = [0]
+            for blob in blobs:
+                offsets.append(offsets[-1] + len(blob))
+            sections.append((f"{name}.offsets", struct.pack(f"<{count + 1}Q", *offsets)))
+            sections.append((f"{name}.data", b"".join(blobs)))
+        for name, values in flags.items():
+            sections.append((f"{name}.flags", bytes(values)))
+        ids = columns["id"]
+        sections.append(("id.sorted", struct.pack(f"<{count}I", *sorted(range(count), key=ids.__getitem__))))
+
+        # Section offsets are relative to the end of the header, so the header can be sized first
+        layout = {}
+        position = 0
+        for name, data in sections:
+            layout[name] = [position, len(data)]
+            position += len(data) + (-len(data) % 8)
+        meta = json.dumps({
+            "format": cls.FORMAT_VERSION,
+            "count": count,
+            "source_version": source_version,
+            "sections": layout,
+        }).encode("utf-8")
+        meta += b" " * (-(len(cls.MAGIC) + 8 + len(meta)) % 8)
+
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(cls.MAGIC)
+                f.write(struct.pack("<Q", len(meta)))
+                f.write(meta)
+                for name, data in sections:
+                    f.write(data)
+                    f.write(b"\0" * (-len(data) % 8))
+            os.replace(tmp_path, path)
+        except Exception as e:
+            record_io("save", "email_snapshot", time.perf_counter() - started, error=e)
+            raise
+        record_io("save", "email_snapshot", time.perf_counter() - started, os.path.getsize(path))
+        return count
+
+    def open(self, source_version=None):
+        """
+        Map the snapshot file. Returns False if it is missing, unreadable or was
+        built from a different repository version than `source_version`.
+        """
+        if not os.path.exists(self.path):
+            return False
+        started = time.perf_counter()
+        try:
+            with open(self.path, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if mapped[:len(self.MAGIC)] != self.MAGIC:
+                return False
+            start = len(self.MAGIC) + 8
+            meta_len = struct.unpack_from("<Q", mapped, len(self.MAGIC))[0]
+            meta = json.loads(mapped[start:start + meta_len])
+            if meta.get("format") != self.FORMAT_VERSION:
+                return False
+            if meta["source_version"] != self.normalize_version(source_version):
+                return False
+        except Exception as e:
+            print(f"Error opening email snapshot: {e}")
+            return False
+
+        view = memoryview(mapped)
+        base = start + meta_len
+        columns = {}
+        for name, (offset, length) in meta["sections"].items():
+            section = view[base + offset:base + offset + length]
+            if name.endswith(".offsets"):
+                section = section.cast("Q")
+            elif name.endswith(".sorted"):
+                section = section.cast("I")
+            columns[name] = section
+        self._map = mapped
+        self._columns = columns
+        self.count = meta["count"]
+        self.source_version = meta["source_version"]
+        record_io("load", "email_snapshot", time.perf_counter() - started)
+        return True
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, name, row):
+        offsets = self._columns[f"{name}.offsets"]
+        return str(self._columns[f"{name}.data"][offsets[row]:offsets[row + 1]], "utf-8")
+
+    def _nullable(self, name, row):
+        return None if self._columns[f"{name}.flags"][row] else self._string(name, row)
+
+    def key(self, row):
+        return self._string("id", row)
+
+    def value(self, name, row):
+        """One stored string column of a row, without decoding the rest of the header."""
+        return self._nullable(name, row) if name in self.NULLABLE else self._string(name, row)
+
+    def find(self, key):
+        """Row number of the email with id `key`, or None (binary search over the sorted id table)."""
+        order = self._columns.get("id.sorted")
+        if order is None:
+            return None
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(order[low]) == key:
+            return order[low]
+        return None
+
+    def header(self, row):
+        """Decode the header of one row."""
+        return EmailHeader(
+            self.key(row),
+            self._string("sender", row),
+            self._string("subject", row),
+            self._string("timestamp", row),
+            processed=bool(self._columns["processed.flags"][row]),
+            provenance=json.loads(self._string("provenance", row)),
+            body_hash=self._string("body_hash", row),
+            **{name: self._nullable(name, row) for name in self.NULLABLE}
+        )
+
+    def record(self, row):
+        """Decode the full record of one row as a dict."""
+        record = json.loads(self._string("extra", row))
+        record.update(
+            id=self.key(row),
+            sender=self._string("sender", row),
+            subject=self._string("subject", row),
+            timestamp=self._string("timestamp", row),
+            body=self._string("body", row),
+            processed=bool(self._columns["processed.flags"][row]),
+            provenance=json.loads(self._string("provenance", row)),
+            **{name: self._nullable(name, row) for name in self.NULLABLE}
+        )
+        return record
+
+class HeaderMap:
+    """
+    Email id -> EmailHeader in inbox order. Headers come from an EmailSnapshot,
+    decoded on access, with headers added or changed since the snapshot was
+    built kept in memory on top of it.
+    """
+
+    def __init__(self, snapshot=None, headers=()):
+        self.snapshot = snapshot
+        self._changed = {}  # id -> header overriding or extending the snapshot
+        self._added = {}    # id -> position, for ids not in the snapshot
+        self._added_keys = []
+        for header in headers:
+            self[header.id] = header
+
+    def _base_count(self):
+        return len(self.snapshot) if self.snapshot else 0
+
+    def snapshot_row(self, key):
+        """Snapshot row still holding the current version of `key`, or None if it changed or is new."""
+        if self.snapshot is None or key in self._changed:
+            return None
+        return self.snapshot.find(key)
+
+    def position(self, key):
+        if key in self._added:
+            return self._base_count() + self._added[key]
+        row = self.snapshot.find(key) if self.snapshot else None
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def key_at(self, position):
+        """Id of the email at an inbox position."""
+        base = self._base_count()
+        return self.snapshot.key(position) if position < base else self._added_keys[position - base]
+
+    def __len__(self):
+        return self._base_count() + len(self._added)
+
+    def __contains__(self, key):
+        return key in self._changed or (self.snapshot is not None and self.snapshot.find(key) is not None)
+
+    def __getitem__(self, key):
+        header = self.get(key)
+        if header is None:
+            raise KeyError(key)
+        return header
+
+    def get(self, key, default=None):
+        if key in self._changed:
+            return self._changed[key]
+        row = self.snapshot.find(key) if self.snapshot else None
+        return self.snapshot.header(row) if row is not None else default
+
+    def __setitem__(self, key, header):
+        if key not in self._changed and key not in self._added and key not in self:
+            self._added[key] = len(self._added)
+            self._added_keys.append(key)
+        self._changed[key] = header
+
+    def __iter__(self):
+        for row in range(self._base_count()):
+            yield self.snapshot.key(row)
+        yield from self._added
+
+    def field_values(self, name):
+        """Yield (id, value of header field `name`) in inbox order, decoding only that field."""
+        for row in range(self._base_count()):
+            key = self.snapshot.key(row)
+            yield key, getattr(self._changed[key], name) if key in self._changed else self.snapshot.value(name, row)
+        for key in self._added:
+            yield key, getattr(self._changed[key], name)
+
+    def values(self):
+        for row in range(self._base_count()):
+            key = self.snapshot.key(row)
+            yield self._changed[key] if key in self._changed else self.snapshot.header(row)
+        for key in self._added:
+            yield self._changed[key]
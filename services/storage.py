@@ -0,0 +1,385 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from services.metrics import record_io
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Per-collection settings shared by both backends
+COLLECTIONS = {
+    "emails": {
+        "json_file": "data/mock_inbox.json",
+        "indexed_fields": ["category", "processed", "sender", "timestamp"],
+    },
+    "drafts": {
+        "json_file": "data/drafts.json",
+        "indexed_fields": ["email_id"],
+    },
+    "prompts": {
+        "json_file": "data/prompts.json",
+        "as_mapping": True,
+    },
+}
+
+class JSONRepository:
+    """
+    Stores a whole collection in one JSON file, either as a list of records
+    (keyed by `key_field`) or as a mapping of key to record. Every write
+    rewrites the file, so this backend is meant for small setups.
+
+    Changes not yet written are kept as a list of operations. If another
+    process rewrote the file since it was last read or written here, it is
+    reloaded and those operations re-applied before writing, so neither
+    process's records are lost.
+    """
+
+    def __init__(self, path, key_field="id", as_mapping=False, name=None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.key_field = key_field
+        self.as_mapping = as_mapping
+        self._records = None
+        self._version = None
+        self._pending = []  # (operation, argument) applied since the last write
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._dirty = False
+
+    def load(self):
+        """Return an ordered dict of key -> record."""
+        started = time.perf_counter()
+        with self._lock:
+            records = OrderedDict()
+            nbytes = 0
+            version = self.version()
+            try:
+                if os.path.exists(self.path):
+                    nbytes = os.path.getsize(self.path)
+                    with open(self.path, 'r') as f:
+                        data = json.load(f)
+                    if self.as_mapping:
+                        records.update(data)
+                    else:
+                        for record in data:
+                            records[record[self.key_field]] = record
+            except Exception as e:
+                record_io("load", self.name, time.perf_counter() - started, error=e)
+                raise
+            self._records = records
+            self._version = version
+            for operation, argument in self._pending:
+                self._apply(operation, argument)
+            record_io("load", self.name, time.perf_counter() - started, nbytes)
+            return OrderedDict(self._records)
+
+    def get(self, keys):
+        """Return an ordered dict of key -> record for the given keys that exist."""
+        with self._lock:
+            self._ensure_loaded()
+            return OrderedDict((key, dict(self._records[key])) for key in keys if key in self._records)
+
+    def load_fields(self, fields, derived=None):
+        """
+        Reload the collection and return key -> {field: value} for only `fields`,
+        plus `derived` values given as name -> (source field, function).
+        """
+        records = self.load()
+        derived = derived or {}
+        return OrderedDict(
+            (key, {
+                **{field: record.get(field) for field in fields},
+                **{name: func(record.get(source)) for name, (source, func) in derived.items()}
+            })
+            for key, record in records.items()
+        )
+
+    def version(self):
+        """Token that changes whenever the file is rewritten, by this process or another."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def _ensure_loaded(self):
+        if self._records is None:
+            self.load()
+
+    def _apply(self, operation, argument):
+        if operation == "upsert":
+            self._records.update(argument)
+        elif operation == "delete":
+            for key in argument:
+                self._records.pop(key, None)
+        else:
+            self._records = OrderedDict(argument)
+
+    def _change(self, operation, argument):
+        """Apply a change in memory and write it (at the end of the transaction, if in one)."""
+        if operation == "replace":
+            # Earlier changes are overwritten anyway, and there is nothing to reload
+            self._pending = []
+        else:
+            self._ensure_loaded()
+        self._apply(operation, argument)
+        self._pending.append((operation, argument))
+        self._write()
+
+    def _write(self):
+        if self._depth:
+            self._dirty = True
+            return
+        if self._pending and self._pending[0][0] != "replace" and self.version() != self._version:
+            # Another process wrote the file: start from its contents, then redo our changes
+            self.load()
+        started = time.perf_counter()
+        if self.as_mapping:
+            data = dict(self._records)
+        else:
+            data = list(self._records.values())
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f, indent=2)
+            stat = os.stat(tmp_path)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            record_io("save", self.name, time.perf_counter() - started, error=e)
+            raise
+        self._dirty = False
+        self._pending = []
+        self._version = (stat.st_mtime_ns, stat.st_size)
+        record_io("save", self.name, time.perf_counter() - started, os.path.getsize(self.path))
+
+    def upsert(self, records):
+        """Insert or replace records given as a dict of key -> record."""
+        with self._lock:
+            self._change("upsert", dict(records))
+
+    def delete(self, keys):
+        """Delete the records with the given keys."""
+        with self._lock:
+            self._change("delete", list(keys))
+
+    def save_all(self, records):
+        """Replace the whole collection."""
+        with self._lock:
+            self._change("replace", OrderedDict(records))
+
+    @contextmanager
+    def transaction(self):
+        """Group several writes into a single file rewrite."""
+        with self._lock:
+            self._depth += 1
+            try:
+                yield self
+            finally:
+                self._depth -= 1
+                if not self._depth and self._dirty:
+                    self._write()
+
+class SQLiteRepository:
+    """
+    Stores a collection as rows of a SQLite table in WAL mode. Each record is
+    kept as a JSON document, with `indexed_fields` copied into indexed columns
+    for filtering. Writes touch only the affected rows.
+    """
+
+    def __init__(self, db_path, table, indexed_fields=None):
+        self.db_path = db_path
+        self.table = table
+        self.indexed_fields = list(indexed_fields or [])
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.depth = 0
+            self._local.wrote = False
+        return conn
+
+    def _create_schema(self):
+        conn = self._connect()
+        columns = "".join(f", {field}" for field in self.indexed_fields)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, data TEXT NOT NULL{columns})")
+        for field in self.indexed_fields:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{field} ON {self.table} ({field})")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def _row(self, key, record):
+        values = [key, json.dumps(record)]
+        for field in self.indexed_fields:
+            value = record.get(field)
+            values.append(int(value) if isinstance(value, bool) else value)
+        return values
+
+    def load(self):
+        """Return an ordered dict of key -> record, in insertion order."""
+        started = time.perf_counter()
+        conn = self._connect()
+        records = OrderedDict()
+        nbytes = 0
+        for key, data in conn.execute(f"SELECT key, data FROM {self.table} ORDER BY rowid"):
+            nbytes += len(data)
+            records[key] = json.loads(data)
+        record_io("load", self.table, time.perf_counter() - started, nbytes)
+        return records
+
+    def get(self, keys):
+        """Return an ordered dict of key -> record for the given keys that exist."""
+        conn = self._connect()
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ", ".join("?" for _ in batch)
+            for key, data in conn.execute(f"SELECT key, data FROM {self.table} WHERE key IN ({placeholders})", batch):
+                found[key] = json.loads(data)
+        return OrderedDict((key, found[key]) for key in keys if key in found)
+
+    def load_fields(self, fields, derived=None):
+        """
+        Return key -> {field: value} for only `fields`, plus `derived` values given
+        as name -> (source field, function). Fields are extracted inside SQLite, so
+        large unrequested values (such as email bodies) never become Python objects.
+        """
+        started = time.perf_counter()
+        conn = self._connect()
+        derived = derived or {}
+        columns = [f"data -> '$.{field}'" for field in fields]
+        for name, (source, func) in derived.items():
+            conn.create_function(f"derive_{name}", 1, func, deterministic=True)
+            columns.append(f"derive_{name}(data ->> '$.{source}')")
+        records = OrderedDict()
+        sql = f"SELECT key, {', '.join(columns)} FROM {self.table} ORDER BY rowid"
+        for row in conn.execute(sql):
+            values = {field: json.loads(value) if value is not None else None
+                      for field, value in zip(fields, row[1:])}
+            values.update(zip(derived, row[1 + len(fields):]))
+            records[row[0]] = values
+        record_io("load_fields", self.table, time.perf_counter() - started)
+        return records
+
+    def version(self):
+        """Write counter for this table, bumped by every committed write from any process."""
+        value = self.get_meta(f"version:{self.table}")
+        return int(value) if value else 0
+
+    def count(self):
+        return self._connect().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def upsert(self, records):
+        """Insert or replace records given as a dict of key -> record."""
+        if not records:
+            return
+        columns = ["key", "data"] + self.indexed_fields
+        placeholders = ", ".join("?" for _ in columns)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        sql = (f"INSERT INTO {self.table} ({', '.join(columns)}) VALUES ({placeholders}) "
+               f"ON CONFLICT(key) DO UPDATE SET {updates}")
+        started = time.perf_counter()
+        rows = [self._row(key, record) for key, record in records.items()]
+        try:
+            with self.transaction() as conn:
+                conn.executemany(sql, rows)
+                self._local.wrote = True
+        except Exception as e:
+            record_io("save", self.table, time.perf_counter() - started, error=e)
+            raise
+        record_io("save", self.table, time.perf_counter() - started, sum(len(row[1]) for row in rows))
+
+    def delete(self, keys):
+        """Delete the records with the given keys."""
+        with self.transaction() as conn:
+            conn.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys])
+            self._local.wrote = True
+
+    def save_all(self, records):
+        """Replace the whole collection."""
+        with self.transaction() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+            self._local.wrote = True
+            self.upsert(records)
+
+    @contextmanager
+    def transaction(self):
+        """Run the enclosed writes in one transaction (nested calls join the outer one)."""
+        conn = self._connect()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        self._local.wrote = False
+        try:
+            yield conn
+            if self._local.wrote:
+                conn.execute(
+                    "INSERT INTO meta (key, value) VALUES (?, '1') "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1",
+                    (f"version:{self.table}",)
+                )
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+        finally:
+            self._local.depth = 0
+            self._local.wrote = False
+
+    def get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def migrate_json_to_sqlite(json_repository, sqlite_repository):
+    """
+    One-shot import of a JSON collection into SQLite. Runs only once per table,
+    so records deleted after the migration are not re-imported.
+    """
+    marker = f"migrated:{sqlite_repository.table}"
+    if sqlite_repository.get_meta(marker):
+        return 0
+    records = json_repository.load() if os.path.exists(json_repository.path) else {}
+    with sqlite_repository.transaction():
+        if not sqlite_repository.count():
+            sqlite_repository.upsert(records)
+        sqlite_repository.set_meta(marker, json_repository.path)
+    return len(records)
+
+def create_repository(collection, json_file=None, backend=None):
+    """
+    Build the repository for a collection. The backend comes from STORAGE_BACKEND
+    ("json" or "sqlite"); the SQLite database is migrated from the JSON file on first use.
+    """
+    config = COLLECTIONS[collection]
+    backend = (backend or os.getenv("STORAGE_BACKEND", "json")).lower()
+    json_path = os.path.join(BASE_DIR, json_file or config["json_file"])
+    json_repository = JSONRepository(json_path, as_mapping=config.get("as_mapping", False), name=collection)
+    if backend == "json":
+        return json_repository
+    if backend != "sqlite":
+        raise ValueError(f"Unknown storage backend: {backend}")
+
+    db_path = os.path.join(BASE_DIR, os.getenv("STORAGE_DB", "data/app.db"))
+    repository = SQLiteRepository(db_path, collection, config.get("indexed_fields"))
+    migrate_json_to_sqlite(json_repository, repository)
+    return repository
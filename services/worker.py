@@ -0,0 +1,128 @@
+import os
+import socket
+import threading
+import time
+
+# Job types the worker knows how to run, with the label shown in the UI
+JOB_TYPES = {
+    "process_inbox": "Process inbox",
+    "reprocess": "Reprocess stale outputs",
+    "reindex": "Rebuild search index",
+    "draft_replies": "Draft replies",
+}
+
+class Worker:
+    """
+    Runs queued jobs against the shared services, one at a time.
+
+    Used both by the standalone `worker.py` process and as a daemon thread
+    inside the Streamlit server (JOB_WORKER=embedded), so work keeps going
+    when the browser session that queued it goes away.
+    """
+
+    def __init__(self, queue, email_processor, draft_manager=None, poll_interval=1.0, heartbeat_interval=10.0,
+                 worker_id=None):
+        self.queue = queue
+        self.email_processor = email_processor
+        self._draft_manager = draft_manager
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.handlers = {
+            "process_inbox": self._process_inbox,
+            "reprocess": self._reprocess,
+            "reindex": self._reindex,
+            "draft_replies": self._draft_replies,
+        }
+        self._stop = threading.Event()
+
+    def _progress(self, job):
+        """Progress callback that writes to the queue at most twice a second."""
+        last = [0.0]
+
+        def update(done, total):
+            now = time.monotonic()
+            if done == total or now - last[0] >= 0.5:
+                last[0] = now
+                self.queue.update_progress(job.id, done, total)
+        return update
+
+    def _process_inbox(self, job):
+        count = self.email_processor.process_inbox(progress_callback=self._progress(job))
+        return {"processed": count, "remaining": len(self.email_processor.get_unprocessed_emails())}
+
+    def _reprocess(self, job):
+        count = self.email_processor.reprocess_stale(progress_callback=self._progress(job))
+        return {"processed": count, "remaining": len(self.email_processor.get_stale_emails())}
+
+    def _reindex(self, job):
+        return {"indexed": self.email_processor.reindex(progress_callback=self._progress(job))}
+
+    @property
+    def draft_manager(self):
+        """The draft store, created on the first drafting job if none was given."""
+        if self._draft_manager is None:
+            from services.draft_manager import DraftManager
+            self._draft_manager = DraftManager()
+        return self._draft_manager
+
+    def _draft_replies(self, job):
+        from services.reply_drafter import REPLY_CATEGORIES, ReplyDrafter
+        params = job.params
+        drafted, failed = ReplyDrafter(self.email_processor, self.draft_manager).draft_replies(
+            categories=params.get("categories") or REPLY_CATEGORIES,
+            instructions=params.get("instructions") or "Polite and professional.",
+            tone=params.get("tone") or "Professional",
+            progress_callback=self._progress(job)
+        )
+        return {"processed": drafted, "remaining": failed}
+
+    def run_once(self):
+        """Claim and run one job. Returns False if the queue was empty."""
+        job = self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+
+        handler = self.handlers.get(job.type)
+        if handler is None:
+            self.queue.fail(job.id, f"Unknown job type: {job.type}")
+            return True
+
+        # Keep the job claimed while it runs, however long it goes without progress
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(self.heartbeat_interval):
+                self.queue.heartbeat(job.id)
+
+        threading.Thread(target=beat, daemon=True).start()
+        try:
+            # Pick up changes another process made since our last job
+            self.email_processor.prompt_manager.refresh()
+            self.email_processor.refresh()
+            self.queue.complete(job.id, handler(job))
+        except Exception as e:
+            print(f"Job {job.id} ({job.type}) failed: {e}")
+            self.queue.fail(job.id, e)
+        finally:
+            done.set()
+        return True
+
+    def run_forever(self):
+        """Run jobs until stop() is called, polling the queue when it is empty."""
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                print(f"Worker error: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Run the worker on a daemon thread."""
+        thread = threading.Thread(target=self.run_forever, name="job-worker", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
@@ -1,11 +1,30 @@
+import hashlib
+import json
 import uuid
 import re
 from datetime import datetime
+from functools import lru_cache
+from html.parser import HTMLParser
+
+_env_loaded = False
+
+def load_env():
+    """Load variables from the .env file into the environment, once per process."""
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
 
 def generate_id():
     """Generate a unique ID."""
     return str(uuid.uuid4())
 
+def content_hash(text):
+    """Short, stable hash of a string, used to version prompts and email bodies."""
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+@lru_cache(maxsize=4096)
 def format_timestamp(timestamp_str):
     """Format ISO timestamp to human readable string."""
     try:
@@ -20,17 +39,74 @@ def sanitize_input(text):
         return ""
     return text.strip()
 
-def extract_json_from_text(text):
-    """Extract JSON object from text that might contain markdown code blocks."""
+_json_decoder = json.JSONDecoder()
+
+def parse_json_response(text):
+    """
+    Parse a JSON reply. Schema-constrained replies are plain JSON and parse directly;
+    otherwise a surrounding code fence is dropped, then the first object in the text
+    is decoded. Raises json.JSONDecodeError if there is none.
+    """
+    text = (text or "").strip()
+    if text.startswith("```"):
+        text = text[text.find("\n") + 1:] if "\n" in text else text[3:]
+        if text.rstrip().endswith("```"):
+            text = text.rstrip()[:-3]
     try:
-        # Try to find JSON inside code blocks
-        match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-        if match:
-            return match.group(1)
-        # Or just look for the first { and last }
-        match = re.search(r'\{.*\}', text, re.DOTALL)
-        if match:
-            return match.group(0)
-        return text
-    except Exception:
-        return text
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start = text.find("{")
+        if start < 0:
+            raise
+        return _json_decoder.raw_decode(text, start)[0]
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) used for rate limiting."""
+    if not text:
+        return 0
+    return max(1, len(text) // 4)
+
+def chunked(iterable, size):
+    """Yield lists of up to `size` items from any iterable without materializing it."""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class _TextExtractor(HTMLParser):
+    BLOCK_TAGS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style", "head"):
+            self._skip += 1
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style", "head"):
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+def html_to_text(html):
+    """Convert an HTML document to plain text, dropping scripts, styles and tags."""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.parts)
+    text = re.sub(r"[ \t\r\f\v]+", " ", text)
+    text = re.sub(r" ?\n ?", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
@@ -0,0 +1,46 @@
+class FieldIndex:
+    """
+    Secondary index mapping a field value to the ids of the records holding it.
+    Updates are incremental: each add/remove touches a single bucket.
+    """
+
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self._buckets = {}  # value -> {record_id: None}, an ordered set
+        self._values = {}   # record_id -> indexed value
+
+    def add(self, record_id, record):
+        """Index a record, moving it if its value changed."""
+        value = self.key_func(record)
+        if record_id in self._values:
+            if self._values[record_id] == value:
+                return
+            self.remove(record_id)
+        self._values[record_id] = value
+        self._buckets.setdefault(value, {})[record_id] = None
+
+    def remove(self, record_id):
+        """Drop a record from the index."""
+        if record_id not in self._values:
+            return
+        value = self._values.pop(record_id)
+        bucket = self._buckets.get(value)
+        if bucket is not None:
+            bucket.pop(record_id, None)
+            if not bucket:
+                del self._buckets[value]
+
+    def get(self, value):
+        """Return the ids of records with the given value."""
+        return list(self._buckets.get(value, ()))
+
+    def count(self, value):
+        return len(self._buckets.get(value, ()))
+
+    def values(self):
+        """Return the distinct indexed values."""
+        return list(self._buckets)
+
+    def clear(self):
+        self._buckets.clear()
+        self._values.clear()
@@ -0,0 +1,159 @@
+class IncrementalJSONParser:
+    """
+    Parses a JSON document that arrives in chunks (e.g. a streamed LLM reply).
+
+    The value is built while the text is scanned, so each feed() only looks at
+    the new chunk. The partial value holds every container opened so far, every
+    finished scalar and the string value still being received; incomplete keys
+    and literals are left out. Text before the first '{' or '[' (such as a
+    markdown fence) is ignored. The full text is kept for a final strict parse.
+    """
+
+    ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+    LITERALS = {"true": True, "false": False, "null": None}
+
+    def __init__(self):
+        self._chunks = []
+        self.value = None          # the root container, updated in place
+        self.complete = False
+        self.changed = False       # whether the last feed() changed the value
+        self._stack = []           # open containers, innermost last
+        self._key = None           # key waiting for its value in the innermost object
+        self._expect_key = False
+        self._string = None        # decoded pieces of the string being read this chunk
+        self._text = ""            # decoded text of that string from earlier chunks
+        self._string_is_key = False
+        self._slot = None          # (container, key or index) of a string value being read
+        self._escape = None        # "\\" after a backslash, "\\uXXXX" while reading a code point
+        self._high_surrogate = None
+        self._scalar = None        # raw text of a number or literal being read
+
+    @property
+    def buffer(self):
+        """All the text received so far."""
+        return "".join(self._chunks)
+
+    def _add(self, value):
+        """Attach a value to the innermost container and return its slot (None if dropped)."""
+        if not self._stack:
+            self.value = value
+            return None
+        container = self._stack[-1]
+        if isinstance(container, list):
+            container.append(value)
+            return container, len(container) - 1
+        if self._key is None:
+            return None
+        key, self._key = self._key, None
+        container[key] = value
+        return container, key
+
+    def _end_string(self):
+        text = self._text + "".join(self._string)
+        if self._string_is_key:
+            self._key = text
+        elif self._slot:
+            container, slot = self._slot
+            container[slot] = text
+            self.changed = True
+        self._string = None
+        self._text = ""
+        self._slot = None
+
+    def _end_scalar(self):
+        raw, self._scalar = self._scalar, None
+        if raw in self.LITERALS:
+            value = self.LITERALS[raw]
+        else:
+            try:
+                value = float(raw) if any(c in raw for c in ".eE") else int(raw)
+            except ValueError:
+                return
+        if self._add(value):
+            self.changed = True
+
+    def _read_string(self, c):
+        if self._escape is None:
+            if c == "\\":
+                self._escape = "\\"
+            elif c == '"':
+                self._end_string()
+            else:
+                self._string.append(c)
+            return
+        if self._escape == "\\" and c != "u":
+            self._string.append(self.ESCAPES.get(c, c))
+            self._escape = None
+            return
+        self._escape += c
+        if len(self._escape) < 6:
+            return
+        try:
+            code = int(self._escape[2:], 16)
+        except ValueError:
+            code = 0xFFFD
+        self._escape = None
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+            return
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        self._string.append(chr(code))
+
+    def feed(self, chunk):
+        """
+        Add a chunk of text and return the current partial value (or None). The
+        value is the parser's own object, which later chunks keep updating.
+        """
+        self._chunks.append(chunk)
+        self.changed = False
+        for c in chunk:
+            if self.complete:
+                break
+            if self._string is not None:
+                self._read_string(c)
+                continue
+            if self._scalar is not None:
+                if c not in ",]}" and not c.isspace():
+                    self._scalar += c
+                    continue
+                self._end_scalar()
+
+            if self.value is None and c not in "{[":
+                continue
+            if c == '"':
+                self._string = []
+                self._string_is_key = isinstance(self._stack[-1], dict) and self._expect_key
+                if not self._string_is_key:
+                    self._slot = self._add("")
+                    self.changed = True
+            elif c in "{[":
+                container = {} if c == "{" else []
+                self._add(container)
+                self._stack.append(container)
+                self._expect_key = c == "{"
+                self.changed = True
+            elif c in "}]":
+                self._stack.pop()
+                self._key = None
+                self._expect_key = False
+                if not self._stack:
+                    self.complete = True
+            elif c == ":":
+                self._expect_key = False
+            elif c == ",":
+                self._key = None
+                self._expect_key = isinstance(self._stack[-1], dict)
+            elif not c.isspace():
+                self._scalar = c
+
+        if self._string:
+            # Show the string value received so far
+            self._text += "".join(self._string)
+            self._string = []
+            if self._slot:
+                container, slot = self._slot
+                container[slot] = self._text
+                self.changed = True
+        return self.value
@@ -1,6 +1,5 @@
 import os
 import sys
-from dotenv import load_dotenv
 
 # Add project root to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -9,8 +8,10 @@ from services.email_processor import EmailProcessor
 from services.prompt_manager import PromptManager
 from services.draft_manager import DraftManager
 from services.llm_service import LLMService
+from utils.helpers import load_env
 
 def test_services():
+    load_env()
     print("Testing Services...")
     
     # 1. Test Prompt Manager
@@ -23,9 +24,10 @@ def test_services():
 
     # 2. Test Email Processor
     ep = EmailProcessor()
-    emails = ep.emails
-    print(f"Loaded {len(emails)} emails.")
-    assert len(emails) > 0
+    headers = ep.headers
+    print(f"Loaded {len(headers)} emails.")
+    assert len(headers) > 0
+    assert ep.get_email(headers[0].id).body is not None
     print("✅ EmailProcessor loading working.")
 
     # 3. Test Draft Manager
@@ -0,0 +1,38 @@
+import argparse
+import os
+import sys
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+
+from services.email_processor import EmailProcessor
+from services.job_queue import JobQueue
+from services.worker import JOB_TYPES, Worker
+from utils.helpers import load_env
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued background jobs (processing, reprocessing, reindexing).")
+    parser.add_argument("--enqueue", choices=sorted(JOB_TYPES), help="Queue a job before starting")
+    parser.add_argument("--once", action="store_true", help="Exit when the queue is empty instead of polling")
+    parser.add_argument("--poll", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    args = parser.parse_args()
+    load_env()
+
+    queue = JobQueue()
+    if args.enqueue:
+        job = queue.enqueue(args.enqueue)
+        print(f"Queued {args.enqueue} job {job.id}")
+
+    worker = Worker(queue, EmailProcessor(), poll_interval=args.poll)
+    print(f"👷 Worker {worker.worker_id} waiting for jobs...")
+    if args.once:
+        while worker.run_once():
+            pass
+        return
+    try:
+        worker.run_forever()
+    except KeyboardInterrupt:
+        print("Stopping worker; a running job is picked up again by the next worker.")
+
+if __name__ == "__main__":
+    main()